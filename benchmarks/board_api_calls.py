@@ -0,0 +1,103 @@
+"""
+Сколько вызовов Bot API стоит одна игра с табло.
+
+Бот работает с поддельным Bot API (benchmarks/fake_api.py), апдейты подаются
+напрямую в Application. Сценарий: /start в группе, создание игры, --players
+игроков подряд нажимают «Присоединиться» (быстрее задержки табло), затем
+--rounds раундов: ведущий выбирает ситуацию, игроки - мемы, ведущий голосует.
+Между фазами - пауза --pause, как у живых игроков.
+
+Запуск: python benchmarks/board_api_calls.py [--players 6] [--rounds 3] [--pause 0.5]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_api import FakeTelegramRequest, prepare_workdir, message_update, callback_update
+
+prepare_workdir()
+os.environ.setdefault('BOARD_DEBOUNCE', '0.3')
+os.environ.setdefault('RATE_LIMIT', '0')
+
+from telegram import Update
+import callback_codec
+from callback_codec import round_nonce
+from bot import MemesGameBot, build_application
+
+CHAT_ID = -1000000000100
+CREATOR = 1
+
+
+async def run(players, rounds, pause):
+    request = FakeTelegramRequest(latency=0.005)
+    game_bot = MemesGameBot()
+    application = build_application(game_bot, token='123456:BENCH', request=request)
+    await application.initialize()
+
+    group_messages = collections.Counter()
+
+    def on_call(method, params):
+        if method.startswith('send') and int(params.get('chat_id', 0)) == CHAT_ID:
+            group_messages[method] += 1
+
+    request.on_call = on_call
+
+    async def feed(update):
+        await application.process_update(Update.de_json(update, application.bot))
+
+    async def press(chat_id, user_id, action, arg=0):
+        game = await game_bot.games.get(CHAT_ID)
+        data = callback_codec.encode(action, CHAT_ID, round_nonce(game) if game else 0, arg)
+        await feed(callback_update(request.next_update_id(), chat_id, user_id, data))
+
+    await feed(message_update(request.next_update_id(), CHAT_ID, CREATOR, '/start'))
+    await feed(callback_update(request.next_update_id(), CHAT_ID, CREATOR,
+                               callback_codec.encode(callback_codec.START_GAME)))
+    for user_id in range(CREATOR + 1, CREATOR + players):
+        await press(CHAT_ID, user_id, callback_codec.JOIN)
+        await asyncio.sleep(0.02)
+    await asyncio.sleep(pause)
+
+    await press(CHAT_ID, CREATOR, callback_codec.BEGIN)
+    for round_number in range(1, rounds + 1):
+        await asyncio.sleep(pause)
+        game = await game_bot.games.get(CHAT_ID)
+        await press(CHAT_ID, game.leader, callback_codec.SITUATION)
+        await asyncio.sleep(pause)
+        for user_id in game.order:
+            if user_id != game.leader:
+                await press(user_id, user_id, callback_codec.MEME_CHOICE)
+        await asyncio.sleep(pause)
+        await press(game.leader, game.leader, callback_codec.VOTE)
+        await asyncio.sleep(pause)
+        last = round_number == rounds
+        await press(CHAT_ID, CREATOR, callback_codec.END_GAME if last else callback_codec.NEXT_ROUND)
+    await asyncio.sleep(pause)
+
+    total = sum(request.calls.values())
+    print(f"Игра: {players} игроков, {rounds} раундов")
+    print(f"  вызовов Bot API: {total}")
+    for method, count in request.calls.most_common():
+        print(f"    {method}: {count}")
+    print(f"  новых сообщений в группе: {sum(group_messages.values())} ({dict(group_messages)})")
+    print(f"  правок табло: {game_bot.board.edits}, слито в одну правку: {game_bot.board.coalesced}")
+
+    await application.shutdown()
+    await game_bot.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--pause', type=float, default=0.5, help='пауза между фазами, с')
+    args = parser.parse_args()
+    asyncio.run(run(args.players, args.rounds, args.pause))
+
+
+if __name__ == '__main__':
+    main()
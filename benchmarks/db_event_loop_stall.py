@@ -0,0 +1,124 @@
+"""
+Сколько event loop простаивает из-за запросов к базе под конкурентной нагрузкой.
+
+Сравниваются два режима:
+  blocking - методы Database вызываются прямо из корутин (как раньше в обработчиках)
+  async    - те же методы через AsyncDatabase (отдельный поток БД)
+
+Запуск: python benchmarks/db_event_loop_stall.py [--handlers 2000] [--users 50000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database, AsyncDatabase
+
+
+class LoopLagMonitor:
+    """Тикер, который меряет, насколько позже запланированного он просыпается"""
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def populate(db, users):
+    rows = [(i, f"user{i}", f"Имя{i}", None) for i in range(users)]
+    db.conn.executemany(
+        'INSERT OR IGNORE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)',
+        rows
+    )
+    db.conn.executemany(
+        'UPDATE users SET games_played = 1, total_score = ? WHERE user_id = ?',
+        [(random.randint(0, 500), i) for i in range(0, users, 3)]
+    )
+    db.conn.commit()
+
+
+async def blocking_handler(db, user_id):
+    db.add_user(user_id, f"user{user_id}", "Имя", None)
+    db.get_user_stats(user_id)
+    db.get_leaderboard(10)
+    await asyncio.sleep(0)
+
+
+async def async_handler(db, user_id):
+    await db.add_user(user_id, f"user{user_id}", "Имя", None)
+    await db.get_user_stats(user_id)
+    await db.get_leaderboard(10)
+
+
+async def run_mode(mode, db_path, handlers, users):
+    sync_db = Database(db_path)
+    db = sync_db if mode == 'blocking' else AsyncDatabase(sync_db)
+    handler = blocking_handler if mode == 'blocking' else async_handler
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(db, random.randrange(users * 2)) for _ in range(handlers)))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    if mode == 'async':
+        await db.close()
+    else:
+        sync_db.close()
+
+    lags = sorted(monitor.lags) or [0.0]
+    return {
+        'mode': mode,
+        'elapsed_s': elapsed,
+        'ticks': len(monitor.lags),
+        'lag_p50_ms': statistics.median(lags) * 1000,
+        'lag_p99_ms': lags[int(len(lags) * 0.99) - 1 if len(lags) > 1 else 0] * 1000,
+        'lag_max_ms': lags[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = Database(db_path)
+        populate(db, args.users)
+        db.close()
+
+        for mode in ('blocking', 'async'):
+            result = asyncio.run(run_mode(mode, db_path, args.handlers, args.users))
+            print(f"{result['mode']:>8}: {args.handlers} обработчиков за {result['elapsed_s']:.2f}с, "
+                  f"тиков loop {result['ticks']}, "
+                  f"задержка loop p50 {result['lag_p50_ms']:.2f}мс, "
+                  f"p99 {result['lag_p99_ms']:.2f}мс, макс {result['lag_max_ms']:.2f}мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Стоимость дедлайнов фаз для большого числа одновременных игр.
+
+Сравниваются два режима:
+  tasks     - по задаче asyncio.sleep на игру, смена фазы отменяет задачу и создает новую
+  scheduler - DeadlineScheduler: одна куча и одна задача на все игры
+
+Для каждой игры дедлайн ставится, затем переставляется (смена фазы), у половины
+игр отменяется (фаза закончилась раньше), остальные срабатывают в течение --spread
+секунд. Меряются время постановки, память и опоздание срабатывания.
+
+Запуск: python benchmarks/deadline_timers.py [--games 100000] [--spread 2.0]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deadline_scheduler import DeadlineScheduler
+
+
+class TaskTimers:
+    """Наивный вариант: отдельная задача на каждую игру"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.tasks = {}
+
+    async def _sleep_then_fire(self, key, when, token):
+        await asyncio.sleep(when - time.time())
+        self.tasks.pop(key, None)
+        await self.callback(key, token)
+
+    def schedule(self, key, when, token=None):
+        self.cancel(key)
+        self.tasks[key] = asyncio.get_running_loop().create_task(self._sleep_then_fire(key, when, token))
+
+    def cancel(self, key):
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+
+async def run_mode(mode, games, spread):
+    lateness = []
+    done = asyncio.Event()
+    expected = games - games // 2
+
+    async def on_deadline(key, when):
+        lateness.append(time.time() - when)
+        if len(lateness) >= expected:
+            done.set()
+
+    tracemalloc.start()
+    timers = TaskTimers(on_deadline) if mode == 'tasks' else DeadlineScheduler(on_deadline)
+
+    started = time.perf_counter()
+    # Запас, чтобы дедлайны не наступили, пока идет постановка
+    base = time.time() + 8.0
+    for key in range(games):
+        when = base + spread * 2
+        timers.schedule(key, when, when)
+    schedule_s = time.perf_counter() - started
+
+    # Смена фазы: у каждой игры новый дедлайн, у половины фаза кончается раньше
+    started = time.perf_counter()
+    for key in range(games):
+        when = base + random.uniform(0, spread)
+        timers.schedule(key, when, when)
+    for key in range(0, games, 2):
+        timers.cancel(key)
+    reschedule_s = time.perf_counter() - started
+
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+    await asyncio.wait_for(done.wait(), timeout=spread + 60)
+    await timers.close()
+
+    lateness.sort()
+    return {
+        'schedule_s': schedule_s,
+        'reschedule_s': reschedule_s,
+        'memory_mb': memory_mb,
+        'fired': len(lateness),
+        'late_p50_ms': statistics.median(lateness) * 1000,
+        'late_p99_ms': lateness[int(len(lateness) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--spread', type=float, default=2.0, help='разброс дедлайнов, с')
+    args = parser.parse_args()
+
+    for mode in ('tasks', 'scheduler'):
+        result = asyncio.run(run_mode(mode, args.games, args.spread))
+        print(f"{mode:>9}: постановка {result['schedule_s']:.2f}с, "
+              f"перестановка+отмена {result['reschedule_s']:.2f}с, "
+              f"память {result['memory_mb']:.1f}МБ, сработало {result['fired']}, "
+              f"опоздание p50 {result['late_p50_ms']:.1f}мс, p99 {result['late_p99_ms']:.1f}мс")
+
+
+if __name__ == '__main__':
+    main()
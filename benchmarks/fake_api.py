@@ -0,0 +1,229 @@
+"""
+Поддельный Telegram Bot API для бенчмарков.
+
+FakeTelegramRequest подключается к Application вместо настоящего HTTP-клиента:
+отвечает на методы Bot API правдоподобными объектами, имитирует задержку сети,
+считает вызовы и умеет отдавать синтетические апдейты через getUpdates.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.request import BaseRequest
+
+
+def prepare_workdir():
+    """
+    Временная рабочая папка с мемами и ситуациями из репозитория и отдельной базой.
+    Вызывать до импорта config/bot: пути в Config относительные.
+    """
+    workdir = tempfile.mkdtemp(prefix='memes-bench-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.symlink(os.path.join(ROOT, 'data', 'memes'), os.path.join(workdir, 'data', 'memes'))
+    shutil.copy(os.path.join(ROOT, 'data', 'situations.txt'), os.path.join(workdir, 'data', 'situations.txt'))
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return workdir
+
+
+def chat_type(chat_id):
+    return 'private' if chat_id > 0 else 'supergroup'
+
+
+def message_update(update_id, chat_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type(chat_id)},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Игрок{user_id}"},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            if text.startswith('/') else []
+        }
+    }
+
+
+def callback_update(update_id, chat_id, user_id, data, message_id=1):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(chat_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Игрок{user_id}"},
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': chat_type(chat_id)},
+                'text': '...'
+            }
+        }
+    }
+
+
+class FloodControl:
+    """
+    Лимиты Telegram в виде токен-бакетов (чуть мягче, чем у RateLimiter бота):
+    при превышении метод отвечает 429 с retry_after, как настоящий Bot API
+    """
+    LIMITS = {'private': (1.0, 5), 'group': (20 / 60, 10), 'global': (30.0, 40)}  # токенов в секунду, запас
+
+    def __init__(self):
+        self.buckets = {}  # ключ -> [токены, время]
+
+    def _take(self, key, kind):
+        rate, capacity = self.LIMITS[kind]
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.buckets[key] = [tokens, now]
+            return int((1 - tokens) / rate) + 1
+        self.buckets[key] = [tokens - 1, now]
+        return 0
+
+    def retry_after(self, method, params):
+        if method in ('getMe', 'getWebhookInfo', 'setWebhook', 'deleteWebhook'):
+            return 0
+        wait = self._take('global', 'global')
+        if wait:
+            return wait
+        chat_id = params.get('chat_id')
+        if chat_id is None:
+            return 0
+        chat_id = int(chat_id)
+        return self._take(chat_id, 'private' if chat_id > 0 else 'group')
+
+
+class FakeTelegramRequest(BaseRequest):
+    def __init__(self, latency=0.0, jitter=0.0, delivery_latency=0.0, flood_control=False):
+        self.latency = latency
+        self.jitter = jitter
+        # Сетевая задержка в одну сторону для getUpdates: запрос и ответ long polling
+        self.delivery_latency = delivery_latency
+        self.calls = collections.Counter()
+        self.flood = FloodControl() if flood_control else None
+        self.flood_errors = 0
+        self.on_call = None           # callback(method, params) после каждого вызова
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates = []
+        self._updates_ready = asyncio.Event()
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def next_update_id(self):
+        return next(self._update_ids)
+
+    def push_update(self, update):
+        """Положить апдейт в очередь getUpdates (режим polling)"""
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        if self.delivery_latency:
+            await asyncio.sleep(self.delivery_latency)
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout=timeout or 0.01)
+            except asyncio.TimeoutError:
+                pass
+        if self.delivery_latency:
+            await asyncio.sleep(self.delivery_latency)
+        return self._updates[:100]
+
+    def _message(self, params, **extra):
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': chat_type(chat_id)},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        message.update(extra)
+        return message
+
+    def _video(self):
+        n = next(self._file_ids)
+        return {'file_id': f"video{n}", 'file_unique_id': f"uv{n}", 'width': 480, 'height': 480, 'duration': 5}
+
+    def _photo(self):
+        n = next(self._file_ids)
+        return [{'file_id': f"photo{n}", 'file_unique_id': f"up{n}", 'width': 640, 'height': 640}]
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'):
+            if 'inline_message_id' in params:
+                return True
+            return self._message(params)
+        if method == 'sendVideo':
+            return self._message(params, video=self._video())
+        if method in ('sendPhoto', 'editMessageMedia'):
+            return self._message(params, photo=self._photo())
+        if method == 'sendMediaGroup':
+            media = params.get('media', [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [
+                self._message(params, **({'video': self._video()} if item.get('type') == 'video'
+                                         else {'photo': self._photo()}))
+                for item in media
+            ]
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if api_method == 'getUpdates':
+            result = await self._get_updates(params)
+        else:
+            delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            retry_after = self.flood.retry_after(api_method, params) if self.flood else 0
+            if retry_after:
+                self.flood_errors += 1
+                return 429, json.dumps({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {retry_after}",
+                    'parameters': {'retry_after': retry_after}
+                }).encode('utf-8')
+            result = self._result(api_method, params)
+            self.calls[api_method] += 1
+            if self.on_call is not None:
+                self.on_call(api_method, params)
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
@@ -0,0 +1,116 @@
+"""
+Память на одну игру: модель Game/Player со __slots__ против прежних вложенных словарей.
+
+Создается --games игр по --players игроков в фазе голосования: у каждого игрока
+рука из MEMES_PER_PLAYER мемов и отправленный мем. Каждый режим запускается
+в отдельном процессе, чтобы RSS не смешивался.
+
+Запуск: python benchmarks/game_memory.py [--games 100000] [--players 6]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from game_state import Game
+
+CATALOG_SIZE = 5000
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def make_catalog():
+    # Записи каталога общие для всех игр в обоих режимах
+    return [
+        {'index': i, 'filename': f"meme{i}.jpg", 'path': os.path.join('data', 'memes', f"meme{i}.jpg"),
+         'size': 100000 + i, 'mtime': 1700000000 + i, 'media_type': 'photo'}
+        for i in range(CATALOG_SIZE)
+    ]
+
+
+def make_dict_game(catalog, players, rng):
+    # Структура игры до перехода на модель
+    player_ids = [rng.randrange(10 ** 9) for _ in range(players)]
+    leader = player_ids[0]
+    hands = {pid: [catalog[rng.randrange(CATALOG_SIZE)] for _ in range(Config.MEMES_PER_PLAYER)]
+             for pid in player_ids if pid != leader}
+    submitted = {pid: {'meme': hand[0], 'player_name': f"Игрок{pid}"} for pid, hand in hands.items()}
+    return {
+        'players': player_ids,
+        'player_names': {pid: f"Игрок{pid}" for pid in player_ids},
+        'status': 'voting',
+        'leader': leader,
+        'round_number': 3,
+        'scores': {pid: rng.randrange(5) for pid in player_ids},
+        'submitted_memes': submitted,
+        'voting_options': {str(uuid.uuid4())[:8]: pid for pid in submitted},
+        'hands': hands,
+        'situations': [],
+        'current_situation': "Ситуация",
+        'session_id': 1,
+        'deadline': time.time(),
+        'idle_rounds': 0,
+        'nonce': rng.randrange(1 << 16),
+    }
+
+
+def make_model_game(catalog, players, rng):
+    game = Game('voting', rng.randrange(1 << 16))
+    for _ in range(players):
+        pid = rng.randrange(10 ** 9)
+        game.add_player(pid, f"Игрок{pid}").score = rng.randrange(5)
+    game.rerank()
+    game.start_round("Ситуация", {
+        pid: [rng.randrange(CATALOG_SIZE) for _ in range(Config.MEMES_PER_PLAYER)]
+        for pid in game.order if pid != game.leader
+    })
+    for pid in game.order[1:]:
+        game.submit(pid, 0)
+    game.voting_options = list(game.submitted)
+    game.round_number = 3
+    game.session_id = 1
+    game.deadline = time.time()
+    return game
+
+
+def measure(mode, games, players):
+    rng = random.Random(1)
+    catalog = make_catalog()
+    make = make_dict_game if mode == 'dicts' else make_model_game
+    before = rss_mb()
+    started = time.perf_counter()
+    active_games = {-(10 ** 12) - i: make(catalog, players, rng) for i in range(games)}
+    elapsed = time.perf_counter() - started
+    after = rss_mb()
+    print(f"{mode:>6}: {len(active_games)} игр за {elapsed:.2f}с, "
+          f"RSS {after:.0f}МБ (+{after - before:.0f}МБ), "
+          f"{(after - before) * 1024 * 1024 / games:.0f} байт на игру")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--mode', choices=('dicts', 'model'))
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args.games, args.players)
+        return
+
+    for mode in ('dicts', 'model'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                        '--games', str(args.games), '--players', str(args.players)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Нагрузочный тест обработчиков: сколько одновременных игр держит один процесс.
+
+Обработчики MemesGameBot вызываются напрямую, без Application и очереди апдейтов:
+start_game, join_game, begin_game, choose_situation, handle_meme_choice,
+handle_vote, next_round_auto, end_game. Бот - настоящий ExtBot поверх поддельного
+Bot API (benchmarks/fake_api.py) с задержкой --api-latency ± --jitter.
+
+Каждая из --games игр стартует в течение --ramp секунд и играет --rounds раундов
+по --players игроков; между действиями - пауза --think (±50%), как у живых игроков.
+Отчет: пропускная способность, p50/p95/p99 задержки каждого обработчика,
+вызовы Bot API на раунд и задержка event loop (насколько опаздывает sleep).
+
+Результаты сохраняются в benchmarks/results/handler_load-<время>.json и
+сравниваются с предыдущим сохраненным прогоном с теми же параметрами
+(или с файлом --compare).
+
+Запуск: python benchmarks/handler_load.py [--games 2000] [--players 4] [--rounds 3]
+        [--api-latency 0.05] [--jitter 0.02] [--think 0.5] [--ramp 5] [--compare FILE]
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, BENCH_DIR)
+
+from fake_api import ROOT, FakeTelegramRequest, prepare_workdir, message_update, callback_update
+
+prepare_workdir()
+# Меряются обработчики, а не лимиты Telegram (их меряет benchmarks/rate_limits.py)
+os.environ.setdefault('RATE_LIMIT', '0')
+
+from telegram import Update
+from telegram.ext import ExtBot
+import callback_codec
+from callback_codec import round_nonce
+from bot import AnsweredQuery, MemesGameBot
+from state_store import StateConflict
+from config import Config
+import log_setup
+
+# Порядок строк в отчете
+HANDLERS = ('start_game', 'join_game', 'begin_game', 'choose_situation',
+            'handle_meme_choice', 'handle_vote', 'next_round_auto', 'end_game')
+
+
+class ErrorCounter(logging.Handler):
+    """Считает записи уровня ERROR: лог бота во время нагрузки уходит в /dev/null"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+
+def pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summary(values):
+    return {
+        'count': len(values),
+        'p50': pct(values, 0.50),
+        'p95': pct(values, 0.95),
+        'p99': pct(values, 0.99),
+        'max': max(values, default=0.0),
+    }
+
+
+class Harness:
+    def __init__(self, players, rounds, think):
+        self.request = None
+        self.bot = None
+        self.game_bot = None
+        self.players = players
+        self.rounds = rounds
+        self.think = think
+        self.latency = collections.defaultdict(list)
+        self.rounds_played = 0
+        self.games_finished = 0
+
+    async def setup(self, api_latency, jitter):
+        self.request = FakeTelegramRequest(latency=api_latency, jitter=jitter)
+        self.bot = ExtBot('123456:LOAD', request=self.request, get_updates_request=self.request)
+        await self.bot.initialize()
+        self.game_bot = MemesGameBot()
+
+    async def pause(self):
+        if self.think:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.think)
+
+    async def timed(self, name, handler, *args):
+        # Как handle_callback: конфликт состояния - повтор на свежей игре
+        started = time.perf_counter()
+        for _ in range(Config.STATE_CONFLICT_RETRIES):
+            try:
+                await handler(*args)
+                break
+            except StateConflict:
+                pass
+        self.latency[name].append(time.perf_counter() - started)
+
+    def query(self, chat_id, user_id, action, game=None, arg=0, group_id=None):
+        if action in callback_codec.GAME_ACTIONS:
+            data = callback_codec.encode(action, group_id, round_nonce(game), arg)
+        else:
+            data = callback_codec.encode(action)
+        update = Update.de_json(callback_update(self.request.next_update_id(), chat_id, user_id, data), self.bot)
+        return AnsweredQuery(update.callback_query), callback_codec.decode(data)
+
+    async def press(self, name, handler, chat_id, user_id, action, game=None, arg=0, group_id=None):
+        query, data = self.query(chat_id, user_id, action, game, arg, group_id)
+        if action in callback_codec.GAME_ACTIONS:
+            await self.timed(name, handler, query, data)
+        else:
+            await self.timed(name, handler, query)
+        await query.answer()
+
+    async def play(self, g, ramp):
+        game_bot = self.game_bot
+        chat_id = -(10 ** 12) - g
+        user_ids = [g * 100 + p + 1 for p in range(self.players)]
+        await asyncio.sleep(random.uniform(0, ramp))
+
+        await self.press('start_game', game_bot.start_game, chat_id, user_ids[0], callback_codec.START_GAME)
+        for user_id in user_ids[1:]:
+            await self.pause()
+            update = Update.de_json(message_update(self.request.next_update_id(), user_id, user_id,
+                                                   f"/join {chat_id}"), self.bot)
+            context = types.SimpleNamespace(args=[str(chat_id)], bot=self.bot)
+            await self.timed('join_game', game_bot.join_game, update, context)
+
+        await self.pause()
+        game = await game_bot.games.get(chat_id)
+        await self.press('begin_game', game_bot.begin_game, chat_id, user_ids[0],
+                         callback_codec.BEGIN, game, group_id=chat_id)
+
+        for round_number in range(1, self.rounds + 1):
+            await self.pause()
+            game = await game_bot.games.get(chat_id)
+            await self.press('choose_situation', game_bot.choose_situation, chat_id, game.leader,
+                             callback_codec.SITUATION, game, group_id=chat_id)
+
+            # Игроки выбирают мемы вразнобой; последний выбор запускает голосование
+            game = await game_bot.games.get(chat_id)
+            choosers = [user_id for user_id in game.order if user_id != game.leader]
+
+            async def choose(user_id):
+                await self.pause()
+                await self.press('handle_meme_choice', game_bot.handle_meme_choice, user_id, user_id,
+                                 callback_codec.MEME_CHOICE, game, group_id=chat_id)
+
+            await asyncio.gather(*(choose(user_id) for user_id in choosers))
+
+            await self.pause()
+            game = await game_bot.games.get(chat_id)
+            await self.press('handle_vote', game_bot.handle_vote, game.leader, game.leader,
+                             callback_codec.VOTE, game, group_id=chat_id)
+            self.rounds_played += 1
+
+            await self.pause()
+            game = await game_bot.games.get(chat_id)
+            if round_number < self.rounds:
+                await self.timed('next_round_auto', game_bot.next_round_auto, chat_id, game, self.bot)
+            else:
+                await self.press('end_game', game_bot.end_game, chat_id, user_ids[0],
+                                 callback_codec.END_GAME, game, group_id=chat_id)
+        if await game_bot.games.get(chat_id) is None:
+            self.games_finished += 1
+
+    async def close(self):
+        # Дать отложенным правкам табло уйти, затем закрыть как post_shutdown
+        await asyncio.sleep(Config.BOARD_DEBOUNCE + 0.1)
+        await self.game_bot.deadlines.close()
+        await self.game_bot.board.close()
+        await self.game_bot.games.close()
+        await self.game_bot.db.close()
+        await self.bot.shutdown()
+
+
+async def sample_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+async def run(args):
+    harness = Harness(args.players, args.rounds, args.think)
+    await harness.setup(args.api_latency, args.jitter)
+    lag = []
+    sampler = asyncio.create_task(sample_loop_lag(lag))
+
+    # Записи по-прежнему форматируются (как в продакшене), но не печатаются
+    log_setup.setup_logging(stream=open(os.devnull, 'w'))
+    log = ErrorCounter()
+    logging.getLogger().addHandler(log)
+    started = time.perf_counter()
+    await asyncio.gather(*(harness.play(g, args.ramp) for g in range(args.games)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    await harness.close()
+    logging.getLogger().removeHandler(log)
+
+    calls = dict(harness.request.calls)
+    calls.pop('getMe', None)
+    rounds = max(harness.rounds_played, 1)
+    handler_calls = sum(len(values) for values in harness.latency.values())
+    return {
+        'params': {name: getattr(args, name) for name in
+                   ('games', 'players', 'rounds', 'api_latency', 'jitter', 'think', 'ramp')},
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'elapsed': elapsed,
+        'games_finished': harness.games_finished,
+        'rounds_played': harness.rounds_played,
+        'log_errors': log.errors,
+        'throughput': {
+            'handlers_per_sec': handler_calls / elapsed,
+            'rounds_per_sec': harness.rounds_played / elapsed,
+            'games_per_sec': harness.games_finished / elapsed,
+        },
+        'handlers': {name: summary(harness.latency[name]) for name in HANDLERS},
+        'api_calls_per_round': sum(calls.values()) / rounds,
+        'api_methods_per_round': {method: count / rounds for method, count in sorted(calls.items())},
+        'loop_lag': summary(lag),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_baseline(params):
+    """Последний сохраненный прогон с теми же параметрами"""
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, 'handler_load-*.json')), reverse=True):
+        with open(path, encoding='utf-8') as f:
+            result = json.load(f)
+        if result.get('params') == params:
+            return path, result
+    return None, None
+
+
+def delta(new, old):
+    if not old:
+        return ''
+    return f" ({(new - old) / old * 100:+.0f}%)"
+
+
+def report(result, baseline=None):
+    base = baseline or {}
+    base_handlers = base.get('handlers', {})
+    throughput = result['throughput']
+    print(f"Игр: {result['params']['games']} x {result['params']['players']} игроков x "
+          f"{result['params']['rounds']} раундов за {result['elapsed']:.1f}с "
+          f"(завершено {result['games_finished']}, ошибок в логе: {result['log_errors']})")
+    print(f"  обработчиков в секунду: {throughput['handlers_per_sec']:.0f}"
+          f"{delta(throughput['handlers_per_sec'], base.get('throughput', {}).get('handlers_per_sec'))}, "
+          f"раундов в секунду: {throughput['rounds_per_sec']:.1f}")
+    print(f"  {'обработчик':<20} {'вызовов':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'макс':>8}")
+    for name, stats in result['handlers'].items():
+        line = (f"  {name:<20} {stats['count']:>8} {stats['p50'] * 1000:>6.0f}мс {stats['p95'] * 1000:>6.0f}мс "
+                f"{stats['p99'] * 1000:>6.0f}мс {stats['max'] * 1000:>6.0f}мс")
+        if name in base_handlers:
+            line += f"  p95{delta(stats['p95'], base_handlers[name]['p95'])}"
+        print(line)
+    print(f"  вызовов Bot API на раунд: {result['api_calls_per_round']:.1f}"
+          f"{delta(result['api_calls_per_round'], base.get('api_calls_per_round'))}")
+    print("    " + ", ".join(f"{method} {count:.1f}" for method, count in result['api_methods_per_round'].items()))
+    lag = result['loop_lag']
+    print(f"  задержка event loop: p50 {lag['p50'] * 1000:.1f}мс, p99 {lag['p99'] * 1000:.1f}мс, "
+          f"макс {lag['max'] * 1000:.0f}мс"
+          f"{'  p99' + delta(lag['p99'], base['loop_lag']['p99']) if base else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--api-latency', type=float, default=0.05, help='задержка Bot API, с')
+    parser.add_argument('--jitter', type=float, default=0.02, help='случайная добавка к задержке, с')
+    parser.add_argument('--think', type=float, default=0.5, help='пауза игрока между действиями, с')
+    parser.add_argument('--ramp', type=float, default=5.0, help='за сколько секунд стартуют все игры')
+    parser.add_argument('--compare', help='файл прошлого прогона для сравнения')
+    parser.add_argument('--no-save', action='store_true', help='не сохранять результат')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    if args.compare:
+        baseline_path = args.compare
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    else:
+        baseline_path, baseline = find_baseline(result['params'])
+    report(result, baseline)
+    if baseline:
+        print(f"  сравнение с {os.path.relpath(baseline_path, ROOT)} ({baseline.get('commit')})")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"handler_load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"  сохранено: {os.path.relpath(path, ROOT)}")
+
+
+if __name__ == '__main__':
+    main()
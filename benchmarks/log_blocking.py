@@ -0,0 +1,94 @@
+"""
+Сколько event loop стоит лог при медленном stdout (лог-дрейн, pipe).
+
+stdout - pipe, который читатель разбирает по --drain-kb КБ раз в 10 мс.
+--handlers обработчиков одновременно пишут по --lines строк, как обработчики
+бота на нажатие кнопки. Сравниваются два режима:
+  print   - print() прямо из корутин (как раньше в боте)
+  logging - logging через log_setup: очередь и отдельный поток записи (JSON)
+
+Запуск: python benchmarks/log_blocking.py [--handlers 500] [--lines 20] [--drain-kb 4]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_event_loop_stall import LoopLagMonitor
+import log_setup
+
+logger = logging.getLogger('bench')
+
+
+class SlowPipe:
+    """Pipe с медленным читателем: запись блокируется, когда буфер ядра полон"""
+
+    def __init__(self, drain_kb):
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb', buffering=0)
+        self.writer = os.fdopen(write_fd, 'w', encoding='utf-8', buffering=1)
+        self.drain = drain_kb * 1024
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        while self.reader.read(self.drain):
+            time.sleep(0.01)
+
+    def close(self):
+        self.writer.close()
+        self.thread.join()
+
+
+async def handler(mode, i, lines, stream):
+    started = time.perf_counter()
+    for line in range(lines):
+        if mode == 'print':
+            print(f"✅ Игрок {i} выбрал мем {line} в игре {-i}", file=stream)
+        else:
+            logger.info("✅ Игрок %s выбрал мем %s в игре %s", i, line, -i)
+        await asyncio.sleep(0)
+    return time.perf_counter() - started
+
+
+async def run(mode, handlers, lines, drain_kb):
+    pipe = SlowPipe(drain_kb)
+    if mode == 'logging':
+        log_setup.setup_logging(level='INFO', fmt='json', stream=pipe.writer)
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    durations = await asyncio.gather(*(handler(mode, i, lines, pipe.writer) for i in range(handlers)))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    if mode == 'logging':
+        # Дождаться, пока поток допишет очередь в pipe: время вне event loop
+        log_setup.setup_logging(stream=open(os.devnull, 'w'))
+    pipe.close()
+
+    lags = sorted(monitor.lags) or [0.0]
+    print(f"{mode:>8}: обработчики за {elapsed:.2f}с, медиана обработчика {statistics.median(durations) * 1000:.0f}мс, "
+          f"задержка loop p99 {lags[int(len(lags) * 0.99)] * 1000:.1f}мс, макс {lags[-1] * 1000:.0f}мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=20)
+    parser.add_argument('--drain-kb', type=int, default=4, help='сколько КБ читатель забирает за 10 мс')
+    args = parser.parse_args()
+
+    for mode in ('print', 'logging'):
+        asyncio.run(run(mode, args.handlers, args.lines, args.drain_kb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Библиотека мемов на --memes файлов: индекс в SQLite (meme_index.py) и раздача.
+
+Во временной папке создаются пустые файлы с именами вперемешку кириллицей
+и транслитом (доля --videos - .mp4, остальные .jpg). Замеряются:
+1. Импорт: первый скан в пустой индекс, повторный без изменений
+   (по mtime папки и принудительный), скан после добавления --added файлов.
+2. Пулы раздачи: вся библиотека, по типу и по тегу (SQL-запрос и память).
+3. Раздача --chats чатам по --players рук в раунд: время на руку и память колод.
+   Сравнение с прежней колодой - перемешанной копией всей библиотеки на чат
+   (на --baseline-chats чатах: тысяча таких копий не помещается в память).
+4. Мем по индексу: из LRU каталога и из индекса.
+
+Запуск: python benchmarks/meme_library.py [--memes 100000] [--chats 1000] [--baseline-chats 20]
+        [--rounds 20]
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from meme_catalog import MemeCatalog
+from meme_deck import MemeDeck
+from meme_index import MemeIndex
+
+WORDS = ['кот', 'kot', 'собака', 'sobaka', 'шок', 'shok', 'работа', 'rabota', 'понедельник',
+         'ponedelnik', 'начальник', 'nachalnik', 'кофе', 'kofe', 'дедлайн', 'deadline', 'пятница',
+         'pyatnitsa', 'отпуск', 'otpusk', 'зарплата', 'zarplata', 'баг', 'релиз', 'reliz', 'тест']
+
+
+class ListDeck:
+    """Прежняя колода: перемешанная копия всей библиотеки на каждый чат"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._cards = []
+        self._position = 0
+        self._round_cards = set()
+
+    def new_round(self):
+        self._round_cards = set()
+
+    def draw(self, count):
+        hand = []
+        while len(hand) < count:
+            if self._position >= len(self._cards):
+                self._cards = [index for index in self.catalog.pool() if index not in self._round_cards]
+                random.shuffle(self._cards)
+                self._position = 0
+            index = self._cards[self._position]
+            self._position += 1
+            if index not in hand:
+                hand.append(index)
+                self._round_cards.add(index)
+        return hand
+
+
+def make_library(memes_dir, count, videos, start=0, rng=random):
+    for number in range(start, start + count):
+        name = "-".join(rng.sample(WORDS, 3))
+        ext = '.mp4' if rng.random() < videos else '.jpg'
+        with open(os.path.join(memes_dir, f"{name}-{number}{ext}"), 'wb'):
+            pass
+
+
+def timed(action):
+    started = time.perf_counter()
+    result = action()
+    return time.perf_counter() - started, result
+
+
+def bench_import(memes_dir, db_path, added, videos):
+    index = MemeIndex(db_path)
+    elapsed, catalog = timed(lambda: MemeCatalog(memes_dir, index))
+    print(f"Первый импорт: {len(catalog)} мемов за {elapsed:.2f}с")
+
+    elapsed, _ = timed(catalog.refresh)
+    print(f"Обновление без изменений (mtime папки тот же): {elapsed * 1e6:.0f}мкс")
+    elapsed, _ = timed(lambda: catalog.refresh(force=True))
+    print(f"Принудительный скан без изменений: {elapsed * 1000:.0f}мс")
+
+    make_library(memes_dir, added, videos, start=len(catalog))
+    elapsed, _ = timed(catalog.refresh)
+    print(f"Скан после добавления {added} файлов: {elapsed * 1000:.0f}мс, в каталоге {len(catalog)}")
+
+    # Перезапуск бота: каталог поднимается из индекса без скана
+    elapsed, restarted = timed(lambda: MemeCatalog(memes_dir, MemeIndex(db_path)))
+    print(f"Старт каталога из индекса: {elapsed * 1000:.0f}мс")
+    restarted.index.close()
+    return catalog
+
+
+def bench_pools(catalog):
+    for label, media_type, tag in (("вся библиотека", None, None), ("video", 'video', None),
+                                   ("тег 'кот'", None, 'кот'), ("photo + тег 'rabota'", 'photo', 'rabota')):
+        elapsed, pool = timed(lambda: catalog.index.pool(media_type, tag))
+        catalog.pool(media_type, tag)
+        cached, _ = timed(lambda: catalog.pool(media_type, tag))
+        print(f"  пул {label:<22} {len(pool):>7} мемов: запрос {elapsed * 1000:6.1f}мс, "
+              f"{pool.itemsize * len(pool) / 1024:6.0f}КБ, из каталога {cached * 1e6:.1f}мкс")
+
+
+def deal_rounds(catalog, make_deck, chats, players, rounds, durations=None):
+    decks = {}
+    for _ in range(rounds):
+        for chat_id in range(chats):
+            deck = decks.get(chat_id)
+            if deck is None:
+                deck = decks[chat_id] = make_deck(catalog)
+            deck.new_round()
+            for _ in range(players):
+                started = time.perf_counter()
+                deck.draw(Config.MEMES_PER_PLAYER)
+                if durations is not None:
+                    durations.append(time.perf_counter() - started)
+    return decks
+
+
+def bench_deal(catalog, make_deck, chats, players, rounds):
+    catalog.pool()
+    durations = []
+    deal_rounds(catalog, make_deck, chats, players, rounds, durations)
+    # Память - отдельным прогоном: tracemalloc замедляет раздачу
+    tracemalloc.start()
+    decks = deal_rounds(catalog, make_deck, chats, players, rounds)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del decks
+    durations.sort()
+    return (statistics.mean(durations) * 1e6, durations[int(len(durations) * 0.99)] * 1e6,
+            durations[-1] * 1000, memory / chats / 1024)
+
+
+def bench_get(catalog):
+    pool = catalog.pool()
+    ids = random.sample(list(pool), min(20000, len(pool)))
+    catalog._cache.clear()
+    cold, _ = timed(lambda: [catalog.get(index) for index in ids])
+    hot_ids = ids[-Config.MEME_CACHE_SIZE // 2:]
+    hot, _ = timed(lambda: [catalog.get(index) for index in hot_ids])
+    print(f"Мем по индексу: из индекса {cold / len(ids) * 1e6:.1f}мкс, из LRU {hot / len(hot_ids) * 1e6:.2f}мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memes', type=int, default=100000)
+    parser.add_argument('--videos', type=float, default=0.3, help='доля видео')
+    parser.add_argument('--added', type=int, default=100, help='сколько файлов добавить для инкрементального скана')
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--baseline-chats', type=int, default=20, help='чатов для прежней колоды')
+    parser.add_argument('--players', type=int, default=5, help='рук в раунд на чат')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='memes-library-')
+    try:
+        memes_dir = os.path.join(workdir, 'memes')
+        os.makedirs(memes_dir)
+        elapsed, _ = timed(lambda: make_library(memes_dir, args.memes, args.videos))
+        print(f"Библиотека: {args.memes} файлов создано за {elapsed:.1f}с")
+
+        catalog = bench_import(memes_dir, os.path.join(workdir, 'index.db'), args.added, args.videos)
+        print("Пулы раздачи:")
+        bench_pools(catalog)
+
+        print(f"Раздача: {args.rounds} раундов x {args.players} рук по {Config.MEMES_PER_PLAYER} мемов")
+        for label, make_deck, chats in (("перемешанный список", ListDeck, args.baseline_chats),
+                                        ("ленивая колода", MemeDeck, args.chats)):
+            mean_us, p99_us, max_ms, per_chat_kb = bench_deal(catalog, make_deck, chats, args.players,
+                                                              args.rounds)
+            print(f"  {label:<20} {chats:>5} чатов, рука: среднее {mean_us:8.1f}мкс, p99 {p99_us:8.1f}мкс, "
+                  f"макс {max_ms:6.1f}мс; память колоды {per_chat_kb:7.1f}КБ на чат")
+        bench_get(catalog)
+        catalog.index.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
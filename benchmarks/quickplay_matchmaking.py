@@ -0,0 +1,244 @@
+"""
+Очередь быстрой игры (/quickplay) под синтетической нагрузкой.
+
+1. Модель: Matchmaker на модельном времени. Игроки приходят пуассоновским
+   потоком --rates игроков в секунду в течение --duration секунд, доля --leave
+   уходит из очереди раньше, чем нашлась игра. Отчет по каждому потоку:
+   ожидание до игры (p50/p95/p99/макс), размеры столов, не дождавшиеся,
+   наибольшая длина очереди и CPU на одну операцию очереди.
+2. Всплеск: --burst игроков нажимают /quickplay в один момент.
+3. Большая очередь: --queue игроков в очереди без сбора игр (худший случай) -
+   стоимость входа, выхода и выдачи игры при такой длине.
+4. Сквозной прогон: --e2e игроков вызывают quickplay_command настоящего
+   MemesGameBot поверх поддельного Bot API (benchmarks/fake_api.py) в течение
+   --ramp секунд; задержка - от команды до табло игры в ЛС игрока.
+
+Запуск: python benchmarks/quickplay_matchmaking.py [--rates 0.1,1,10,100] [--duration 3600]
+        [--leave 0.1] [--burst 10000] [--queue 100000] [--e2e 400] [--ramp 10]
+"""
+import argparse
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_api import FakeTelegramRequest, prepare_workdir, message_update
+
+prepare_workdir()
+os.environ.setdefault('RATE_LIMIT', '0')
+# Сквозной прогон идет в реальном времени: короткие цели ожидания
+os.environ.setdefault('QUICKPLAY_TARGET_WAIT', '3')
+os.environ.setdefault('QUICKPLAY_MAX_WAIT', '10')
+
+from telegram import Update
+from telegram.ext import ExtBot
+from bot import MemesGameBot
+from config import Config
+from matchmaking import Matchmaker
+import log_setup
+
+
+def pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def simulate(rate, duration, leave, target_wait, max_wait, rng):
+    """Поток игроков через очередь на модельном времени (без sleep)"""
+    matchmaker = Matchmaker(Config.MIN_PLAYERS, Config.MAX_PLAYERS, target_wait, max_wait)
+    events = []
+    seq = itertools.count()
+    now = 0.0
+    for user_id in itertools.count():
+        now += rng.expovariate(rate)
+        if now > duration:
+            break
+        heapq.heappush(events, (now, next(seq), 'join', user_id))
+        if rng.random() < leave:
+            heapq.heappush(events, (now + rng.uniform(0, target_wait), next(seq), 'leave', user_id))
+
+    waits = []
+    tables = collections.Counter()
+    left = expired = longest = operations = 0
+    cpu = 0.0
+    timer = None
+    while events:
+        now, _, kind, user_id = heapq.heappop(events)
+        if kind == 'timer' and now != timer:
+            continue  # таймер заменен более поздним
+        started = time.perf_counter()
+        if kind == 'join':
+            matchmaker.join(user_id, '', now)
+        elif kind == 'leave':
+            left += matchmaker.leave(user_id)
+        longest = max(longest, len(matchmaker))
+        groups = matchmaker.match(now)
+        gone = matchmaker.expire(now)
+        next_check = matchmaker.next_check()
+        cpu += time.perf_counter() - started
+        operations += 1
+
+        for group in groups:
+            tables[len(group)] += 1
+            waits.extend(now - waiting.joined for waiting in group)
+        expired += len(gone)
+        if next_check is not None and next_check != timer:
+            timer = next_check
+            heapq.heappush(events, (timer, next(seq), 'timer', None))
+
+    return {
+        'players': len(waits) + left + expired,
+        'matched': len(waits),
+        'left': left,
+        'expired': expired,
+        'waits': waits,
+        'tables': tables,
+        'longest': longest,
+        'op_us': cpu / max(operations, 1) * 1e6,
+    }
+
+
+def report_simulation(rate, result):
+    waits = result['waits']
+    tables = ", ".join(f"{size}:{count}" for size, count in sorted(result['tables'].items()))
+    print(f"  {rate:>7g}/с  игроков {result['players']:>7}  в игре {result['matched']:>7}  "
+          f"ушли {result['left']:>5}  не дождались {result['expired']:>5}  "
+          f"ожидание p50 {pct(waits, 0.5):5.1f}с p95 {pct(waits, 0.95):5.1f}с "
+          f"p99 {pct(waits, 0.99):5.1f}с макс {max(waits, default=0):5.1f}с  "
+          f"очередь до {result['longest']}  {result['op_us']:.1f}мкс/оп")
+    print(f"            столы (игроков:игр) {tables}")
+
+
+def burst(players):
+    """Все нажали /quickplay разом: каждый вход сразу проверяет очередь, как run_matchmaking"""
+    matchmaker = Matchmaker(Config.MIN_PLAYERS, Config.MAX_PLAYERS, Config.QUICKPLAY_TARGET_WAIT,
+                            Config.QUICKPLAY_MAX_WAIT)
+    games = longest = 0
+    started = time.perf_counter()
+    for user_id in range(players):
+        matchmaker.join(user_id, '', 0.0)
+        longest = max(longest, len(matchmaker))
+        games += len(matchmaker.match(0.0))
+    elapsed = time.perf_counter() - started
+    print(f"Всплеск: {players} игроков в один момент -> {games} игр по {Config.MAX_PLAYERS}, "
+          f"в очереди осталось {len(matchmaker)}, очередь не длиннее {longest}; "
+          f"{elapsed / players * 1e6:.2f}мкс на игрока")
+
+
+def big_queue(size, rng):
+    """Худший случай: очередь из size игроков, которых нельзя собрать (игры не собираются)"""
+    matchmaker = Matchmaker(Config.MIN_PLAYERS, Config.MAX_PLAYERS, Config.QUICKPLAY_TARGET_WAIT,
+                            Config.QUICKPLAY_MAX_WAIT)
+    started = time.perf_counter()
+    for user_id in range(size):
+        matchmaker.join(user_id, '', float(user_id))
+    join_us = (time.perf_counter() - started) / size * 1e6
+
+    leaving = rng.sample(range(size), size // 10)
+    started = time.perf_counter()
+    for user_id in leaving:
+        matchmaker.leave(user_id)
+    leave_us = (time.perf_counter() - started) / len(leaving) * 1e6
+
+    # Время сдвинуто за цель ожидания: каждый match() выдает полный стол
+    started = time.perf_counter()
+    games = 0
+    while len(matchmaker) >= Config.MAX_PLAYERS:
+        games += len(matchmaker.match(float(size)))
+        matchmaker.next_check()
+    match_us = (time.perf_counter() - started) / max(games, 1) * 1e6
+    print(f"Очередь {size} игроков: вход {join_us:.2f}мкс, выход из середины {leave_us:.2f}мкс, "
+          f"сбор игры {match_us:.2f}мкс ({games} игр)")
+
+
+async def end_to_end(players, ramp, api_latency):
+    request = FakeTelegramRequest(latency=api_latency, jitter=api_latency / 2)
+    bot = ExtBot('123456:QUICK', request=request, get_updates_request=request)
+    await bot.initialize()
+    game_bot = MemesGameBot()
+
+    queued_at = {}
+    latency = []
+
+    def on_call(method, params):
+        # Табло быстрой игры в ЛС - игрок увидел, что игра началась
+        if method == 'sendMessage' and str(params.get('text', '')).startswith("⚡ БЫСТРАЯ ИГРА"):
+            user_id = int(params['chat_id'])
+            if user_id in queued_at:
+                latency.append(time.perf_counter() - queued_at.pop(user_id))
+
+    request.on_call = on_call
+
+    async def player(user_id):
+        await asyncio.sleep(random.uniform(0, ramp))
+        update = Update.de_json(message_update(request.next_update_id(), user_id, user_id, "/quickplay"), bot)
+        queued_at[user_id] = time.perf_counter()
+        await game_bot.quickplay_command(update, types.SimpleNamespace(bot=bot, args=[]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(player(user_id) for user_id in range(1, players + 1)))
+    # Последние в очереди ждут сбора по цели ожидания или выходят по max_wait
+    deadline = time.perf_counter() + Config.QUICKPLAY_MAX_WAIT + 1
+    while len(game_bot.matchmaker) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - started
+
+    games = len(game_bot.games.local_games())
+    print(f"Сквозной прогон: {players} игроков за {ramp:.0f}с, Bot API {api_latency * 1000:.0f}мс, "
+          f"цель ожидания {Config.QUICKPLAY_TARGET_WAIT:g}с -> {games} игр, "
+          f"табло получили {len(latency)}, не дождались {len(queued_at) - len(game_bot.matchmaker)}")
+    print(f"  от /quickplay до табло в ЛС: p50 {pct(latency, 0.5):.2f}с, p95 {pct(latency, 0.95):.2f}с, "
+          f"p99 {pct(latency, 0.99):.2f}с, макс {max(latency, default=0):.2f}с ({elapsed:.1f}с всего)")
+
+    await game_bot.quickplay_timer.close()
+    await game_bot.deadlines.close()
+    await game_bot.board.close()
+    await game_bot.games.close()
+    await game_bot.db.close()
+    await bot.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', default='0.1,1,10,100', help='потоки игроков в секунду через запятую')
+    parser.add_argument('--duration', type=float, default=3600, help='модельное время, с')
+    parser.add_argument('--leave', type=float, default=0.1, help='доля игроков, уходящих из очереди')
+    parser.add_argument('--target-wait', type=float, default=30, help='цель ожидания в модели, с')
+    parser.add_argument('--max-wait', type=float, default=300, help='предел ожидания в модели, с')
+    parser.add_argument('--burst', type=int, default=10000)
+    parser.add_argument('--queue', type=int, default=100000)
+    parser.add_argument('--e2e', type=int, default=400, help='игроков в сквозном прогоне (0 - пропустить)')
+    parser.add_argument('--ramp', type=float, default=10.0)
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    log_setup.setup_logging(stream=open(os.devnull, 'w'))
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    print(f"Модель: {args.duration:.0f}с, цель ожидания {args.target_wait:g}с, предел {args.max_wait:g}с, "
+          f"столы {Config.MIN_PLAYERS}..{Config.MAX_PLAYERS}, уходят {args.leave:.0%}")
+    for rate in (float(value) for value in args.rates.split(',')):
+        report_simulation(rate, simulate(rate, args.duration, args.leave, args.target_wait, args.max_wait, rng))
+    burst(args.burst)
+    big_queue(args.queue, rng)
+    if args.e2e:
+        asyncio.run(end_to_end(args.e2e, args.ramp, args.api_latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Пиковая нагрузка на Bot API: без ограничителя против RateLimiter.
+
+Поддельный Bot API (benchmarks/fake_api.py) отвечает 429 с retry_after при
+превышении лимитов Telegram. Одновременно идут --games игр по --players игроков:
+объявления в группу, раздача рук (медиагруппа + сообщение с кнопками в ЛС)
+и ответы на нажатия кнопок. Без ограничителя RetryAfter, как и раньше в боте,
+печатается и проглатывается - сообщение потеряно.
+
+Запуск: python benchmarks/rate_limits.py [--games 10] [--players 6] [--rounds 2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_api import FakeTelegramRequest, prepare_workdir
+
+prepare_workdir()
+
+from telegram import InputMediaPhoto
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+from rate_limiter import RateLimiter
+
+
+class Load:
+    def __init__(self, bot):
+        self.bot = bot
+        self.lost = 0
+        self.latency = {'interactive': [], 'broadcast': []}
+
+    async def call(self, kind, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except RetryAfter:
+            self.lost += 1
+            return
+        self.latency[kind].append(time.perf_counter() - started)
+
+    async def deal_hand(self, player_id):
+        media = [InputMediaPhoto(f"photo{i}") for i in range(6)]
+        await self.call('broadcast', self.bot.send_media_group(player_id, media))
+        await self.call('broadcast', self.bot.send_message(player_id, "Выберите мем"))
+
+    async def click(self, player_id, i):
+        # Игрок нажимает кнопку спустя немного времени после раздачи
+        await asyncio.sleep(0.2 * i)
+        await self.call('interactive', self.bot.answer_callback_query(str(player_id)))
+        await self.call('interactive', self.bot.edit_message_text("✅ Мем выбран", player_id, 1))
+
+    async def game(self, chat_id, players, rounds):
+        for _ in range(rounds):
+            await self.call('broadcast', self.bot.send_message(chat_id, "🔄 Новый раунд"))
+            await asyncio.gather(*(self.deal_hand(player_id) for player_id in players))
+            await asyncio.gather(*(self.click(player_id, i) for i, player_id in enumerate(players)))
+            await self.call('broadcast', self.bot.send_message(chat_id, "📊 Все мемы отправлены!"))
+
+
+def pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(mode, games, players, rounds):
+    request = FakeTelegramRequest(latency=0.02, flood_control=True)
+    limiter = RateLimiter() if mode == 'limiter' else None
+    bot = ExtBot('1:bench', request=request, get_updates_request=request, rate_limiter=limiter)
+    await bot.initialize()
+
+    load = Load(bot)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        load.game(-(10 ** 12) - g, [g * 100 + p + 1 for p in range(players)], rounds)
+        for g in range(games)
+    ))
+    elapsed = time.perf_counter() - started
+
+    print(f"{mode:>8}: {elapsed:.1f}с, вызовов {sum(request.calls.values())}, "
+          f"ответов 429: {request.flood_errors}, потеряно сообщений: {load.lost}")
+    for kind, values in load.latency.items():
+        print(f"          {kind:>11}: медиана {statistics.median(values) if values else 0:.2f}с, "
+              f"p95 {pct(values, 0.95):.2f}с, макс {max(values, default=0):.2f}с")
+    if limiter is not None:
+        metrics = limiter.metrics()
+        print("          ожидание токена (среднее): " + ", ".join(
+            f"{name} {value:.2f}с" for name, value in metrics['wait_avg'].items()))
+    await bot.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    for mode in ('none', 'limiter'):
+        asyncio.run(run(mode, args.games, args.players, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Сквозная задержка обработки апдейтов: webhook против polling.
+
+Бот запускается с поддельным Bot API (benchmarks/fake_api.py). Синтетические
+апдейты /start отправляются POST-запросом на встроенный webhook-сервер
+(с секретным токеном) или отдаются через getUpdates. Задержка - время от
+появления апдейта до вызова sendMessage с ответом в этот чат.
+
+--delivery-latency имитирует сеть между Telegram и ботом: webhook платит ее
+один раз (POST), long polling - на ответ getUpdates и на каждый новый запрос.
+
+Запуск: python benchmarks/webhook_latency.py [--updates 500] [--rate 200] [--api-latency 0.05]
+        [--delivery-latency 0.03]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_api import FakeTelegramRequest, prepare_workdir, message_update
+
+prepare_workdir()
+# Меряется обработка апдейтов, а не лимиты Telegram (их меряет benchmarks/rate_limits.py)
+os.environ.setdefault('RATE_LIMIT', '0')
+
+import httpx
+from bot import MemesGameBot, build_application
+
+SECRET = 'bench-secret'
+PORT = 18443
+PATH = 'telegram'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_mode(mode, updates, rate, api_latency, delivery_latency):
+    request = FakeTelegramRequest(latency=api_latency,
+                                  delivery_latency=delivery_latency if mode == 'polling' else 0.0)
+    game_bot = MemesGameBot()
+    application = build_application(game_bot, token='123456:BENCH', request=request)
+
+    sent_at = {}
+    latencies = []
+
+    def on_call(method, params):
+        chat_id = int(params.get('chat_id', 0))
+        if method == 'sendMessage' and chat_id in sent_at:
+            latencies.append(time.perf_counter() - sent_at.pop(chat_id))
+
+    request.on_call = on_call
+
+    await application.initialize()
+    if mode == 'webhook':
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=PORT, url_path=PATH, secret_token=SECRET
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}") as client:
+        if mode == 'webhook':
+            # Запрос без секрета должен быть отклонен
+            response = await client.post(f"/{PATH}", json=message_update(0, 1, 1, '/start'))
+            print(f"  запрос без секретного токена: HTTP {response.status_code}")
+
+        async def send(i):
+            chat_id = 100000 + i
+            update = message_update(request.next_update_id(), chat_id, chat_id, '/start')
+            sent_at[chat_id] = time.perf_counter()
+            if mode == 'webhook':
+                await asyncio.sleep(delivery_latency)
+                await client.post(f"/{PATH}", json=update,
+                                  headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+            else:
+                request.push_update(update)
+
+        tasks = []
+        for i in range(updates):
+            tasks.append(asyncio.create_task(send(i)))
+            await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+
+        deadline = time.perf_counter() + 30
+        while sent_at and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await game_bot.db.close()
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=200, help='апдейтов в секунду')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='задержка поддельного Bot API, с')
+    parser.add_argument('--delivery-latency', type=float, default=0.03, help='сеть Telegram -> бот, с')
+    args = parser.parse_args()
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    for mode in ('webhook', 'polling'):
+        print(f"{mode}:")
+        latencies = asyncio.run(run_mode(mode, args.updates, args.rate, args.api_latency,
+                                             args.delivery_latency))
+        if not latencies:
+            print("  нет ответов")
+            continue
+        print(f"  ответов {len(latencies)}/{args.updates}, "
+              f"p50 {statistics.median(latencies) * 1000:.1f}мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f}мс, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.1f}мс")
+
+
+if __name__ == '__main__':
+    main()
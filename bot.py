@@ -1,16 +1,19 @@
+import asyncio
+import functools
 import logging
 import os
 import random
-import uuid
-import traceback
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaVideo
+import statistics
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-from telegram.error import BadRequest, NetworkError, TimedOut
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
+from telegram.request import HTTPXRequest
 
 print("=== Начало загрузки бота ===")
 
 try:
-    from database import Database
+    from database import AsyncDatabase
     print("✅ Database импортирован успешно")
 except Exception as e:
     print(f"❌ Ошибка импорта Database: {e}")
@@ -24,25 +27,252 @@ except Exception as e:
     raise
 
 try:
-    from file_manager import FileManager, safe_text
+    from file_manager import FileManager, safe_text, situation_label
     print("✅ FileManager импортирован успешно")
 except Exception as e:
     print(f"❌ Ошибка импорта FileManager: {e}")
     raise
 
+try:
+    from media_cache import MediaCache
+    print("✅ MediaCache импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта MediaCache: {e}")
+    raise
+
+try:
+    from rate_limiter import RateLimiter
+    print("✅ RateLimiter импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта RateLimiter: {e}")
+    raise
+
+try:
+    from voting_sheet import VotingSheetRenderer
+    print("✅ VotingSheetRenderer импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта VotingSheetRenderer: {e}")
+    raise
+
+try:
+    import callback_codec
+    from callback_codec import InvalidCallback, round_nonce
+    print("✅ callback_codec импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта callback_codec: {e}")
+    raise
+
+try:
+    from deadline_scheduler import DeadlineScheduler
+    print("✅ DeadlineScheduler импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта DeadlineScheduler: {e}")
+    raise
+
+try:
+    from game_board import GameBoard
+    print("✅ GameBoard импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта GameBoard: {e}")
+    raise
+
+try:
+    from game_state import Game
+    print("✅ game_state импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта game_state: {e}")
+    raise
+
+try:
+    from state_store import StateConflict, create_state_store
+    print("✅ state_store импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта state_store: {e}")
+    raise
+
+try:
+    import metrics
+    print("✅ metrics импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта metrics: {e}")
+    raise
+
+try:
+    import log_setup
+    print("✅ log_setup импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта log_setup: {e}")
+    raise
+
+try:
+    from render_cache import RenderCache
+    print("✅ render_cache импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта render_cache: {e}")
+    raise
+
+try:
+    from matchmaking import Matchmaker, is_quick_chat, new_quick_chat_id
+    print("✅ matchmaking импортирован успешно")
+except Exception as e:
+    print(f"❌ Ошибка импорта matchmaking: {e}")
+    raise
+
 print("=== Все импорты успешны ===")
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Логи пишет отдельный поток из очереди: вывод не блокирует event loop
+log_setup.setup_logging()
+logger = logging.getLogger(__name__)
+
+# Статичные сообщения: собираются один раз при импорте
+START_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Начать игру", callback_data=callback_codec.encode(callback_codec.START_GAME))],
+    [InlineKeyboardButton("⚡ Быстрая игра", callback_data=callback_codec.encode(callback_codec.QUICKPLAY))],
+    [InlineKeyboardButton("📋 Правила", callback_data=callback_codec.encode(callback_codec.SHOW_RULES))],
+    [InlineKeyboardButton("📊 Статистика", callback_data=callback_codec.encode(callback_codec.SHOW_STATS))],
+    [InlineKeyboardButton("🏆 Лидерборд", callback_data=callback_codec.encode(callback_codec.SHOW_LEADERBOARD))]
+])
+
+QUICKPLAY_QUEUE_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🚪 Выйти из очереди", callback_data=callback_codec.encode(callback_codec.QUICKPLAY_LEAVE))]
+])
+
+RULES_TEXT = """
+📋 ПРАВИЛА ИГРЫ:
+
+👥 Игроков: 2-8 человек
+🃏 Каждый получает по 6 карточек с мемами
+👑 Первый ведущий - создатель игры
+📖 Ведущий выбирает и зачитывает ситуацию
+😂 Игроки выбирают самый подходящий мем
+🏆 Ведущий выбирает победителя раунда
+🔄 Ведущий меняется каждый раунд
+🎯 Побеждает набравший больше всего очков
+
+🎥 Мемы могут быть как фото, так и видео!
+
+📝 КАК ИГРАТЬ:
+1. Создайте игру командой /start
+2. Пригласите друзей: /join_123456789
+3. Ведущий выбирает ситуацию
+4. Игроки выбирают мемы из ЛС
+5. Ведущий голосует за лучший мем
+6. Игра продолжается до завершения!
+"""
+
+class AnsweredQuery:
+    """
+    CallbackQuery, на который можно ответить только один раз.
+    
+    Telegram принимает один answerCallbackQuery на нажатие, повторный ответ
+    обработчика - лишний запрос, который все равно отклоняется.
+    """
+    __slots__ = ('query', 'answered')
+    
+    def __init__(self, query):
+        self.query = query
+        self.answered = False
+    
+    def __getattr__(self, name):
+        return getattr(self.query, name)
+    
+    async def answer(self, *args, **kwargs):
+        if self.answered:
+            return False
+        self.answered = True
+        return await self.query.answer(*args, **kwargs)
+
+def logged_command(handler):
+    """Контекст записей лога команды, как у нажатий кнопок: чат, пользователь, обработчик, длительность"""
+    @functools.wraps(handler)
+    async def wrapper(self, update, context):
+        chat, user = update.effective_chat, update.effective_user
+        log_context = log_setup.bind(chat_id=chat.id if chat else None, user_id=user.id if user else None,
+                                     handler=handler.__name__, started=time.perf_counter())
+        try:
+            return await handler(self, update, context)
+        finally:
+            log_setup.unbind(log_context)
+    return wrapper
 
 class MemesGameBot:
     def __init__(self):
-        self.db = Database()
-        self.file_manager = FileManager()
-        self.active_games = {}
-        self.user_sessions = {}  # Для хранения текущих мемов пользователя
+        self.db = AsyncDatabase()
+        self.file_manager = FileManager(run=self.db.run)
+        self.media_cache = MediaCache(self.db)
+        # Все исходящие запросы идут через бакеты чатов и общий бакет с приоритетами
+        self.rate_limiter = RateLimiter() if Config.RATE_LIMIT else None
+        # Лист голосования одной картинкой (если включен VOTING_SHEET)
+        self.voting_sheets = VotingSheetRenderer(Config.VOTING_SHEET_DIR) if Config.VOTING_SHEET else None
+        if self.voting_sheets is not None:
+            # file_id листов, удаленных с диска, больше не понадобятся
+            self.media_cache.drop(self.voting_sheets.stale_keys(self.media_cache.keys())
+                                  + self.voting_sheets.take_evicted())
+        # Хранилище игр: в памяти процесса или общее для нескольких воркеров.
+        # Раздача игрокам хранится в руках игроков (индексы каталога)
+        self.games = create_state_store(self.db)
+        self.games.restore()
+        # Дедлайны фаз: по одному на игру, игра продолжается сама, если игроки молчат
+        self.deadlines = DeadlineScheduler(self.on_deadline)
+        # Закрепленное табло игры в чате: правится на месте вместо новых сообщений
+        self.board = GameBoard(self.render_board)
+        # Готовые клавиатуры и тексты: одно состояние раунда отрисовывается один раз
+        self.renders = RenderCache()
+        # Очередь быстрой игры и ее таймер: игра поменьше или истекшее ожидание
+        self.matchmaker = Matchmaker()
+        for chat_id, game in self.games.local_games().items():
+            if is_quick_chat(chat_id):
+                self.matchmaker.started(chat_id, game.order)
+        self.quickplay_timer = DeadlineScheduler(self.on_quickplay_deadline)
+        # chat_id -> nonce кнопок текущего раунда
+        self.round_nonces = {chat_id: round_nonce(game) for chat_id, game in self.games.local_games().items()}
+        # Код действия из callback_data -> обработчик
+        self.callback_routes = {
+            callback_codec.START_GAME: self.start_game,
+            callback_codec.SHOW_RULES: self.show_rules,
+            callback_codec.SHOW_STATS: self.show_stats,
+            callback_codec.SHOW_LEADERBOARD: self.show_leaderboard,
+            callback_codec.BEGIN: self.begin_game,
+            callback_codec.SITUATION: self.choose_situation,
+            callback_codec.MEME_CHOICE: self.handle_meme_choice,
+            callback_codec.VOTE: self.handle_vote,
+            callback_codec.NEXT_ROUND: self.next_round,
+            callback_codec.END_GAME: self.end_game,
+            callback_codec.JOIN: self.join_button,
+            callback_codec.QUICKPLAY: self.quickplay_button,
+            callback_codec.QUICKPLAY_LEAVE: self.quickplay_leave,
+        }
+        self._leaderboard_text = None  # (версия лидерборда, готовый текст)
+        self.metrics_server = None
+        self._register_metrics()
+    
+    def _register_metrics(self):
+        """Значения, которые считаются в момент запроса /metrics"""
+        registry = metrics.REGISTRY
+        registry.collected('memes_active_games', 'Игр в памяти этого процесса',
+                           lambda: len(self.games.local_games()))
+        registry.collected('memes_active_players', 'Игроков в этих играх',
+                           lambda: sum(len(game.order) for game in self.games.local_games().values()))
+        registry.collected('memes_pending_deadlines', 'Взведенных дедлайнов фаз', lambda: len(self.deadlines))
+        registry.collected('memes_db_pending_writes', 'Записей в буфере отложенной записи',
+                           self.db.pending_writes)
+        registry.collected('memes_board_edits_total', 'Правок табло игр', lambda: self.board.edits, 'counter')
+        registry.collected('memes_quickplay_queue', 'Игроков в очереди быстрой игры', lambda: len(self.matchmaker))
+        registry.collected('memes_render_cache_total', 'Обращения к кэшу отрисовки',
+                           lambda: {('hit',): self.renders.hits, ('miss',): self.renders.misses},
+                           'counter', ('result',))
+        if self.rate_limiter is not None:
+            registry.collected('telegram_rate_limit_queue_depth', 'Запросов в очереди ограничителя',
+                               lambda: {(name,): depth for name, depth
+                                        in self.rate_limiter.metrics()['queue_depth'].items()},
+                               labelnames=('priority',))
+            registry.collected('telegram_rate_limit_retries_total', 'Повторов после RetryAfter',
+                               lambda: self.rate_limiter.retries, 'counter')
+            # Распределение ожидания токена пишет сам ограничитель (telegram_rate_limit_wait_seconds)
+            registry.collected('telegram_rate_limit_wait_max_seconds', 'Наибольшее ожидание токена с запуска',
+                               lambda: {(name,): wait for name, wait
+                                        in self.rate_limiter.metrics()['wait_max'].items()},
+                               labelnames=('priority',))
     
     def _safe_text(self, text, default="Текст"):
         """
@@ -50,255 +280,697 @@ class MemesGameBot:
         """
         return safe_text(text, default)
     
+    def _button(self, text, action, chat_id, game, arg=0):
+        """Кнопка игры: чат, nonce текущего раунда и аргумент упакованы в callback_data"""
+        return InlineKeyboardButton(
+            text, callback_data=callback_codec.encode(action, chat_id, round_nonce(game), arg)
+        )
+    
+    # Клавиатуры игры неизменяемы и зависят только от чата и раунда:
+    # собираются один раз на ключ (вид, chat_id, nonce раунда[, аргумент])
+    
+    def _lobby_keyboard(self, chat_id, game):
+        return self.renders.get(('lobby', chat_id, round_nonce(game)), lambda: InlineKeyboardMarkup([
+            [self._button("🙋 Присоединиться", callback_codec.JOIN, chat_id, game)],
+            [self._button("▶️ Начать игру", callback_codec.BEGIN, chat_id, game)],
+            [self._button("❌ Отменить игру", callback_codec.END_GAME, chat_id, game)]
+        ]))
+    
+    def _situation_keyboard(self, chat_id, game):
+        return self.renders.get(('situations', chat_id, round_nonce(game), tuple(game.situations)),
+                                lambda: InlineKeyboardMarkup([
+            [self._button(situation_label(text), callback_codec.SITUATION, chat_id, game, i)]
+            for i, text in enumerate(game.situations)
+        ]))
+    
+    def _meme_choice_keyboard(self, chat_id, game, count):
+        return self.renders.get(('meme_choice', chat_id, round_nonce(game), count), lambda: InlineKeyboardMarkup([
+            [self._button(f"Мем {i+1}", callback_codec.MEME_CHOICE, chat_id, game, i)]
+            for i in range(count)
+        ]))
+    
+    def _vote_keyboard(self, chat_id, game):
+        return self.renders.get(('vote', chat_id, round_nonce(game), len(game.voting_options)),
+                                lambda: self._build_vote_keyboard(chat_id, game))
+    
+    def _build_vote_keyboard(self, chat_id, game):
+        keyboard = []
+        temp_row = []
+        for i in range(len(game.voting_options)):
+            temp_row.append(self._button(f"🎯 {i+1}", callback_codec.VOTE, chat_id, game, i))
+            if len(temp_row) >= 3:  # 3 кнопки в ряд
+                keyboard.append(temp_row)
+                temp_row = []
+        if temp_row:
+            keyboard.append(temp_row)
+        return InlineKeyboardMarkup(keyboard)
+    
+    def _round_complete_keyboard(self, chat_id, game):
+        return self.renders.get(('round_complete', chat_id, round_nonce(game)), lambda: InlineKeyboardMarkup([
+            [self._button("➡️ Следующий раунд", callback_codec.NEXT_ROUND, chat_id, game)],
+            [self._button("🏁 Завершить игру", callback_codec.END_GAME, chat_id, game)]
+        ]))
+    
+    def _choice_prompt(self, chat_id, game):
+        """Приглашение выбрать мем: одно на раунд для всех игроков (ситуация уже очищена)"""
+        return self.renders.get(('choice_prompt', chat_id, round_nonce(game), game.current_situation),
+                                lambda: f"🎲 Выберите мем для ситуации:\n\n{game.current_situation}")
+    
+    def _board_text(self, chat_id, game):
+        """Табло: фаза, раунд, ведущий, ситуация и игроки с очками"""
+        phase = {
+            'waiting': "⏳ Набор игроков",
+            'choosing_situation': "📝 Ведущий выбирает ситуацию",
+            'players_choosing': "🎲 Игроки выбирают мемы",
+            'voting': "📊 Ведущий выбирает победителя",
+            'round_complete': "✅ Раунд завершен",
+        }.get(game.status, game.status)
+        lines = ["⚡ БЫСТРАЯ ИГРА" if is_quick_chat(chat_id) else "🎮 МЕМЫ ПО СИТУАЦИИ", f"Фаза: {phase}"]
+        if game.round_number:
+            lines.append(f"Раунд: {game.round_number}")
+            lines.append(f"👑 Ведущий: {game.name(game.leader, 'Ведущий')}")
+        if game.current_situation and game.status in ('players_choosing', 'voting', 'round_complete'):
+            lines.append(f"\nСитуация: {game.current_situation}")
+        
+        lines.append(f"\nИгроки ({len(game.order)}/{Config.MAX_PLAYERS}):")
+        for user_id in game.order:
+            player = game.players[user_id]
+            mark = "👑" if game.round_number and user_id == game.leader else "▫️"
+            lines.append(f"{mark} {player.name}: {player.score}")
+        
+        if game.status == 'waiting':
+            lines.append(f"\nНажмите «Присоединиться» или отправьте /join_{chat_id}")
+        # Имена очищены при входе в игру, ситуации - при загрузке
+        return "\n".join(lines)
+    
+    def _board_keyboard(self, chat_id, game):
+        if game.status == 'waiting':
+            return self._lobby_keyboard(chat_id, game)
+        if game.status == 'choosing_situation':
+            return self._situation_keyboard(chat_id, game)
+        if game.status == 'round_complete':
+            return self._round_complete_keyboard(chat_id, game)
+        return None
+    
+    async def render_board(self, chat_id):
+        game = await self.games.get(chat_id)
+        if not game or game.status == 'finished':
+            return None
+        targets = game.board_targets(chat_id)
+        if not targets:
+            return None
+        return targets, self._board_text(chat_id, game), self._board_keyboard(chat_id, game)
+    
+    async def update_board(self, chat_id, game, bot, notice=None):
+        """Показать изменения игры на табло (с задержкой); notice - событие внизу табло"""
+        if game.board_targets(chat_id):
+            self.board.refresh(chat_id, bot, notice)
+        else:
+            await self.create_board(chat_id, game, bot, notice)
+    
+    async def create_board(self, chat_id, game, bot, notice=None):
+        """
+        Новое табло для игры без него (быстрая игра, игра из старого снимка): отправить и закрепить.
+        У быстрой игры нет общего чата - табло получает каждый игрок в ЛС.
+        """
+        text = self._board_text(chat_id, game)
+        if notice:
+            text = f"{text}\n\n{notice}"
+        reply_markup = self._board_keyboard(chat_id, game)
+        if is_quick_chat(chat_id):
+            messages = await asyncio.gather(*(bot.send_message(user_id, text, reply_markup=reply_markup)
+                                              for user_id in game.order), return_exceptions=True)
+            for user_id, message in zip(game.order, messages):
+                if isinstance(message, Exception):
+                    logger.error("❌ Не удалось отправить табло игроку %s: %s", user_id, message)
+                else:
+                    game.screens[user_id] = message.message_id
+        else:
+            message = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+            game.board_message_id = message.message_id
+        await self.games.save(chat_id, game)
+        await self.board.pin(bot, game.board_targets(chat_id))
+    
+    def _game_chats(self, chat_id, game):
+        """Куда отправлять сообщения для всей игры: чат игры или ЛС игроков быстрой игры"""
+        return list(game.order) if is_quick_chat(chat_id) else [chat_id]
+    
+    def _phase_duration(self, status):
+        return {
+            'choosing_situation': Config.SITUATION_DURATION,
+            'players_choosing': Config.ROUND_DURATION,
+            'voting': Config.VOTING_DURATION,
+        }.get(status)
+    
+    def _arm_deadline(self, chat_id, game, bot):
+        if game.deadline:
+            self.deadlines.schedule(chat_id, game.deadline, (game.status, game.round_number, bot))
+        else:
+            self.deadlines.cancel(chat_id)
+    
+    async def save_phase(self, chat_id, game, bot):
+        """Сохранить переход в новую фазу и перезапустить ее дедлайн"""
+        duration = self._phase_duration(game.status)
+        game.deadline = time.time() + duration if duration else None
+        await self.games.save(chat_id, game)
+        self._remember_round(chat_id, game)
+        self._arm_deadline(chat_id, game, bot)
+        log_setup.annotate(phase=game.status)
+    
+    async def on_deadline(self, chat_id, token):
+        """Время фазы вышло: продолжаем игру без молчащих игроков"""
+        status, round_number, bot = token
+        log_context = log_setup.bind(chat_id=chat_id, phase=status, handler='on_deadline',
+                                     started=time.perf_counter())
+        try:
+            await self._on_deadline(chat_id, status, round_number, bot)
+        finally:
+            log_setup.unbind(log_context)
+    
+    async def _on_deadline(self, chat_id, status, round_number, bot):
+        game = await self.games.get(chat_id)
+        # Фаза могла закончиться раньше дедлайна
+        if not game or game.status != status or game.round_number != round_number:
+            return
+        
+        try:
+            if status == 'players_choosing' and game.submitted:
+                await self.update_board(chat_id, game, bot, "⏰ Время выбора мемов вышло! Голосуем за отправленные.")
+                await self.start_voting(chat_id, game, bot)
+                return
+            
+            game.idle_rounds = game.idle_rounds + 1
+            if game.idle_rounds >= Config.MAX_IDLE_ROUNDS:
+                results = await self.finish_game(chat_id, game, bot, "⏰ Игроки неактивны, игра завершена.")
+                if not game.board_targets(chat_id):
+                    for target in self._game_chats(chat_id, game):
+                        await bot.send_message(target, results)
+                return
+            
+            notice = {
+                'choosing_situation': "⏰ Ведущий не выбрал ситуацию, ход переходит следующему.",
+                'players_choosing': "⏰ Никто не выбрал мем! Раунд пропущен.",
+                'voting': "⏰ Ведущий не проголосовал! Раунд пропущен.",
+            }[status]
+            await self.next_round_auto(chat_id, game, bot, notice)
+        except StateConflict as e:
+            # Игру изменили параллельно: новый дедлайн поставил тот, кто ее изменил
+            logger.warning("🔁 Дедлайн игры %s пропущен: %s", chat_id, e)
+    
+    async def post_init(self, application):
+        """Запускается после инициализации приложения: продолжение игр, предзагрузка мемов, сервер метрик"""
+        if Config.METRICS_PORT:
+            self.metrics_server = metrics.serve()
+        
+        if self.games.local_games():
+            application.create_task(self.resume_games(application.bot))
+        
+        application.create_task(self.prepare_media(application.bot))
+    
+    async def prepare_media(self, bot):
+        """Метаданные новых мемов, оптимизация в пуле процессов, затем предзагрузка уже оптимизированных"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.file_manager.probe_memes)
+        except Exception as e:
+            logger.error("❌ Ошибка чтения метаданных мемов: %s", e)
+        
+        if Config.MEDIA_OPTIMIZE_ON_START:
+            try:
+                memes = await self.file_manager.load_memes()
+                await asyncio.get_running_loop().run_in_executor(None, self.file_manager.optimize_media, memes)
+            except Exception as e:
+                logger.error("❌ Ошибка оптимизации мемов: %s", e)
+        
+        if Config.MEDIA_STORAGE_CHAT_ID:
+            await self.media_cache.warm_up(
+                bot,
+                int(Config.MEDIA_STORAGE_CHAT_ID),
+                await self.file_manager.get_all_memes()
+            )
+    
+    async def post_shutdown(self, application):
+        """Закрываем хранилище игр и соединение с базой при остановке бота"""
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        await self.deadlines.close()
+        await self.quickplay_timer.close()
+        await self.board.close()
+        await self.games.close()
+        await self.db.close()
+    
+    @logged_command
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user = update.effective_user
             chat_id = update.effective_chat.id
             
-            self.db.add_user(
+            await self.db.add_user(
                 user.id, 
                 self._safe_text(user.username),
                 self._safe_text(user.first_name),
                 self._safe_text(user.last_name)
             )
             
-            keyboard = [
-                [InlineKeyboardButton("🎮 Начать игру", callback_data="start_game")],
-                [InlineKeyboardButton("📋 Правила", callback_data="show_rules")],
-                [InlineKeyboardButton("📊 Статистика", callback_data="show_stats")],
-                [InlineKeyboardButton("🏆 Лидерборд", callback_data="show_leaderboard")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await update.message.reply_text(
-                self._safe_text(f"Привет, {user.first_name}! 👋\n"
+                f"Привет, {self._safe_text(user.first_name, 'игрок')}! 👋\n"
                 "Добро пожаловать в игру 'Мемы по ситуации'!\n\n"
-                "Собери 2-8 друзей и начните веселье!"),
-                reply_markup=reply_markup
+                "Собери 2-8 друзей и начните веселье!",
+                reply_markup=START_MENU
             )
         except Exception as e:
-            print(f"❌ Ошибка в start: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в start: %s", e)
     
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        action = 'stale'  # метка метрик: устаревшие и поддельные кнопки - одной строкой
+        # Контекст записей лога этого нажатия: кто, в каком чате, сколько длится обработка
+        log_context = log_setup.bind(user_id=update.effective_user.id, chat_id=update.effective_chat.id,
+                                     started=started)
         try:
-            query = update.callback_query
-            await query.answer()
+            query = AnsweredQuery(update.callback_query)
             
-            callback_data = query.data
-            
-            if callback_data == "start_game":
-                await self.start_game(query)
-            elif callback_data == "show_rules":
-                await self.show_rules(query)
-            elif callback_data == "show_stats":
-                await self.show_stats(query)
-            elif callback_data == "show_leaderboard":
-                await self.show_leaderboard(query)
-            elif callback_data.startswith("situation_"):
-                await self.choose_situation(query)
-            elif callback_data.startswith("begin_"):
-                await self.begin_game(query)
-            elif callback_data.startswith("memechoice_"):
-                await self.handle_meme_choice(query)
-            elif callback_data.startswith("vote_"):
-                await self.handle_vote(query)
-            elif callback_data.startswith("nextround_"):
-                await self.next_round(query)
-            elif callback_data.startswith("endgame_"):
-                await self.end_game(query)
+            # Устаревшие кнопки отсекаются до обращения к хранилищу игр
+            try:
+                data = callback_codec.decode(query.data)
+            except InvalidCallback:
+                await query.answer("❌ Кнопка устарела!")
+                return
+            handler = self.callback_routes.get(data.action)
+            if handler is None or not self._nonce_is_current(data):
+                await query.answer("❌ Кнопка устарела!")
+                return
+            action = handler.__name__
+            game = self.games.local_games().get(data.chat_id)
+            # Кнопки игры в ЛС игроков относятся к чату игры
+            log_setup.annotate(handler=action, phase=game.status if game else None,
+                               chat_id=data.chat_id if data.action in callback_codec.GAME_ACTIONS
+                               else update.effective_chat.id)
+            
+            # Если игру одновременно изменил другой обработчик или воркер,
+            # обработчик повторяется на свежем состоянии
+            for attempt in range(Config.STATE_CONFLICT_RETRIES):
+                try:
+                    if data.action in callback_codec.GAME_ACTIONS:
+                        await handler(query, data)
+                    else:
+                        await handler(query)
+                    break
+                except StateConflict as e:
+                    logger.warning("🔁 Конфликт состояния (%s/%s): %s",
+                                   attempt + 1, Config.STATE_CONFLICT_RETRIES, e)
+            else:
+                await query.answer("❌ Игра изменилась, попробуйте еще раз")
+            # Обработчик не ответил сам - пустой ответ убирает часики с кнопки
+            await query.answer()
+        except TimedOut as e:
+            logger.error("❌ Таймаут: %s", e)
+            metrics.CALLBACK_ERRORS.inc(action, type(e).__name__)
+        except BadRequest as e:
+            logger.error("❌ Ошибка Telegram API: %s", e)
+            metrics.CALLBACK_ERRORS.inc(action, type(e).__name__)
+        except NetworkError as e:
+            logger.error("❌ Сетевая ошибка: %s", e)
+            metrics.CALLBACK_ERRORS.inc(action, type(e).__name__)
         except Exception as e:
-            print(f"❌ Ошибка в handle_callback: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в handle_callback: %s", e)
+            metrics.CALLBACK_ERRORS.inc(action, type(e).__name__)
             try:
-                except BadRequest as e:
-                    print(f"❌ Ошибка Telegram API: {e}")
-                except NetworkError as e:
-                    print(f"❌ Сетевая ошибка: {e}")
-                except TimedOut as e:
-                    print(f"❌ Таймаут: {e}")
-                except Exception as e:
-                    print(f"❌ Неожиданная ошибка: {e}")
-                    traceback.print_exc()
                 await query.answer("❌ Произошла ошибка!")
             except:
                 pass
+        finally:
+            metrics.CALLBACK_SECONDS.observe(time.perf_counter() - started, action)
+            logger.debug("⏱ Нажатие обработано: %s", action)
+            log_setup.unbind(log_context)
+    
+    def _nonce_is_current(self, data):
+        """Кнопка игры из прошлого раунда или прошлой игры? Чаты без записи проверяются обработчиком"""
+        if data.action not in callback_codec.GAME_ACTIONS:
+            return True
+        nonce = self.round_nonces.get(data.chat_id)
+        return nonce is None or nonce == data.nonce
+    
+    def _remember_round(self, chat_id, game):
+        self.round_nonces[chat_id] = round_nonce(game)
     
     async def start_game(self, query):
         try:
             chat_id = query.message.chat_id
             user_id = query.from_user.id
             
-            # Создаем новую игру
-            self.active_games[chat_id] = {
-                'players': [user_id],
-                'player_names': {user_id: self._safe_text(query.from_user.first_name, f"Игрок1")},
-                'status': 'waiting',
-                'leader': user_id,
-                'round_number': 0,
-                'scores': {user_id: 0},
-                'submitted_memes': {},
-                'voting_options': {}
-            }
+            await self.db.add_user(
+                user_id,
+                self._safe_text(query.from_user.username),
+                self._safe_text(query.from_user.first_name),
+                self._safe_text(query.from_user.last_name)
+            )
             
-            await query.edit_message_text(
-                self._safe_text("🎮 Игра создана!\n"
-                f"Игроков: 1/{Config.MAX_PLAYERS}\n\n"
-                "Отправьте друзьям команду чтобы присоединиться:\n"
-                f"/join_{chat_id}\n\n"
-                "Когда все присоединятся, нажмите 'Начать игру'"),
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("▶️ Начать игру", callback_data=f"begin_{chat_id}")],
-                    [InlineKeyboardButton("❌ Отменить игру", callback_data=f"endgame_{chat_id}")]
-                ])
+            # Создаем новую игру; сообщение с меню становится ее табло
+            game = Game(nonce=random.randrange(1 << 16))
+            game.add_player(user_id, self._safe_text(query.from_user.first_name, f"Игрок1"))
+            game.board_message_id = query.message.message_id
+            await self.games.create(chat_id, game)
+            self._remember_round(chat_id, game)
+            
+            bot = query.get_bot()
+            targets = game.board_targets(chat_id)
+            await self.board.show(
+                chat_id, bot, targets,
+                self._board_text(chat_id, game), self._board_keyboard(chat_id, game)
             )
+            await self.board.pin(bot, targets)
         except Exception as e:
-            print(f"❌ Ошибка в start_game: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в start_game: %s", e)
             await query.answer("❌ Ошибка создания игры!")
     
-    async def join_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        try:
-            if not context.args:
-                await update.message.reply_text("❌ Используйте: /join_123456789")
-                return
-                
-            chat_id = int(context.args[0])
-            user = update.effective_user
-            
-            print(f"🔄 Игрок {self._safe_text(user.first_name)} пытается присоединиться к игре {chat_id}")
-            
-            if chat_id not in self.active_games:
-                await update.message.reply_text("❌ Игра не найдена или уже завершена!")
-                return
+    async def add_player(self, chat_id, user):
+        """Добавить пользователя в игру чата. Возвращает (ответ пользователю, игра или None, если не добавлен)"""
+        logger.debug("🔄 Игрок %s пытается присоединиться к игре %s", user.first_name, chat_id)
+        
+        # Состав быстрой игры собирает очередь
+        if is_quick_chat(chat_id):
+            return "❌ К быстрой игре нельзя присоединиться, используйте /quickplay", None
+        
+        # Повторяем, если игру одновременно изменил другой обработчик или воркер
+        for attempt in range(Config.STATE_CONFLICT_RETRIES):
+            game = await self.games.get(chat_id)
             
-            game = self.active_games[chat_id]
+            if not game or game.status == 'finished':
+                return "❌ Игра не найдена или уже завершена!", None
             
-            if user.id in game['players']:
-                await update.message.reply_text("✅ Вы уже в игре!")
-                return
+            if user.id in game.players:
+                return "✅ Вы уже в игре!", None
             
-            if len(game['players']) >= Config.MAX_PLAYERS:
-                await update.message.reply_text("❌ Максимум 8 игроков достигнут!")
-                return
+            if len(game.order) >= Config.MAX_PLAYERS:
+                return "❌ Максимум 8 игроков достигнут!", None
             
             # Безопасное имя игрока
-            safe_player_name = self._safe_text(user.first_name, f"Игрок{len(game['players']) + 1}")
+            safe_player_name = self._safe_text(user.first_name, f"Игрок{len(game.order) + 1}")
             
             # Добавляем игрока
-            game['players'].append(user.id)
-            game['player_names'][user.id] = safe_player_name
-            game['scores'][user.id] = 0
-            self.db.add_user(
-                user.id, 
-                self._safe_text(user.username),
-                self._safe_text(user.first_name),
-                self._safe_text(user.last_name)
-            )
-            
-            print(f"✅ Игрок {safe_player_name} добавлен в игру {chat_id}")
+            game.add_player(user.id, safe_player_name)
+            try:
+                await self.games.save(chat_id, game)
+                break
+            except StateConflict as e:
+                logger.warning("🔁 Конфликт состояния (%s/%s): %s",
+                                   attempt + 1, Config.STATE_CONFLICT_RETRIES, e)
+        else:
+            return "❌ Игра изменилась, попробуйте еще раз", None
+        
+        await self.db.add_user(
+            user.id, 
+            self._safe_text(user.username),
+            self._safe_text(user.first_name),
+            self._safe_text(user.last_name)
+        )
+        if game.session_id:
+            await self.db.add_player_to_session(game.session_id, user.id)
+        
+        logger.debug("✅ Игрок %s добавлен в игру %s", safe_player_name, chat_id)
+        return f"✅ Вы присоединились к игре!\nИгроков: {len(game.order)}/{Config.MAX_PLAYERS}", game
+    
+    @logged_command
+    async def join_game(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            if not context.args:
+                await update.message.reply_text("❌ Используйте: /join_123456789")
+                return
+                
+            chat_id = int(context.args[0])
+            reply, game = await self.add_player(chat_id, update.effective_user)
             
-            # Отправляем уведомление в чат
-            await context.bot.send_message(
-                chat_id, 
-                self._safe_text(f"✅ {safe_player_name} присоединился к игре!\nИгроков: {len(game['players'])}/{Config.MAX_PLAYERS}")
-            )
+            # Состав игры виден на табло: присоединения за секунду - одна правка
+            if game:
+                await self.update_board(chat_id, game, context.bot)
             
-            await update.message.reply_text(
-                self._safe_text(f"✅ Вы присоединились к игре!\nИгроков: {len(game['players'])}/{Config.MAX_PLAYERS}")
-            )
+            await update.message.reply_text(reply)
             
         except ValueError:
             await update.message.reply_text("❌ Используйте: /join_123456789")
         except Exception as e:
-            print(f"❌ Ошибка присоединения: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка присоединения: %s", e)
             await update.message.reply_text("❌ Ошибка присоединения к игре")
     
-    async def begin_game(self, query):
+    async def join_button(self, query, data):
+        """Кнопка «Присоединиться» на табло игры"""
+        try:
+            reply, game = await self.add_player(data.chat_id, query.from_user)
+            if game:
+                await self.update_board(data.chat_id, game, query.get_bot())
+            await query.answer(reply)
+        except Exception as e:
+            logger.exception("❌ Ошибка присоединения: %s", e)
+            await query.answer("❌ Ошибка присоединения к игре")
+    
+    async def enqueue_quickplay(self, user, bot):
+        """Поставить игрока в очередь быстрой игры. Возвращает (в очереди ли, ответ пользователю)"""
+        if user.id in self.matchmaker:
+            return False, f"⚡ Вы уже в очереди! Игроков в очереди: {len(self.matchmaker)}"
+        if user.id in self.matchmaker.playing:
+            return False, "❌ Вы уже в быстрой игре!"
+        
+        # Игра пройдет в ЛС: бот должен иметь право писать игроку
+        try:
+            await bot.send_message(
+                user.id,
+                f"⚡ Ищем соперников для быстрой игры...\nИгроков в очереди: {len(self.matchmaker) + 1}",
+                reply_markup=QUICKPLAY_QUEUE_MENU
+            )
+        except Forbidden:
+            return False, "❌ Сначала напишите боту в ЛС /start, игра пройдет там"
+        
+        await self.db.add_user(
+            user.id,
+            self._safe_text(user.username),
+            self._safe_text(user.first_name),
+            self._safe_text(user.last_name)
+        )
+        if not self.matchmaker.join(user.id, self._safe_text(user.first_name, "Игрок")):
+            return False, f"⚡ Вы уже в очереди! Игроков в очереди: {len(self.matchmaker)}"
+        await self.run_matchmaking(bot)
+        return True, "⚡ Вы в очереди быстрой игры! Игра начнется в ЛС с ботом."
+    
+    @logged_command
+    async def quickplay_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            queued, reply = await self.enqueue_quickplay(update.effective_user, context.bot)
+            # В ЛС о постановке в очередь уже сообщило сообщение с кнопкой выхода
+            if not queued or update.effective_chat.id != update.effective_user.id:
+                await update.message.reply_text(reply)
+        except Exception as e:
+            logger.exception("❌ Ошибка в quickplay_command: %s", e)
+            await update.message.reply_text("❌ Ошибка постановки в очередь")
+    
+    async def quickplay_button(self, query):
+        """Кнопка «Быстрая игра» в меню /start"""
+        try:
+            _, reply = await self.enqueue_quickplay(query.from_user, query.get_bot())
+            await query.answer(reply)
+        except Exception as e:
+            logger.exception("❌ Ошибка постановки в очередь: %s", e)
+            await query.answer("❌ Ошибка постановки в очередь")
+    
+    async def quickplay_leave(self, query):
+        if not self.matchmaker.leave(query.from_user.id):
+            await query.answer("❌ Вы не в очереди")
+            return
+        # Первый в очереди мог смениться - пересчитать таймер
+        await self.run_matchmaking(query.get_bot())
+        await query.answer()
+        await query.edit_message_text("🚪 Вы вышли из очереди быстрой игры")
+    
+    async def run_matchmaking(self, bot):
+        """Собрать игры из очереди, отпустить не дождавшихся и завести таймер следующей проверки"""
+        now = time.time()
+        groups = self.matchmaker.match(now)
+        expired = self.matchmaker.expire(now)
+        next_check = self.matchmaker.next_check()
+        if next_check is None:
+            self.quickplay_timer.cancel('quickplay')
+        else:
+            self.quickplay_timer.schedule('quickplay', next_check, bot)
+        
+        for group in groups:
+            for waiting in group:
+                metrics.QUICKPLAY_WAIT_SECONDS.observe(now - waiting.joined)
+        await asyncio.gather(
+            *(self.start_quick_game(group, bot) for group in groups),
+            *(self._quickplay_expired(waiting.user_id, bot) for waiting in expired)
+        )
+    
+    async def on_quickplay_deadline(self, key, bot):
+        await self.run_matchmaking(bot)
+    
+    async def _quickplay_expired(self, user_id, bot):
+        try:
+            await bot.send_message(user_id, "😔 Соперники не нашлись. Попробуйте /quickplay чуть позже!")
+        except Exception as e:
+            logger.error("❌ Не удалось уведомить игрока %s: %s", user_id, e)
+    
+    async def start_quick_game(self, group, bot):
+        """Игра из очереди: состав уже собран, сразу первый раунд, табло - в ЛС каждому игроку"""
+        chat_id = new_quick_chat_id()
+        while await self.games.get(chat_id) is not None:
+            chat_id = new_quick_chat_id()
+        log_context = log_setup.bind(chat_id=chat_id, handler='start_quick_game', started=time.perf_counter())
+        try:
+            game = Game(nonce=random.randrange(1 << 16))
+            for waiting in group:
+                game.add_player(waiting.user_id, waiting.name)
+            await self.games.create(chat_id, game)
+            self._remember_round(chat_id, game)
+            self.matchmaker.started(chat_id, game.order)
+            
+            await self.start_first_round(chat_id, game, bot, f"⚡ Игроки найдены: {len(game.order)}. Игра началась!")
+            logger.info("✅ Быстрая игра %s: %s игроков", chat_id, len(game.order))
+        except Exception as e:
+            logger.exception("❌ Ошибка создания быстрой игры: %s", e)
+            # Игроки могут встать в очередь снова
+            self.matchmaker.finished([waiting.user_id for waiting in group])
+        finally:
+            log_setup.unbind(log_context)
+    
+    async def begin_game(self, query, data):
         try:
-            chat_id = int(query.data.split('_')[1])
-            game = self.active_games.get(chat_id)
+            chat_id = data.chat_id
+            game = await self.games.get(chat_id)
             
             if not game:
                 await query.answer("❌ Игра не найдена!")
                 return
             
-            if len(game['players']) < Config.MIN_PLAYERS:
-                await query.answer(f"❌ Нужно минимум {Config.MIN_PLAYERS} игрока!")
+            if round_nonce(game) != data.nonce:
+                await query.answer("❌ Кнопка устарела!")
                 return
             
-            game['round_number'] = 1
-            game['status'] = 'choosing_situation'
+            if game.status != 'waiting':
+                await query.answer("❌ Игра уже идет!")
+                return
             
-            # Получаем случайные ситуации
-            situations = self.file_manager.get_random_situations(Config.SITUATIONS_TO_CHOOSE)
-            game['situations'] = situations
-            
-            # Создаем клавиатуру с ситуациями
-            keyboard = []
-            for i, situation in enumerate(situations):
-                safe_sit = self._safe_text(situation, f"Ситуация {i+1}")
-                button_text = safe_sit[:40] + "..." if len(safe_sit) > 40 else safe_sit
-                keyboard.append([InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"situation_{i}"
-                )])
-            
-            # Безопасное получение имени ведущего
-            leader_name = self._safe_text(game['player_names'][game['leader']], "Ведущий")
-            
-            await query.message.reply_text(
-                self._safe_text(f"📝 {leader_name}, выберите ситуацию для раунда {game['round_number']}:"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            if len(game.order) < Config.MIN_PLAYERS:
+                await query.answer(f"❌ Нужно минимум {Config.MIN_PLAYERS} игрока!")
+                return
             
+            await self.start_first_round(chat_id, game, query.get_bot())
             await query.answer("🎮 Игра началась!")
             
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка в begin_game: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в begin_game: %s", e)
             await query.answer("❌ Ошибка начала игры!")
     
-    async def choose_situation(self, query):
+    async def start_first_round(self, chat_id, game, bot, notice=None):
+        """Первый раунд: ситуации ведущему на табло, сессия в базе для статистики"""
+        game.round_number = 1
+        game.status = 'choosing_situation'
+        
+        # Получаем случайные ситуации
+        situations = self.file_manager.get_random_situations(Config.SITUATIONS_TO_CHOOSE)
+        game.situations = [situation.text for situation in situations]
+        
+        # Сначала фиксируем переход, потом побочные эффекты: при конфликте
+        # сессия в базе не создается дважды
+        await self.save_phase(chat_id, game, bot)
+        
+        # Сохраняем игру в базе для статистики
+        if not game.session_id:
+            game.session_id = await self.db.create_game_session(chat_id)
+            for player_id in game.order:
+                await self.db.add_player_to_session(game.session_id, player_id)
+            await self.games.save(chat_id, game)
+        
+        # Ситуации для ведущего - кнопками на табло
+        await self.update_board(chat_id, game, bot, notice)
+    
+    async def choose_situation(self, query, data):
         try:
-            chat_id = query.message.chat_id
-            game = self.active_games.get(chat_id)
+            chat_id = data.chat_id
+            game = await self.games.get(chat_id)
             
-            if not game or query.from_user.id != game['leader']:
+            if not game or query.from_user.id != game.leader:
                 await query.answer("❌ Только ведущий может выбирать!")
                 return
             
-            situation_index = int(query.data.split('_')[1])
-            chosen_situation = game['situations'][situation_index]
-            game['current_situation'] = chosen_situation
-            game['status'] = 'players_choosing'
-            game['submitted_memes'] = {}  # user_id -> meme_data
+            if round_nonce(game) != data.nonce:
+                await query.answer("❌ Кнопка устарела!")
+                return
+            
+            if game.status != 'choosing_situation':
+                await query.answer("❌ Ситуация уже выбрана!")
+                return
             
-            # Безопасное отображение ситуации
-            safe_situation = self._safe_text(chosen_situation, "Выбранная ситуация")
+            if data.arg >= len(game.situations):
+                await query.answer("❌ Неверная ситуация!")
+                return
             
-            await query.edit_message_text(
-                self._safe_text(f"🎲 РАУНД {game['round_number']} - СИТУАЦИЯ:\n\n{safe_situation}\n\nИгроки выбирают мемы..."), 
-                reply_markup=None
-            )
+            chosen_situation = game.situations[data.arg]
+            game.status = 'players_choosing'
+            game.idle_rounds = 0
+            
+            # Раздаем мемы каждому игроку (ведущий не выбирает мем) и сохраняем руки
+            # до отправки: игрок может выбрать мем, пока остальным еще идет раздача
+            players = [player_id for player_id in game.order if player_id != game.leader]
+            await self.file_manager.new_round(chat_id)
+            hands = {
+                player_id: self.file_manager.deal_memes(chat_id, Config.MEMES_PER_PLAYER)
+                for player_id in players
+            }
+            game.start_round(chosen_situation, hands)
+            await self.save_phase(chat_id, game, query.get_bot())
+            await self.db.count_meme_usage(dealt=[index for hand in hands.values() for index in hand])
+            # Ответ до раздачи: рассылка мемов занимает секунды
+            await query.answer()
+            
+            # Ситуация раунда - на табло
+            await self.update_board(chat_id, game, query.get_bot())
             
-            # Раздаем мемы каждому игроку в ЛС
-            for player_id in game['players']:
-                if player_id != game['leader']:  # Ведущий не выбирает мем
-                    await self.distribute_memes_to_player(chat_id, player_id, query.message.bot)
+            # Отправляем мемы в ЛС
+            await self.deal_hands(chat_id, game, players, query.get_bot())
             
-            print(f"✅ Выбрана ситуация: {safe_situation}")
+            logger.debug("✅ Выбрана ситуация: %s", chosen_situation)
             
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка в choose_situation: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в choose_situation: %s", e)
             await query.answer("❌ Ошибка выбора ситуации!")
     
-    async def distribute_memes_to_player(self, chat_id, player_id, bot):
+    async def deal_hands(self, chat_id, game, player_ids, bot):
+        """
+        Параллельная раздача мемов игрокам с ограничением числа одновременных отправок.
+        Ошибка или таймаут у одного игрока не задерживает остальных.
+        """
+        semaphore = asyncio.Semaphore(Config.DEAL_CONCURRENCY)
+        
+        async def deal(player_id):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(
+                        self.distribute_memes_to_player(chat_id, game, player_id, bot),
+                        timeout=Config.DEAL_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    logger.error("❌ Таймаут раздачи мемов игроку %s", player_id)
+                except Exception as e:
+                    logger.error("❌ Ошибка раздачи мемов игроку %s: %s", player_id, e)
+                return player_id, time.perf_counter() - started
+        
+        latencies = dict(await asyncio.gather(*(deal(player_id) for player_id in player_ids)))
+        
+        if latencies:
+            slowest = max(latencies, key=latencies.get)
+            logger.info("⏱ Раздача мемов в чате %s: %s игроков, мин %.2fс, медиана %.2fс, макс %.2fс (игрок %s)",
+                        chat_id, len(latencies), min(latencies.values()),
+                        statistics.median(latencies.values()), latencies[slowest], slowest)
+        return latencies
+    
+    async def distribute_memes_to_player(self, chat_id, game, player_id, bot):
         try:
-            # Получаем случайные мемы для игрока
-            memes = self.file_manager.get_random_memes(Config.MEMES_PER_PLAYER)
+            # Мемы игрока уже розданы и сохранены в его руке
+            memes = await self.file_manager.get_memes(game.players[player_id].hand)
             
             if not memes:
                 await bot.send_message(
@@ -307,383 +979,389 @@ class MemesGameBot:
                 )
                 return
             
-            # Сохраняем мемы для этого игрока
-            if player_id not in self.user_sessions:
-                self.user_sessions[player_id] = {}
-            
-            self.user_sessions[player_id][chat_id] = memes
-            
-            # Отправляем сообщение с кнопками для выбора мема
-            keyboard = []
-            for i, meme in enumerate(memes):
-                keyboard.append([InlineKeyboardButton(
-                    f"Мем {i+1}", 
-                    callback_data=f"memechoice_{chat_id}_{i}"
-                )])
-            
-            # Отправляем каждый мем как медиа
+            # Отправляем каждый мем как медиа (по file_id, если мем уже загружался)
             media_group = []
+            sent_memes = []
             for i, meme in enumerate(memes):
                 try:
-                    file_path = meme['path']
-                    if file_path != 'stub':  # Пропускаем заглушки
-                        if meme['filename'].lower().endswith(('.mp4', '.mov', '.avi')):
-                            media = InputMediaVideo(media=open(file_path, 'rb'), caption=f"Мем {i+1}" if i == 0 else "")
-                        else:
-                            media = InputMediaPhoto(media=open(file_path, 'rb'), caption=f"Мем {i+1}" if i == 0 else "")
-                        media_group.append(media)
+                    if meme['path'] != 'stub':  # Пропускаем заглушки
+                        media_group.append(self.media_cache.input_media(meme, f"Мем {i+1}" if i == 0 else ""))
+                        sent_memes.append(meme)
                 except Exception as e:
-                    print(f"❌ Ошибка загрузки мема {meme['filename']}: {e}")
+                    logger.error("❌ Ошибка загрузки мема %s: %s", meme['filename'], e)
                     continue
             
             if media_group:
-                await bot.send_media_group(player_id, media=media_group)
-            
-            # Безопасное получение ситуации
-            try:
-                situation = self._safe_text(self.active_games[chat_id]['current_situation'], "Интересная ситуация")
-            except:
-                situation = "Интересная ситуация"
+                messages = await bot.send_media_group(player_id, media=media_group)
+                await self.media_cache.remember_group(sent_memes, messages)
             
-            # Отправляем кнопки для выбора
+            # Отправляем кнопки для выбора: текст и клавиатура общие для всех игроков раунда
             await bot.send_message(
                 player_id,
-                self._safe_text(f"🎲 Выберите мем для ситуации:\n\n{situation}"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                self._choice_prompt(chat_id, game),
+                reply_markup=self._meme_choice_keyboard(chat_id, game, len(memes))
             )
             
         except Exception as e:
-            print(f"❌ Ошибка отправки мемов игроку {player_id}: {e}")
-            traceback.print_exc()
-            await bot.send_message(
-                player_id,
-                "❌ Произошла ошибка при загрузке мемов. Попробуйте позже."
-            )
+            logger.exception("❌ Ошибка отправки мемов игроку %s: %s", player_id, e)
+            try:
+                await bot.send_message(
+                    player_id,
+                    "❌ Произошла ошибка при загрузке мемов. Попробуйте позже."
+                )
+            except Exception as e:
+                logger.error("❌ Не удалось уведомить игрока %s: %s", player_id, e)
     
-    async def handle_meme_choice(self, query):
+    async def handle_meme_choice(self, query, data):
         try:
-            data_parts = query.data.split('_')
-            chat_id = int(data_parts[1])
-            meme_index = int(data_parts[2])
+            chat_id = data.chat_id
+            meme_index = data.arg
             user_id = query.from_user.id
             
-            game = self.active_games.get(chat_id)
-            if not game or game['status'] != 'players_choosing':
+            game = await self.games.get(chat_id)
+            if not game or game.status != 'players_choosing' or round_nonce(game) != data.nonce:
                 await query.answer("❌ Время выбора мемов истекло!")
                 return
             
-            if user_id in game['submitted_memes']:
+            player = game.players.get(user_id)
+            if player is not None and player.choice is not None:
                 await query.answer("❌ Вы уже отправили мем!")
                 return
             
-            # Получаем выбранный мем
-            user_memes = self.user_sessions.get(user_id, {}).get(chat_id, [])
-            if not user_memes or meme_index >= len(user_memes):
+            # Проверяем выбранный мем
+            if player is None or meme_index >= len(player.hand):
                 await query.answer("❌ Ошибка выбора мема!")
                 return
             
-            selected_meme = user_memes[meme_index]
-            
             # Сохраняем выбор игрока
-            game['submitted_memes'][user_id] = {
-                'meme': selected_meme,
-                'player_name': game['player_names'][user_id]
-            }
+            game.submit(user_id, meme_index)
+            game.idle_rounds = 0
+            await self.games.save(chat_id, game)
             
             await query.answer(f"✅ Вы выбрали мем {meme_index + 1}!")
             await query.edit_message_text("✅ Ваш мем отправлен! Ждем других игроков...")
             
             # Проверяем, все ли игроки сделали выбор (кроме ведущего)
-            expected_players = len(game['players']) - 1  # Все кроме ведущего
-            if len(game['submitted_memes']) >= expected_players:
-                await self.start_voting(chat_id, query.message.bot)
+            expected_players = len(game.order) - 1  # Все кроме ведущего
+            # Статус проверяется повторно: параллельный выбор мог уже запустить голосование
+            if len(game.submitted) >= expected_players and game.status == 'players_choosing':
+                await self.start_voting(chat_id, game, query.get_bot())
                 
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка обработки выбора мема: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка обработки выбора мема: %s", e)
             await query.answer("❌ Ошибка выбора мема!")
     
-    async def start_voting(self, chat_id, bot):
+    async def start_voting(self, chat_id, game, bot):
         try:
-            game = self.active_games[chat_id]
-            game['status'] = 'voting'
+            game.status = 'voting'
             
-            # Отправляем все мемы ведущему для голосования
-            leader_id = game['leader']
-            
-            if not game['submitted_memes']:
-                await bot.send_message(chat_id, "❌ Никто не отправил мемы! Раунд пропущен.")
-                await self.next_round_auto(chat_id, bot)
+            if not game.submitted:
+                await self.next_round_auto(chat_id, game, bot, "❌ Никто не отправил мемы! Раунд пропущен.")
                 return
             
-            # Отправляем каждый мем ведущему
-            voting_options = {}
-            media_group = []
-            
-            for i, (user_id, meme_data) in enumerate(game['submitted_memes'].items()):
-                meme = meme_data['meme']
-                player_name = meme_data['player_name']
-                option_id = str(uuid.uuid4())[:8]  # Уникальный ID для варианта голосования
-                voting_options[option_id] = user_id
-                
-                caption = self._safe_text(f"🎭 Вариант от {player_name}") if i == 0 else ""
-                
-                try:
-                    if meme['path'] != 'stub':  # Пропускаем заглушки
-                        if meme['filename'].lower().endswith(('.mp4', '.mov', '.avi')):
-                            media = InputMediaVideo(media=open(meme['path'], 'rb'), caption=caption)
-                        else:
-                            media = InputMediaPhoto(media=open(meme['path'], 'rb'), caption=caption)
-                        media_group.append(media)
-                except Exception as e:
-                    print(f"❌ Ошибка загрузки мема для голосования: {e}")
-                    continue
+            game.voting_options = list(game.submitted)
+            await self.save_phase(chat_id, game, bot)
             
-            game['voting_options'] = voting_options
+            # Отправляем все мемы ведущему; номер кнопки голосования - позиция в voting_options
+            if self.voting_sheets is None or not await self.send_voting_sheet(chat_id, game, bot):
+                await self.send_voting_album(chat_id, game, bot)
             
-            # Отправляем медиагруппу
-            if media_group:
-                await bot.send_media_group(leader_id, media=media_group)
-            
-            # Создаем клавиатуру для голосования
-            keyboard = []
-            temp_row = []
-            for i, option_id in enumerate(voting_options.keys()):
-                temp_row.append(InlineKeyboardButton(f"🎯 {i+1}", callback_data=f"vote_{chat_id}_{option_id}"))
-                if len(temp_row) >= 3:  # 3 кнопки в ряд
-                    keyboard.append(temp_row)
-                    temp_row = []
-            if temp_row:
-                keyboard.append(temp_row)
+            # Фаза голосования - на табло
+            await self.update_board(chat_id, game, bot)
             
-            await bot.send_message(
-                leader_id,
-                self._safe_text(f"📊 {game['player_names'][leader_id]}, выберите самый смешной мем для ситуации:\n\n{game['current_situation']}"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
+        except StateConflict:
+            raise
+        except Exception as e:
+            logger.exception("❌ Ошибка в start_voting: %s", e)
+    
+    def _vote_prompt(self, chat_id, game):
+        return self.renders.get(('vote_prompt', chat_id, round_nonce(game), game.leader, game.current_situation), lambda: (
+            f"📊 {game.name(game.leader)}, выберите самый смешной мем для ситуации:\n\n{game.current_situation}"
+        ))
+    
+    async def send_voting_sheet(self, chat_id, game, bot):
+        """Один лист со всеми мемами и кнопками голосования. False - лист не получился"""
+        memes = await self.file_manager.get_memes([game.players[user_id].choice for user_id in game.voting_options])
+        try:
+            sheet = await asyncio.get_running_loop().run_in_executor(
+                None, self.voting_sheets.render, memes
             )
+        except Exception as e:
+            logger.error("❌ Ошибка сборки листа голосования: %s", e)
+            return False
+        finally:
+            await self.media_cache.forget(self.voting_sheets.take_evicted())
+        
+        await self.media_cache.send(
+            bot, game.leader, sheet,
+            caption=self._vote_prompt(chat_id, game),
+            reply_markup=self._vote_keyboard(chat_id, game)
+        )
+        return True
+    
+    async def send_voting_album(self, chat_id, game, bot):
+        """Мемы ведущему медиагруппой и отдельное сообщение с кнопками голосования"""
+        leader_id = game.leader
+        media_group = []
+        sent_memes = []
+        memes = await self.file_manager.get_memes([game.players[user_id].choice for user_id in game.voting_options])
+        
+        for i, (user_id, meme) in enumerate(zip(game.voting_options, memes)):
+            player_name = game.name(user_id)
             
-            # Уведомляем всех в основном чате
-            await bot.send_message(
-                chat_id,
-                "📊 Все мемы отправлены! Ведущий выбирает победителя..."
-            )
+            caption = f"🎭 Вариант от {player_name}" if i == 0 else ""
             
-        except Exception as e:
-            print(f"❌ Ошибка в start_voting: {e}")
-            traceback.print_exc()
+            try:
+                if meme['path'] != 'stub':  # Пропускаем заглушки
+                    media_group.append(self.media_cache.input_media(meme, caption))
+                    sent_memes.append(meme)
+            except Exception as e:
+                logger.error("❌ Ошибка загрузки мема для голосования: %s", e)
+                continue
+        
+        if media_group:
+            messages = await bot.send_media_group(leader_id, media=media_group)
+            await self.media_cache.remember_group(sent_memes, messages)
+        
+        await bot.send_message(
+            leader_id,
+            self._vote_prompt(chat_id, game),
+            reply_markup=self._vote_keyboard(chat_id, game)
+        )
     
-    async def handle_vote(self, query):
+    async def handle_vote(self, query, data):
         try:
-            data_parts = query.data.split('_')
-            chat_id = int(data_parts[1])
-            option_id = data_parts[2]
+            chat_id = data.chat_id
             voter_id = query.from_user.id
             
-            game = self.active_games.get(chat_id)
-            if not game or game['status'] != 'voting':
+            game = await self.games.get(chat_id)
+            if not game or game.status != 'voting' or round_nonce(game) != data.nonce:
                 await query.answer("❌ Голосование завершено!")
                 return
             
-            if voter_id != game['leader']:
+            if voter_id != game.leader:
                 await query.answer("❌ Только ведущий может голосовать!")
                 return
             
-            if option_id not in game['voting_options']:
+            # Кнопка несет номер варианта в порядке голосования
+            if data.arg >= len(game.voting_options):
                 await query.answer("❌ Неверный вариант!")
                 return
             
             # Находим победителя
-            winner_id = game['voting_options'][option_id]
-            winner_name = self._safe_text(game['player_names'][winner_id], "Победитель")
-            
-            # Обновляем счет
-            game['scores'][winner_id] = game['scores'].get(winner_id, 0) + 1
-            
-            # Отправляем результаты в чат
-            winner_meme = game['submitted_memes'][winner_id]['meme']
-            
-            try:
-                if winner_meme['path'] != 'stub' and winner_meme['filename'].lower().endswith(('.mp4', '.mov', '.avi')):
-                    await query.message.bot.send_video(
-                        chat_id,
-                        video=open(winner_meme['path'], 'rb'),
-                        caption=self._safe_text(f"🏆 ПОБЕДИТЕЛЬ РАУНДА: {winner_name}!\n\n"
-                               f"Ситуация: {game['current_situation']}\n\n"
-                               f"💯 Текущие очки:\n" + 
-                               "\n".join([f"{name}: {score}" for name, score in sorted(
-                                   [(self._safe_text(game['player_names'][pid]), score) for pid, score in game['scores'].items()],
-                                   key=lambda x: x[1], reverse=True
-                               )]))
-                    )
-                elif winner_meme['path'] != 'stub':
-                    await query.message.bot.send_photo(
-                        chat_id,
-                        photo=open(winner_meme['path'], 'rb'),
-                        caption=self._safe_text(f"🏆 ПОБЕДИТЕЛЬ РАУНДА: {winner_name}!\n\n"
-                               f"Ситуация: {game['current_situation']}\n\n"
-                               f"💯 Текущие очки:\n" + 
-                               "\n".join([f"{name}: {score}" for name, score in sorted(
-                                   [(self._safe_text(game['player_names'][pid]), score) for pid, score in game['scores'].items()],
-                                   key=lambda x: x[1], reverse=True
-                               )]))
-                    )
-                else:
-                    await query.message.bot.send_message(
-                        chat_id,
-                        self._safe_text(f"🏆 ПОБЕДИТЕЛЬ РАУНДА: {winner_name}!\n\n"
-                        f"Ситуация: {game['current_situation']}\n\n"
-                        f"💯 Текущие очки:\n" + 
-                        "\n".join([f"{name}: {score}" for name, score in sorted(
-                            [(self._safe_text(game['player_names'][pid]), score) for pid, score in game['scores'].items()],
-                            key=lambda x: x[1], reverse=True
-                        )]))
-                    )
-            except Exception as e:
-                print(f"❌ Ошибка отправки мема победителя: {e}")
-                await query.message.bot.send_message(
-                    chat_id,
-                    self._safe_text(f"🏆 ПОБЕДИТЕЛЬ РАУНДА: {winner_name}!\n\n"
-                    f"Ситуация: {game['current_situation']}\n\n"
-                    f"💯 Текущие очки:\n" + 
-                    "\n".join([f"{name}: {score}" for name, score in sorted(
-                        [(self._safe_text(game['player_names'][pid]), score) for pid, score in game['scores'].items()],
-                        key=lambda x: x[1], reverse=True
-                    )]))
+            winner_id = game.voting_options[data.arg]
+            winner = game.players[winner_id]
+            
+            # Обновляем счет и сразу закрываем голосование, чтобы повторное нажатие не засчиталось
+            game.award(winner_id)
+            game.status = 'round_complete'
+            game.idle_rounds = 0
+            await self.save_phase(chat_id, game, query.get_bot())
+            if game.session_id:
+                await self.db.record_round_result(
+                    game.session_id, game.round_number, game.current_situation, winner_id
                 )
+            await self.db.count_meme_usage(won=winner.choice)
             
-            # Предлагаем начать следующий раунд
-            game['status'] = 'round_complete'
+            await query.answer()
             
-            keyboard = [
-                [InlineKeyboardButton("➡️ Следующий раунд", callback_data=f"nextround_{chat_id}")],
-                [InlineKeyboardButton("🏁 Завершить игру", callback_data=f"endgame_{chat_id}")]
-            ]
+            # Мем победителя - в чат, очки и кнопки следующего раунда - на табло
+            bot = query.get_bot()
+            winner_meme = await self.file_manager.get_meme(winner.choice)
+            results = (f"🏆 ПОБЕДИТЕЛЬ РАУНДА {game.round_number}: {winner.name}!\n\n"
+                       f"Ситуация: {game.current_situation}")
+            await self.update_board(chat_id, game, bot, f"🏆 Раунд {game.round_number}: победил {winner.name}")
             
-            await query.edit_message_text(
-                "✅ Голосование завершено!",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            await self.announce_winner(self._game_chats(chat_id, game), bot, winner_meme, results)
             
+            # Убираем кнопки голосования у ведущего (лист голосования - фото с подписью)
+            if query.message.photo:
+                await query.edit_message_caption("✅ Голосование завершено!")
+            else:
+                await query.edit_message_text("✅ Голосование завершено!")
+            
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка обработки голоса: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка обработки голоса: %s", e)
             await query.answer("❌ Ошибка голосования!")
     
-    async def next_round(self, query):
+    async def announce_winner(self, chats, bot, meme, results):
+        """Мем победителя с подписью в чаты игры; в первый - загрузкой, в остальные - по file_id"""
+        async def send(target):
+            try:
+                if meme['path'] != 'stub':
+                    await self.media_cache.send(bot, target, meme, caption=results)
+                else:
+                    await bot.send_message(target, results)
+            except Exception as e:
+                logger.error("❌ Ошибка отправки мема победителя: %s", e)
+                await bot.send_message(target, results)
+        
+        await send(chats[0])
+        if len(chats) > 1:
+            results_by_chat = await asyncio.gather(*(send(target) for target in chats[1:]), return_exceptions=True)
+            for target, result in zip(chats[1:], results_by_chat):
+                if isinstance(result, Exception):
+                    logger.error("❌ Не удалось отправить итог раунда в чат %s: %s", target, result)
+    
+    async def next_round(self, query, data):
         try:
-            chat_id = int(query.data.split('_')[1])
-            await self.next_round_auto(chat_id, query.message.bot)
+            chat_id = data.chat_id
+            game = await self.games.get(chat_id)
+            if not game or game.status != 'round_complete' or round_nonce(game) != data.nonce:
+                await query.answer("❌ Раунд уже начат!")
+                return
+            await self.next_round_auto(chat_id, game, query.get_bot())
             await query.answer("🔄 Подготовка следующего раунда...")
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка в next_round: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в next_round: %s", e)
             await query.answer("❌ Ошибка перехода к следующему раунду!")
     
-    async def next_round_auto(self, chat_id, bot):
+    async def next_round_auto(self, chat_id, game, bot, notice=None):
         try:
-            game = self.active_games.get(chat_id)
-            if not game:
-                return
-            
             # Меняем ведущего по кругу
-            current_leader_index = game['players'].index(game['leader'])
-            next_leader_index = (current_leader_index + 1) % len(game['players'])
-            game['leader'] = game['players'][next_leader_index]
-            game['round_number'] += 1
+            game.rotate_leader()
+            game.round_number += 1
             
             # Начинаем новый раунд
-            game['status'] = 'choosing_situation'
+            game.status = 'choosing_situation'
             situations = self.file_manager.get_random_situations(Config.SITUATIONS_TO_CHOOSE)
-            game['situations'] = situations
-            
-            # Создаем клавиатуру с ситуациями
-            keyboard = []
-            for i, situation in enumerate(situations):
-                safe_sit = self._safe_text(situation, f"Ситуация {i+1}")
-                button_text = safe_sit[:40] + "..." if len(safe_sit) > 40 else safe_sit
-                keyboard.append([InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"situation_{i}"
-                )])
+            game.situations = [situation.text for situation in situations]
+            await self.save_phase(chat_id, game, bot)
             
-            leader_name = self._safe_text(game['player_names'][game['leader']], "Ведущий")
-            
-            await bot.send_message(
-                chat_id,
-                self._safe_text(f"🔄 РАУНД {game['round_number']}\n📝 {leader_name}, выберите ситуацию:"),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            # Новый ведущий выбирает ситуацию кнопками на табло
+            await self.update_board(chat_id, game, bot, notice)
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка в next_round_auto: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в next_round_auto: %s", e)
     
-    async def end_game(self, query):
+    async def end_game(self, query, data):
         try:
-            chat_id = int(query.data.split('_')[1])
-            game = self.active_games.get(chat_id)
+            chat_id = data.chat_id
+            game = await self.games.get(chat_id)
             
-            if not game:
+            if not game or game.status == 'finished':
                 await query.answer("❌ Игра не найдена!")
                 return
             
-            # Определяем победителя
-            if game['scores']:
-                winner_id = max(game['scores'], key=game['scores'].get)
-                winner_name = self._safe_text(game['player_names'][winner_id], "Победитель")
-                winner_score = game['scores'][winner_id]
-                
-                # Формируем таблицу результатов
-                results = "🏆 ФИНАЛЬНЫЕ РЕЗУЛЬТАТЫ:\n\n"
-                sorted_players = sorted(game['scores'].items(), key=lambda x: x[1], reverse=True)
-                
-                for i, (player_id, score) in enumerate(sorted_players, 1):
-                    player_name = self._safe_text(game['player_names'][player_id], f"Игрок {i}")
-                    results += f"{i}. {player_name}: {score} очков\n"
-                
-                results += f"\n🎉 ПОБЕДИТЕЛЬ: {winner_name} с {winner_score} очками!"
-                
-                await query.edit_message_text(self._safe_text(results))
-            else:
-                await query.edit_message_text("🎮 Игра завершена! Никто не набрал очков.")
+            if round_nonce(game) != data.nonce:
+                await query.answer("❌ Кнопка устарела!")
+                return
             
-            # Удаляем игру из активных
-            if chat_id in self.active_games:
-                del self.active_games[chat_id]
-                
+            results = await self.finish_game(chat_id, game, query.get_bot())
+            if not game.board_targets(chat_id):
+                await query.edit_message_text(results)
+            
+        except StateConflict:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка в end_game: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в end_game: %s", e)
             await query.answer("❌ Ошибка завершения игры!")
     
+    async def finish_game(self, chat_id, game, bot, headline=None):
+        """Завершить игру, записать итоги и показать их на табло; возвращает текст результатов"""
+        # Сначала помечаем игру завершенной (compare-and-set), потом удаляем:
+        # повторное нажатие или другой воркер не запишет итоги дважды
+        game.status = 'finished'
+        await self.games.save(chat_id, game)
+        await self.games.delete(chat_id)
+        self.deadlines.cancel(chat_id)
+        self.round_nonces.pop(chat_id, None)
+        self.file_manager.drop_deck(chat_id)
+        if is_quick_chat(chat_id):
+            self.matchmaker.finished(game.order)
+        
+        # Записываем итоги игры одной транзакцией
+        if game.session_id:
+            await self.db.complete_game_session(
+                game.session_id, {player.user_id: player.score for player in game.players.values()}
+            )
+        
+        results = self._final_results(game)
+        if headline:
+            results = f"{headline}\n\n{results}"
+        targets = game.board_targets(chat_id)
+        if targets:
+            await self.board.finish(chat_id, bot, targets, results)
+        return results
+    
+    def _final_results(self, game):
+        # Определяем победителя
+        if not game.players:
+            return "🎮 Игра завершена! Никто не набрал очков."
+        
+        # Формируем таблицу результатов: рейтинг игры уже упорядочен по очкам
+        scoreboard = game.scoreboard()
+        lines = ["🏆 ФИНАЛЬНЫЕ РЕЗУЛЬТАТЫ:\n"]
+        for i, player in enumerate(scoreboard, 1):
+            lines.append(f"{i}. {player.name}: {player.score} очков")
+        
+        winner = scoreboard[0]
+        lines.append(f"\n🎉 ПОБЕДИТЕЛЬ: {winner.name} с {winner.score} очками!")
+        return "\n".join(lines)
+    
+    async def resume_games(self, bot):
+        """Повторно выдать клавиатуры играм, восстановленным после перезапуска"""
+        semaphore = asyncio.Semaphore(Config.RESUME_CONCURRENCY)
+        
+        async def resume(chat_id):
+            async with semaphore:
+                try:
+                    await self.resume_game(chat_id, bot)
+                except Exception as e:
+                    logger.error("❌ Ошибка продолжения игры %s: %s", chat_id, e)
+        
+        await asyncio.gather(*(resume(chat_id) for chat_id in list(self.games.local_games())))
+        logger.info("✅ Восстановленные игры продолжены")
+    
+    async def resume_game(self, chat_id, bot):
+        game = await self.games.get(chat_id)
+        if not game:
+            return
+        
+        notice = "♻️ Бот был перезапущен, игра продолжается!"
+        status = game.status
+        
+        # Табло с кнопками текущей фазы (игре из старого снимка оно создается)
+        await self.update_board(chat_id, game, bot, notice)
+        
+        if status == 'players_choosing':
+            # Мемы уже в ЛС у игроков, достаточно повторить кнопки выбора
+            prompt = f"{notice}\n{self._choice_prompt(chat_id, game)}"
+            for player in game.players.values():
+                if player.hand and player.choice is None:
+                    await bot.send_message(
+                        player.user_id,
+                        prompt,
+                        reply_markup=self._meme_choice_keyboard(chat_id, game, len(player.hand))
+                    )
+        elif status == 'voting':
+            await bot.send_message(
+                game.leader,
+                f"{notice}\n{self._vote_prompt(chat_id, game)}",
+                reply_markup=self._vote_keyboard(chat_id, game)
+            )
+        
+        # Дедлайн фазы переживает перезапуск (в старых снимках его нет - отсчет заново)
+        duration = self._phase_duration(status)
+        if duration:
+            if not game.deadline:
+                game.deadline = time.time() + duration
+            self._arm_deadline(chat_id, game, bot)
+    
     async def show_rules(self, query):
-        rules_text = """
-📋 ПРАВИЛА ИГРЫ:
-
-👥 Игроков: 2-8 человек
-🃏 Каждый получает по 6 карточек с мемами
-👑 Первый ведущий - создатель игры
-📖 Ведущий выбирает и зачитывает ситуацию
-😂 Игроки выбирают самый подходящий мем
-🏆 Ведущий выбирает победителя раунда
-🔄 Ведущий меняется каждый раунд
-🎯 Побеждает набравший больше всего очков
-
-🎥 Мемы могут быть как фото, так и видео!
-
-📝 КАК ИГРАТЬ:
-1. Создайте игру командой /start
-2. Пригласите друзей: /join_123456789
-3. Ведущий выбирает ситуацию
-4. Игроки выбирают мемы из ЛС
-5. Ведущий голосует за лучший мем
-6. Игра продолжается до завершения!
-        """
-        await query.edit_message_text(rules_text)
+        await query.edit_message_text(RULES_TEXT)
     
     async def show_stats(self, query):
         try:
             user_id = query.from_user.id
-            user_stats = self.db.get_user_stats(user_id)
+            user_stats = await self.db.get_user_stats(user_id)
             
             stats_text = f"""
 📊 СТАТИСТИКА {self._safe_text(query.from_user.first_name)}:
@@ -695,33 +1373,40 @@ class MemesGameBot:
             
             await query.edit_message_text(stats_text)
         except Exception as e:
-            print(f"❌ Ошибка в show_stats: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в show_stats: %s", e)
             await query.answer("❌ Ошибка загрузки статистики!")
     
-    async def show_leaderboard(self, query):
-        try:
-            leaderboard_data = self.db.get_leaderboard(10)
-            
-            if not leaderboard_data:
-                await query.edit_message_text("📊 Пока никто не играл! Будьте первым!")
-                return
-            
+    async def render_leaderboard(self):
+        """Текст лидерборда; пересобирается только после изменения очков"""
+        version = self.db.leaderboard_version
+        if self._leaderboard_text is not None and self._leaderboard_text[0] == version:
+            return self._leaderboard_text[1]
+        
+        leaderboard_data = await self.db.get_leaderboard(10)
+        
+        if not leaderboard_data:
+            leaderboard_text = "📊 Пока никто не играл! Будьте первым!"
+        else:
             leaderboard_text = "🏆 ТОП-10 ИГРОКОВ:\n\n"
             for i, player in enumerate(leaderboard_data, 1):
                 username = self._safe_text(player['username'] or player['first_name'], f"Игрок {i}")
                 leaderboard_text += f"{i}. {username} - {player['total_score']} очков ({player['games_played']} игр)\n"
-            
-            await query.edit_message_text(leaderboard_text)
+        
+        self._leaderboard_text = (version, leaderboard_text)
+        return leaderboard_text
+    
+    async def show_leaderboard(self, query):
+        try:
+            await query.edit_message_text(await self.render_leaderboard())
         except Exception as e:
-            print(f"❌ Ошибка в show_leaderboard: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в show_leaderboard: %s", e)
             await query.answer("❌ Ошибка загрузки лидерборда!")
     
+    @logged_command
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
-            user_stats = self.db.get_user_stats(user_id)
+            user_stats = await self.db.get_user_stats(user_id)
             
             stats_text = f"""
 📊 СТАТИСТИКА {self._safe_text(update.effective_user.first_name)}:
@@ -733,36 +1418,40 @@ class MemesGameBot:
             
             await update.message.reply_text(stats_text)
         except Exception as e:
-            print(f"❌ Ошибка в stats_command: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в stats_command: %s", e)
             await update.message.reply_text("❌ Ошибка загрузки статистики!")
     
+    @logged_command
     async def leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            leaderboard_data = self.db.get_leaderboard(10)
-            
-            if not leaderboard_data:
-                await update.message.reply_text("📊 Пока никто не играл! Будьте первым!")
-                return
-            
-            leaderboard_text = "🏆 ТОП-10 ИГРОКОВ:\n\n"
-            for i, player in enumerate(leaderboard_data, 1):
-                username = self._safe_text(player['username'] or player['first_name'], f"Игрок {i}")
-                leaderboard_text += f"{i}. {username} - {player['total_score']} очков ({player['games_played']} игр)\n"
-            
-            await update.message.reply_text(leaderboard_text)
+            await update.message.reply_text(await self.render_leaderboard())
         except Exception as e:
-            print(f"❌ Ошибка в leaderboard_command: {e}")
-            traceback.print_exc()
+            logger.exception("❌ Ошибка в leaderboard_command: %s", e)
             await update.message.reply_text("❌ Ошибка загрузки лидерборда!")
     
+    @logged_command
+    async def reload_memes_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Полное пересканирование библиотеки - служебная команда, не для игроков
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            await update.message.reply_text("⛔ Команда доступна только администраторам бота")
+            return
+        try:
+            memes_count = await self.file_manager.reload_memes()
+            await update.message.reply_text(f"🔄 Каталог мемов обновлен: {memes_count} мемов")
+        except Exception as e:
+            logger.exception("❌ Ошибка в reload_memes_command: %s", e)
+            await update.message.reply_text("❌ Ошибка обновления каталога мемов!")
+    
+    @logged_command
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text = """
 🤖 КОМАНДЫ БОТА:
 
 /start - Начать игру
+/quickplay - Быстрая игра со случайными соперниками
 /stats - Показать статистику
 /leaderboard - Таблица лидеров
+/reload_memes - Перечитать папку с мемами (для администраторов)
 /help - Показать справку
 
 🎮 КАК ИГРАТЬ:
@@ -777,34 +1466,83 @@ class MemesGameBot:
         """
         await update.message.reply_text(help_text)
 
+def register_handlers(application, bot):
+    # Добавляем обработчики команд
+    application.add_handler(CommandHandler("start", bot.start))
+    application.add_handler(CommandHandler("join", bot.join_game))
+    application.add_handler(CommandHandler("quickplay", bot.quickplay_command))
+    application.add_handler(CommandHandler("stats", bot.stats_command))
+    application.add_handler(CommandHandler("leaderboard", bot.leaderboard_command))
+    application.add_handler(CommandHandler("reload_memes", bot.reload_memes_command))
+    application.add_handler(CommandHandler("help", bot.help_command))
+    
+    # Добавляем обработчики callback-запросов
+    application.add_handler(CallbackQueryHandler(bot.handle_callback))
+
+def build_application(bot, token=None, request=None):
+    """Приложение с обработчиками бота; request подменяется в бенчмарках"""
+    builder = (
+        Application.builder()
+        .token(token or Config.BOT_TOKEN)
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+        .post_init(bot.post_init)
+        .post_shutdown(bot.post_shutdown)
+    )
+    if bot.rate_limiter is not None:
+        builder = builder.rate_limiter(bot.rate_limiter)
+    # Время и коды ответов Bot API по методам (пул соединений - как у PTB по умолчанию)
+    builder = builder.request(metrics.InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    application = builder.build()
+    register_handlers(application, bot)
+    return application
+
 def main():
+    if Config.BOT_MODE == 'router':
+        # Роутер не обрабатывает апдейты сам, а раздает их воркерам по chat_id;
+        # воркеры запускаются в режиме webhook на своих портах с тем же WEBHOOK_URL
+        if not Config.WEBHOOK_SECRET:
+            logger.error("WEBHOOK_SECRET не задан! Нужен для режима router")
+            return
+        from worker_router import run_router
+        asyncio.run(run_router())
+        return
+    
     if not Config.BOT_TOKEN:
-        logging.error("BOT_TOKEN не найден! Проверьте .env файл")
+        logger.error("BOT_TOKEN не найден! Проверьте .env файл")
         return
     
     try:
-        application = Application.builder().token(Config.BOT_TOKEN).build()
         bot = MemesGameBot()
+        application = build_application(bot)
         
         # Проверяем файлы
         bot.file_manager.check_files()
         
-        # Добавляем обработчики команд
-        application.add_handler(CommandHandler("start", bot.start))
-        application.add_handler(CommandHandler("join", bot.join_game))
-        application.add_handler(CommandHandler("stats", bot.stats_command))
-        application.add_handler(CommandHandler("leaderboard", bot.leaderboard_command))
-        application.add_handler(CommandHandler("help", bot.help_command))
-        
-        # Добавляем обработчики callback-запросов
-        application.add_handler(CallbackQueryHandler(bot.handle_callback))
-        
-        print("✅ Бот запускается...")
-        application.run_polling()
+        if Config.BOT_MODE == 'webhook':
+            if not Config.WEBHOOK_URL:
+                logger.error("WEBHOOK_URL не задан! Нужен для режима webhook")
+                return
+            if not Config.WEBHOOK_SECRET:
+                # Telegram подписывает апдейты секретом; без него webhook примет апдейты от кого угодно
+                logger.error("WEBHOOK_SECRET не задан! Нужен для режима webhook")
+                return
+            logger.info("✅ Бот запускается в режиме webhook на порту %s...", Config.PORT)
+            application.run_webhook(
+                listen=Config.WEBHOOK_LISTEN,
+                port=Config.PORT,
+                url_path=Config.WEBHOOK_PATH,
+                webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}",
+                secret_token=Config.WEBHOOK_SECRET,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS
+            )
+        else:
+            logger.info("✅ Бот запускается...")
+            application.run_polling()
         
     except Exception as e:
-        print(f"❌ Критическая ошибка при запуске бота: {e}")
-        traceback.print_exc()
+        logger.exception("❌ Критическая ошибка при запуске бота: %s", e)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,71 @@
+import base64
+import binascii
+import struct
+from collections import namedtuple
+
+# Версия формата: кнопки старого формата или версии отбрасываются при разборе
+VERSION = 1
+
+# Коды действий
+START_GAME = 1
+SHOW_RULES = 2
+SHOW_STATS = 3
+SHOW_LEADERBOARD = 4
+QUICKPLAY = 5
+QUICKPLAY_LEAVE = 6
+BEGIN = 10
+SITUATION = 11
+MEME_CHOICE = 12
+VOTE = 13
+NEXT_ROUND = 14
+END_GAME = 15
+JOIN = 16
+
+# Кнопки игры несут чат игры, nonce раунда и аргумент (номер ситуации, мема, варианта)
+GAME_ACTIONS = frozenset({BEGIN, SITUATION, MEME_CHOICE, VOTE, NEXT_ROUND, END_GAME, JOIN})
+
+# Кнопки очереди быстрой игры: обслуживаются воркером с очередью
+QUICKPLAY_ACTIONS = frozenset({QUICKPLAY, QUICKPLAY_LEAVE})
+
+_MENU = struct.Struct('>BB')        # версия, действие
+_GAME = struct.Struct('>BBqHH')     # версия, действие, chat_id, nonce, аргумент
+
+# 14 байт кнопки игры -> 19 символов base64url (лимит Telegram - 64 байта)
+CallbackData = namedtuple('CallbackData', 'action chat_id nonce arg')
+
+
+class InvalidCallback(ValueError):
+    """callback_data не разбирается: кнопка старого формата или подделана"""
+
+
+def encode(action, chat_id=0, nonce=0, arg=0):
+    if action in GAME_ACTIONS:
+        raw = _GAME.pack(VERSION, action, chat_id, nonce & 0xFFFF, arg)
+    else:
+        raw = _MENU.pack(VERSION, action)
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode(data):
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidCallback(data)
+
+    if len(raw) < _MENU.size or raw[0] != VERSION:
+        raise InvalidCallback(data)
+
+    if raw[1] in GAME_ACTIONS:
+        if len(raw) != _GAME.size:
+            raise InvalidCallback(data)
+        _, action, chat_id, nonce, arg = _GAME.unpack(raw)
+        return CallbackData(action, chat_id, nonce, arg)
+
+    if len(raw) != _MENU.size:
+        raise InvalidCallback(data)
+    return CallbackData(raw[1], 0, 0, 0)
+
+
+def round_nonce(game):
+    """Nonce кнопок текущего раунда: меняется с каждым раундом и каждой новой игрой в чате"""
+    return (game.nonce + game.round_number) & 0xFFFF
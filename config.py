@@ -5,15 +5,120 @@ load_dotenv()
 
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
+    # Администраторы бота (user_id через запятую): им доступны служебные команды вроде /reload_memes
+    ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+    
+    # Режим получения апдейтов: 'polling', 'webhook' или 'router' (раздача апдейтов воркерам)
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес приложения, например https://app.herokuapp.com
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    # Обязателен в режимах webhook и router: проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    # (1-256 символов A-Z, a-z, 0-9, _ и -)
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    WEBHOOK_LISTEN = '0.0.0.0'
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+    PORT = int(os.getenv('PORT', '8443'))
+    # Сколько апдейтов обрабатывается одновременно
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+    
+    # Ограничение исходящих запросов (лимиты Telegram): общий, на личный чат и на группу
+    RATE_LIMIT = os.getenv('RATE_LIMIT', '1') == '1'
+    RATE_LIMIT_GLOBAL = 30  # запросов в секунду на бота
+    RATE_LIMIT_PRIVATE = 1  # сообщений в секунду в личный чат
+    RATE_LIMIT_PRIVATE_BURST = 3
+    RATE_LIMIT_GROUP_PER_MINUTE = 20
+    RATE_LIMIT_GROUP_BURST = 5
+    RATE_LIMIT_MAX_RETRIES = 3  # повторов после RetryAfter, дальше ошибка уходит вызывающему
+    RATE_LIMIT_MAX_CHATS = 10000  # при скольких бакетах чатов забывать простаивающие
+    
+    # Метрики в формате Prometheus на http://METRICS_LISTEN:METRICS_PORT/metrics (0 - сервер не запускается)
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+    
+    # Логи: уровень (DEBUG, INFO, WARNING, ERROR) и формат: 'json' - строка JSON на запись, 'text' - для разработки
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    
+    # Хранилище игр: 'memory' (один процесс) или 'sqlite' (общее для нескольких воркеров)
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH', 'shared_state.db')
+    # Сколько раз повторять обработчик, если игру одновременно изменил другой воркер
+    STATE_CONFLICT_RETRIES = 3
+    # Режим 'router': адреса воркеров через запятую, чат обслуживает WORKER_URLS[chat_id % N]
+    WORKER_URLS = [url.strip() for url in os.getenv('WORKER_URLS', '').split(',') if url.strip()]
+    # Воркер с общим хранилищем: его номер в WORKER_URLS и число воркеров. После перезапуска
+    # он продолжает только свои игры - те, что роутер отдает ему по chat_id % WORKER_COUNT
+    WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+    WORKER_COUNT = int(os.getenv('WORKER_COUNT', str(len(WORKER_URLS) or 1)))
     
     MAX_PLAYERS = 8
     MIN_PLAYERS = 2
     MEMES_PER_PLAYER = 6
     SITUATIONS_TO_CHOOSE = 10
+    # Дедлайны фаз, секунд: выбор ситуации ведущим, выбор мемов игроками, голосование ведущего.
+    # После дедлайна игра продолжается сама; после MAX_IDLE_ROUNDS пропущенных подряд раундов завершается
+    SITUATION_DURATION = 60
     ROUND_DURATION = 120
+    VOTING_DURATION = 60
+    MAX_IDLE_ROUNDS = 3
+    # Табло игры правится не чаще раза в BOARD_DEBOUNCE секунд: события за это время сливаются в одну правку
+    BOARD_DEBOUNCE = float(os.getenv('BOARD_DEBOUNCE', '1.0'))
+    # Готовых клавиатур и текстов в кэше отрисовки (ключ - чат и раунд)
+    RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '4096'))
+    # Быстрая игра (/quickplay): игроки из любых чатов, игра в ЛС. Полный стол собирается сразу,
+    # за QUICKPLAY_TARGET_WAIT секунд ожидания первого в очереди требование снижается до MIN_PLAYERS;
+    # не дождавшийся соперников за QUICKPLAY_MAX_WAIT секунд покидает очередь
+    QUICKPLAY_TARGET_WAIT = float(os.getenv('QUICKPLAY_TARGET_WAIT', '30'))
+    QUICKPLAY_MAX_WAIT = float(os.getenv('QUICKPLAY_MAX_WAIT', '300'))
+    
+    # Параллельная раздача мемов: сколько игроков обслуживается одновременно
+    # и сколько секунд ждать отправку одному игроку
+    DEAL_CONCURRENCY = int(os.getenv('DEAL_CONCURRENCY', '4'))
+    DEAL_TIMEOUT = 60
+    
+    # Сколько восстановленных после перезапуска игр продолжается одновременно
+    RESUME_CONCURRENCY = 10
     
     MEMES_DIR = os.path.join('data', 'memes')
     SITUATIONS_FILE = os.path.join('data', 'situations.txt')
-    USED_MEMES_FILE = os.path.join('data', 'used_memes.json')
+    # Прежний JSON-манифест каталога: переносится в индекс мемов (meme_index.py) при первом запуске
+    MEMES_MANIFEST_FILE = os.path.join('data', 'memes_manifest.json')
+    # Сколько недавно запрошенных мемов каталог держит в памяти (остальные читаются из индекса)
+    MEME_CACHE_SIZE = 4096
+    # Раздавать только часть библиотеки: тип мемов (photo/video) и/или тег (пусто - вся библиотека)
+    DEAL_MEDIA_TYPE = os.getenv('DEAL_MEDIA_TYPE') or None
+    DEAL_TAG = os.getenv('DEAL_TAG') or None
+    
+    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///game.db')
+    DB_BUSY_TIMEOUT_MS = 5000
+    DB_CACHE_SIZE_KB = 16000
+    
+    # Отложенная запись: сколько секунд записи могут ждать в буфере (0 - писать сразу)
+    # и при каком размере буфера сбрасывать его досрочно
+    DB_WRITE_DELAY = float(os.getenv('DB_WRITE_DELAY', '1.0'))
+    DB_WRITE_BATCH_SIZE = 500
+    # Если пакет не записался, он остается в буфере, а повтор откладывается вдвое дольше, до этого предела
+    DB_WRITE_RETRY_MAX_DELAY = 30
+    
+    # Служебный чат, куда при старте предзагружаются мемы ради file_id
+    MEDIA_STORAGE_CHAT_ID = os.getenv('MEDIA_STORAGE_CHAT_ID')
+    MEDIA_WARMUP_DELAY = 1.5
+    
+    # Оптимизированные копии мемов (папка с адресацией по хэшу исходника)
+    OPTIMIZED_MEDIA_DIR = os.path.join('data', 'memes_optimized')
+    # Оптимизировать новые мемы при старте бота (иначе - вручную: python media_optimizer.py)
+    MEDIA_OPTIMIZE_ON_START = os.getenv('MEDIA_OPTIMIZE_ON_START', '0') == '1'
+    MEDIA_OPTIMIZE_WORKERS = int(os.getenv('MEDIA_OPTIMIZE_WORKERS', str(os.cpu_count() or 1)))
+    # Картинки: наибольшая сторона и качество JPEG; видео: наибольшая сторона и CRF x264
+    MEDIA_MAX_SIDE = 1280
+    MEDIA_JPEG_QUALITY = 85
+    MEDIA_VIDEO_MAX_SIDE = 720
+    MEDIA_VIDEO_CRF = 28
     
-    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///game.db')
\ No newline at end of file
+    # Голосование одним листом-коллажем с кнопками вместо медиагруппы и отдельного сообщения
+    VOTING_SHEET = os.getenv('VOTING_SHEET', '0') == '1'
+    VOTING_SHEET_DIR = os.path.join('data', 'voting_sheets')
+    VOTING_SHEET_TILE = 480  # сторона клетки листа, пикселей
+    VOTING_SHEET_CACHE_SIZE = 256  # сколько листов помнить в памяти
+    # Сколько листов хранить на диске: старые удаляются вместе с их file_id
+    VOTING_SHEET_DISK_LIMIT = int(os.getenv('VOTING_SHEET_DISK_LIMIT', '2000'))
\ No newline at end of file
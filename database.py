@@ -1,14 +1,55 @@
 import sqlite3
 import os
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from metrics import DB_SECONDS
+from meme_index import SCHEMA as MEME_INDEX_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+# Миграции схемы для существующих баз: номер версии = позиция в списке + 1.
+# Текущая версия хранится в PRAGMA user_version
+MIGRATIONS = [
+    # 1: индексы для лидерборда и итогов игры
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_users_leaderboard
+           ON users (total_score DESC) WHERE games_played > 0''',
+        '''CREATE INDEX IF NOT EXISTS idx_participation_session
+           ON game_participation (session_id, user_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_rounds_session
+           ON game_rounds (session_id)''',
+    ],
+    # 2: индекс библиотеки мемов (meme_index.py): метаданные, теги, счетчики раздач и побед
+    MEME_INDEX_SCHEMA,
+]
 
 class Database:
+    """
+    Синхронный доступ к SQLite через одно долгоживущее соединение.
+    Из асинхронного кода используйте AsyncDatabase: все вызовы идут из одного потока БД.
+    """
     def __init__(self, db_path=None):
         self.db_path = db_path or Config.DATABASE_URL.replace('sqlite:///', '')
+        self.conn = self._connect()
         self._init_db()
     
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA cache_size=-{Config.DB_CACHE_SIZE_KB}')
+        return conn
+    
+    def close(self):
+        self.conn.close()
+    
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         
         # Таблица пользователей
@@ -61,21 +102,49 @@ class Database:
             )
         ''')
         
+        # Кэш Telegram file_id для загруженных мемов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_file_ids (
+                cache_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                media_type TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Снимки незавершенных игр для восстановления после перезапуска
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS game_snapshots (
+                chat_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         conn.commit()
-        conn.close()
+        self._migrate()
+    
+    def _migrate(self):
+        conn = self.conn
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+            logger.info("✅ Схема БД обновлена до версии %s", number)
     
     def add_user(self, user_id, username, first_name, last_name):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
             VALUES (?, ?, ?, ?)
         ''', (user_id, username, first_name, last_name))
         conn.commit()
-        conn.close()
     
     def update_user_stats(self, user_id, score_delta=0, games_delta=0):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             UPDATE users 
@@ -84,10 +153,9 @@ class Database:
             WHERE user_id = ?
         ''', (games_delta, score_delta, user_id))
         conn.commit()
-        conn.close()
     
     def create_game_session(self, chat_id):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO game_sessions (chat_id, status)
@@ -95,75 +163,118 @@ class Database:
         ''', (chat_id,))
         session_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         return session_id
     
     def add_player_to_session(self, session_id, user_id):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR IGNORE INTO game_participation (session_id, user_id)
             VALUES (?, ?)
         ''', (session_id, user_id))
         conn.commit()
-        conn.close()
     
     def record_round_result(self, session_id, round_number, situation, winner_id):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO game_rounds (session_id, round_number, situation, winner_id)
             VALUES (?, ?, ?, ?)
         ''', (session_id, round_number, situation, winner_id))
         conn.commit()
-        conn.close()
     
     def complete_game_session(self, session_id, final_scores):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Итоги игры одной транзакцией: участие, статистика игроков и статус сессии"""
         # Находим победителя
         winner_id = max(final_scores, key=final_scores.get) if final_scores else None
         
-        # Обновляем участие игроков
-        for user_id, score in final_scores.items():
-            is_winner = 1 if user_id == winner_id else 0
-            cursor.execute('''
+        conn = self.conn
+        with conn:
+            # Обновляем участие игроков
+            conn.executemany('''
                 UPDATE game_participation 
                 SET final_score = ?, is_winner = ?
                 WHERE session_id = ? AND user_id = ?
-            ''', (score, is_winner, session_id, user_id))
+            ''', [
+                (score, 1 if user_id == winner_id else 0, session_id, user_id)
+                for user_id, score in final_scores.items()
+            ])
             
-            # Обновляем статистику пользователя
-            self.update_user_stats(user_id, score_delta=score, games_delta=1)
-        
-        # Обновляем сессию
-        cursor.execute('''
-            UPDATE game_sessions 
-            SET status = 'completed', total_rounds = (
-                SELECT COUNT(*) FROM game_rounds WHERE session_id = ?
-            )
-            WHERE session_id = ?
-        ''', (session_id, session_id))
-        
-        conn.commit()
-        conn.close()
+            # Обновляем статистику пользователей
+            conn.executemany('''
+                UPDATE users 
+                SET games_played = games_played + 1, 
+                    total_score = total_score + ?
+                WHERE user_id = ?
+            ''', [(score, user_id) for user_id, score in final_scores.items()])
+            
+            # Обновляем сессию
+            conn.execute('''
+                UPDATE game_sessions 
+                SET status = 'completed', total_rounds = (
+                    SELECT COUNT(*) FROM game_rounds WHERE session_id = ?
+                )
+                WHERE session_id = ?
+            ''', (session_id, session_id))
+    
+    def load_game_snapshots(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT chat_id, state FROM game_snapshots')
+        return cursor.fetchall()
+    
+    def apply_writes(self, users, stats, participants, rounds, media, snapshots=(), deleted_snapshots=(),
+                     meme_usage=()):
+        """Пакет отложенных записей одной транзакцией"""
+        conn = self.conn
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', users)
+            conn.executemany('''
+                UPDATE users 
+                SET games_played = games_played + ?, 
+                    total_score = total_score + ?
+                WHERE user_id = ?
+            ''', stats)
+            conn.executemany('''
+                INSERT OR IGNORE INTO game_participation (session_id, user_id)
+                VALUES (?, ?)
+            ''', participants)
+            conn.executemany('''
+                INSERT INTO game_rounds (session_id, round_number, situation, winner_id)
+                VALUES (?, ?, ?, ?)
+            ''', rounds)
+            conn.executemany('''
+                INSERT OR REPLACE INTO media_file_ids (cache_key, file_id, media_type)
+                VALUES (?, ?, ?)
+            ''', media)
+            conn.executemany('''
+                INSERT OR REPLACE INTO game_snapshots (chat_id, state, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', snapshots)
+            conn.executemany('DELETE FROM game_snapshots WHERE chat_id = ?', deleted_snapshots)
+            conn.executemany('''
+                UPDATE memes
+                SET times_dealt = times_dealt + ?,
+                    times_won = times_won + ?
+                WHERE id = ?
+            ''', meme_usage)
     
     def get_user_stats(self, user_id):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             SELECT games_played, total_score FROM users WHERE user_id = ?
         ''', (user_id,))
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             return {'games_played': result[0], 'total_score': result[1]}
         return {'games_played': 0, 'total_score': 0}
     
     def get_leaderboard(self, limit=10):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.conn
         cursor = conn.cursor()
         cursor.execute('''
             SELECT user_id, username, first_name, total_score, games_played
@@ -183,5 +294,250 @@ class Database:
                 'games_played': row[4]
             })
         
-        conn.close()
         return leaderboard
+    
+    def load_media_file_ids(self):
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.execute('SELECT cache_key, file_id FROM media_file_ids')
+        file_ids = dict(cursor.fetchall())
+        return file_ids
+    
+    def save_media_file_id(self, cache_key, file_id, media_type):
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO media_file_ids (cache_key, file_id, media_type)
+            VALUES (?, ?, ?)
+        ''', (cache_key, file_id, media_type))
+        conn.commit()
+    
+    def delete_media_file_ids(self, cache_keys):
+        conn = self.conn
+        with conn:
+            conn.executemany('DELETE FROM media_file_ids WHERE cache_key = ?', [(key,) for key in cache_keys])
+
+
+class AsyncDatabase:
+    """
+    Неблокирующий доступ к базе для обработчиков бота: запросы выполняются
+    в отдельном потоке БД, event loop в это время обслуживает другие чаты.
+    
+    Мелкие записи (пользователи, статистика, раунды, file_id) копятся в буфере
+    и сбрасываются одной транзакцией раз в Config.DB_WRITE_DELAY секунд
+    или при накоплении Config.DB_WRITE_BATCH_SIZE записей. Пакет, который
+    не удалось записать, остается в буфере до следующего сброса.
+    """
+    def __init__(self, db=None):
+        self.sync = db or Database()
+        # Один поток = одно соединение, без гонок внутри sqlite3
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        
+        self._pending_users = {}         # user_id -> (username, first_name, last_name)
+        self._pending_stats = {}         # user_id -> [score_delta, games_delta]
+        self._pending_participants = set()
+        self._pending_rounds = []
+        self._pending_media = {}         # cache_key -> (file_id, media_type)
+        self._pending_snapshots = {}     # chat_id -> JSON игры или None для удаления
+        self._pending_meme_usage = {}    # индекс мема -> [раздач, побед]
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        
+        # Кэш лидерборда: сбрасывается только при изменении очков
+        self._leaderboard_cache = {}     # limit -> список игроков
+        self.leaderboard_version = 0
+    
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, method, *args)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, method.__name__)
+    
+    async def run(self, method, *args):
+        """Синхронная функция в потоке БД: индекс мемов в том же файле не спорит с записью за блокировку"""
+        return await self._run(method, *args)
+    
+    def pending_writes(self):
+        return (len(self._pending_users) + len(self._pending_stats) + len(self._pending_participants)
+                + len(self._pending_rounds) + len(self._pending_media) + len(self._pending_snapshots)
+                + len(self._pending_meme_usage))
+    
+    async def _after_write(self):
+        # Нулевая задержка - запись сразу, без буфера
+        if Config.DB_WRITE_DELAY <= 0:
+            await self.flush()
+            return
+        
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        if self.pending_writes() >= Config.DB_WRITE_BATCH_SIZE:
+            self._wakeup.set()
+    
+    async def _flush_loop(self):
+        backoff = Config.DB_WRITE_DELAY
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=Config.DB_WRITE_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if await self.flush():
+                backoff = Config.DB_WRITE_DELAY
+            else:
+                # База недоступна: повторяем реже, буфер при этом сохраняется
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, Config.DB_WRITE_RETRY_MAX_DELAY)
+    
+    def _take_pending(self):
+        batch = (self._pending_users, self._pending_stats, self._pending_participants, self._pending_rounds,
+                 self._pending_media, self._pending_snapshots, self._pending_meme_usage)
+        self._pending_users = {}
+        self._pending_stats = {}
+        self._pending_participants = set()
+        self._pending_rounds = []
+        self._pending_media = {}
+        self._pending_snapshots = {}
+        self._pending_meme_usage = {}
+        return batch
+    
+    def _restore_pending(self, batch):
+        """Вернуть несохраненный пакет в буфер; записи, сделанные после него, новее и важнее"""
+        users, stats, participants, rounds, media, snapshots, meme_usage = batch
+        for user_id, names in users.items():
+            self._pending_users.setdefault(user_id, names)
+        for user_id, (score, games) in stats.items():
+            delta = self._pending_stats.setdefault(user_id, [0, 0])
+            delta[0] += score
+            delta[1] += games
+        self._pending_participants |= participants
+        self._pending_rounds[:0] = rounds
+        for key, value in media.items():
+            self._pending_media.setdefault(key, value)
+        for chat_id, state in snapshots.items():
+            self._pending_snapshots.setdefault(chat_id, state)
+        for meme_id, (dealt, won) in meme_usage.items():
+            usage = self._pending_meme_usage.setdefault(meme_id, [0, 0])
+            usage[0] += dealt
+            usage[1] += won
+    
+    async def flush(self):
+        """
+        Записать все отложенное одной транзакцией. Если запись не удалась,
+        пакет возвращается в буфер и уйдет со следующим сбросом. Возвращает успех
+        """
+        # Сбросы идут по очереди: вернувшийся пакет не перезапишет более новые снимки
+        async with self._flush_lock:
+            if not self.pending_writes():
+                return True
+            
+            batch = self._take_pending()
+            users, stats, participants, rounds, media, snapshots, meme_usage = batch
+            try:
+                await self._run(
+                    self.sync.apply_writes,
+                    [(user_id, *names) for user_id, names in users.items()],
+                    [(games, score, user_id) for user_id, (score, games) in stats.items()],
+                    list(participants),
+                    rounds,
+                    [(key, file_id, media_type) for key, (file_id, media_type) in media.items()],
+                    [(chat_id, state) for chat_id, state in snapshots.items() if state is not None],
+                    [(chat_id,) for chat_id, state in snapshots.items() if state is None],
+                    [(dealt, won, meme_id) for meme_id, (dealt, won) in meme_usage.items()],
+                )
+                return True
+            except Exception as e:
+                self._restore_pending(batch)
+                logger.error("❌ Ошибка пакетной записи в БД, записи оставлены в буфере (%s): %s",
+                             self.pending_writes(), e)
+                return False
+    
+    async def add_user(self, user_id, username, first_name, last_name):
+        self._pending_users[user_id] = (username, first_name, last_name)
+        await self._after_write()
+    
+    def invalidate_leaderboard(self):
+        self._leaderboard_cache = {}
+        self.leaderboard_version += 1
+    
+    async def update_user_stats(self, user_id, score_delta=0, games_delta=0):
+        self.invalidate_leaderboard()
+        delta = self._pending_stats.setdefault(user_id, [0, 0])
+        delta[0] += score_delta
+        delta[1] += games_delta
+        await self._after_write()
+    
+    async def create_game_session(self, chat_id):
+        return await self._run(self.sync.create_game_session, chat_id)
+    
+    async def add_player_to_session(self, session_id, user_id):
+        self._pending_participants.add((session_id, user_id))
+        await self._after_write()
+    
+    async def record_round_result(self, session_id, round_number, situation, winner_id):
+        self._pending_rounds.append((session_id, round_number, situation, winner_id))
+        await self._after_write()
+    
+    async def complete_game_session(self, session_id, final_scores):
+        # Раунды и участники этой игры должны попасть в базу раньше итогов
+        await self.flush()
+        await self._run(self.sync.complete_game_session, session_id, final_scores)
+        self.invalidate_leaderboard()
+    
+    async def get_user_stats(self, user_id):
+        await self.flush()
+        return await self._run(self.sync.get_user_stats, user_id)
+    
+    async def get_leaderboard(self, limit=10):
+        leaderboard = self._leaderboard_cache.get(limit)
+        if leaderboard is None:
+            version = self.leaderboard_version
+            await self.flush()
+            leaderboard = await self._run(self.sync.get_leaderboard, limit)
+            # Пока шел запрос, очки могли измениться - такой результат не кэшируем
+            if version == self.leaderboard_version:
+                self._leaderboard_cache[limit] = leaderboard
+        return leaderboard
+    
+    async def save_media_file_id(self, cache_key, file_id, media_type):
+        self._pending_media[cache_key] = (file_id, media_type)
+        await self._after_write()
+    
+    async def delete_media_file_ids(self, cache_keys):
+        # Еще не записанные file_id просто выбрасываются из буфера
+        for key in cache_keys:
+            self._pending_media.pop(key, None)
+        await self._run(self.sync.delete_media_file_ids, cache_keys)
+    
+    async def save_game_snapshot(self, chat_id, state):
+        # Между сбросами буфера хранится только последний снимок игры
+        self._pending_snapshots[chat_id] = state
+        await self._after_write()
+    
+    async def delete_game_snapshot(self, chat_id):
+        self._pending_snapshots[chat_id] = None
+        await self._after_write()
+    
+    async def count_meme_usage(self, dealt=(), won=None):
+        """Счетчики раздач и побед мемов в индексе; заглушки не считаются"""
+        for meme_id in dealt:
+            if meme_id >= 0:
+                self._pending_meme_usage.setdefault(meme_id, [0, 0])[0] += 1
+        if won is not None and won >= 0:
+            self._pending_meme_usage.setdefault(won, [0, 0])[1] += 1
+        await self._after_write()
+    
+    async def close(self):
+        """Остановка: дописываем буфер и закрываем соединение"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        if not await self.flush():
+            logger.error("❌ При остановке не записано отложенных записей: %s", self.pending_writes())
+        await self._run(self.sync.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Дедлайны фаз игры: одна куча (when, seq, key) и одна задача на event loop,
+    которая спит до ближайшего дедлайна. У ключа (chat_id) не больше одного
+    активного дедлайна: schedule() заменяет прежний, cancel() снимает.
+    Отмененные записи удаляются из кучи лениво, при накоплении - перестройкой.
+
+    callback(key, token) - корутина, вызывается после наступления дедлайна.
+    Время - time.time(), чтобы дедлайн можно было сохранить в снимке игры.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._deadlines = {}  # key -> (seq, when, token)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, when, token=None):
+        seq = next(self._seq)
+        replaced = self._deadlines.get(key) is not None
+        self._deadlines[key] = (seq, when, token)
+        heapq.heappush(self._heap, (when, seq, key))
+        if replaced:
+            self._compact()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        elif self._heap[0][1] == seq:
+            # Новый дедлайн раньше всех остальных - будим задачу
+            self._wakeup.set()
+
+    def cancel(self, key):
+        if self._deadlines.pop(key, None) is not None:
+            self._compact()
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(when, seq, key) for key, (seq, when, _) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _is_live(self, entry):
+        _, seq, key = entry
+        current = self._deadlines.get(key)
+        return current is not None and current[0] == seq
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                due.append((entry[2], self._deadlines.pop(entry[2])[2]))
+        return due
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._is_live(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            for key, token in self._pop_due(time.time()):
+                task = asyncio.get_running_loop().create_task(self._fire(key, token))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _fire(self, key, token):
+        try:
+            await self.callback(key, token)
+        except Exception as e:
+            logger.error("❌ Ошибка обработки дедлайна %s: %s", key, e)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,7 +1,17 @@
+import asyncio
+import logging
 import os
-import json
 import random
+from collections import namedtuple
 from config import Config
+from meme_catalog import MemeCatalog
+from meme_index import MemeIndex
+from meme_deck import MemeDeck
+from media_optimizer import MediaOptimizer
+from game_state import STUB_INDEX
+from metrics import FILE_MANAGER_SECONDS, async_timed, timed
+
+logger = logging.getLogger(__name__)
 
 def safe_text(text, default="Текст"):
     """
@@ -39,75 +49,136 @@ def safe_text(text, default="Текст"):
     except Exception:
         return default
 
+# Ситуация с заранее обрезанной подписью для кнопки
+Situation = namedtuple('Situation', ['text', 'label'])
+
+SITUATION_LABEL_LENGTH = 40
+
+def situation_label(text):
+    if len(text) > SITUATION_LABEL_LENGTH:
+        return text[:SITUATION_LABEL_LENGTH] + "..."
+    return text
+
 class FileManager:
-    def __init__(self):
-        print("=== FileManager инициализация ===")
+    def __init__(self, run=None):
+        logger.info("=== FileManager инициализация ===")
         self.memes_dir = Config.MEMES_DIR
         self.situations_file = Config.SITUATIONS_FILE
-        self.used_memes_file = Config.USED_MEMES_FILE
+        self.manifest_file = Config.MEMES_MANIFEST_FILE
         
-        print(f"MEMES_DIR: {self.memes_dir}")
-        print(f"SITUATIONS_FILE: {self.situations_file}")
-        print(f"USED_MEMES_FILE: {self.used_memes_file}")
+        logger.info("MEMES_DIR: %s", self.memes_dir)
+        logger.info("SITUATIONS_FILE: %s", self.situations_file)
+        logger.info("MEMES_MANIFEST_FILE: %s", self.manifest_file)
         
         self._ensure_directories()
-        print("=== FileManager инициализирован успешно ===")
+        self.catalog = MemeCatalog(self.memes_dir, legacy_manifest=self.manifest_file)
+        self.optimizer = MediaOptimizer(Config.OPTIMIZED_MEDIA_DIR)
+        self.decks = {}  # chat_id -> MemeDeck
+        # Скан папки и запросы к индексу мемов - вне event loop: бот выполняет их
+        # в потоке БД (AsyncDatabase.run), без него - в пуле потоков по умолчанию
+        self._run = run or self._run_in_executor
+        self._pool_keys = list(dict.fromkeys([(Config.DEAL_MEDIA_TYPE, Config.DEAL_TAG), (None, None)]))
+        self._situations = []
+        self._situations_mtime = None
+        logger.info("=== FileManager инициализирован успешно ===")
     
     def _ensure_directories(self):
         os.makedirs(self.memes_dir, exist_ok=True)
-        os.makedirs(os.path.dirname(self.used_memes_file), exist_ok=True)
-        
-        if not os.path.exists(self.used_memes_file):
-            with open(self.used_memes_file, 'w', encoding='utf-8') as f:
-                json.dump({"used_memes": []}, f, ensure_ascii=False)
-    
-    def get_all_memes(self):
-        memes = []
-        if not os.path.exists(self.memes_dir):
-            return memes
-            
-        for file in os.listdir(self.memes_dir):
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.mp4', '.mov', '.avi')):
-                memes.append({
-                    'filename': file,
-                    'path': os.path.join(self.memes_dir, file)
-                })
-        return memes
-    
-    def get_random_memes(self, count=6):
-        all_memes = self.get_all_memes()
-        if not all_memes:
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+    
+    @staticmethod
+    async def _run_in_executor(method, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    
+    async def _refresh(self, force=False):
+        # Папка пересканируется только если изменился ее mtime (или force)
+        return self.catalog.apply(await self._run(self.catalog.load, force, self._pool_keys))
+    
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def load_memes(self):
+        """Все существующие мемы каталога; читаются из индекса в потоке БД"""
+        return await self._run(self.catalog.memes)
+    
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def get_all_memes(self):
+        await self._refresh()
+        return [self.optimizer.serve(meme) for meme in await self.load_memes()]
+    
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def reload_memes(self):
+        """Принудительное пересканирование папки с мемами"""
+        await self._refresh(force=True)
+        await self._run(self.optimizer.load)
+        return len(self.catalog)
+    
+    @timed(FILE_MANAGER_SECONDS)
+    def optimize_media(self, memes, workers=None):
+        """
+        Оптимизировать мемы, для которых еще нет артефакта (долго - вызывать вне event loop).
+        Список мемов - из load_memes: индекс читается только в потоке БД
+        """
+        return self.optimizer.optimize(memes, workers)
+    
+    @timed(FILE_MANAGER_SECONDS)
+    def probe_memes(self):
+        """Прочитать размеры и длительность новых мемов (читает файлы - вызывать вне event loop)"""
+        # Свое соединение: каталог в это время обслуживает раздачу в event loop
+        index = MemeIndex(self.catalog.index.db_path)
+        try:
+            return index.probe(self.memes_dir)
+        finally:
+            index.close()
+    
+    def _deck(self, chat_id):
+        deck = self.decks.get(chat_id)
+        if deck is None:
+            deck = self.decks[chat_id] = MemeDeck(self.catalog, Config.DEAL_MEDIA_TYPE, Config.DEAL_TAG)
+        return deck
+    
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def new_round(self, chat_id):
+        """Начало раздачи раунда: игроки одного раунда не получат одинаковых мемов"""
+        # Заодно готовит пулы раздачи: deal_memes берет их уже из памяти
+        await self._refresh()
+        self._deck(chat_id).new_round()
+    
+    @timed(FILE_MANAGER_SECONDS)
+    def deal_memes(self, chat_id, count=6):
+        """Вытянуть count мемов из колоды чата (индексы каталога)"""
+        if not len(self.catalog):
             # Возвращаем заглушки, если нет мемов
-            stub_memes = []
-            for i in range(count):
-                stub_memes.append({
-                    'filename': f'stub_{i}.jpg', 
-                    'path': 'stub'
-                })
-            return stub_memes
-            
-        used_memes = self._load_used_memes()
-        available_memes = [m for m in all_memes if m['filename'] not in used_memes]
-
-
-        if len(available_memes) < len(all_memes) * 0.2:
-            print("🔄 Доступные мемы заканчиваются, сбрасываем список использованных")
-            self.reset_used_memes()
-            available_memes = all_memes
-        # Если доступных мемов меньше нужного количества, сбрасываем использованные
-        
-        # Если все равно недостаточно мемов, используем повторно
-        if len(available_memes) < count:
-            needed = count - len(available_memes)
-            additional_memes = random.sample(all_memes, min(needed, len(all_memes)))
-            available_memes.extend(additional_memes)
+            return [STUB_INDEX] * count
         
-        selected_memes = random.sample(available_memes, min(count, len(available_memes)))
-        self._mark_memes_as_used([m['filename'] for m in selected_memes])
-        
-        return selected_memes
+        return self._deck(chat_id).draw(count)
     
-    def get_all_situations(self):
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def get_memes(self, indexes):
+        """
+        Мемы по индексам каталога (оптимизированные копии, если есть); удаленный мем
+        и заглушка - как заглушка. Промахи LRU читаются из индекса одним вызовом вне event loop.
+        """
+        memes = [self.catalog.cached(index) if index >= 0 else None for index in indexes]
+        missing = [index for index, meme in zip(indexes, memes) if meme is None and index >= 0]
+        if missing:
+            rows = await self._run(self.catalog.fetch, missing)
+            memes = [self.catalog.remember(index, rows[index]) if meme is None and index >= 0 else meme
+                     for index, meme in zip(indexes, memes)]
+        return [self._serve(meme) for meme in memes]
+    
+    @async_timed(FILE_MANAGER_SECONDS)
+    async def get_meme(self, index):
+        return (await self.get_memes([index]))[0]
+    
+    def _serve(self, meme):
+        if meme is None:
+            return {'filename': 'stub.jpg', 'path': 'stub'}
+        return self.optimizer.serve(meme)
+    
+    @timed(FILE_MANAGER_SECONDS)
+    def drop_deck(self, chat_id):
+        self.decks.pop(chat_id, None)
+    
+    def _read_situations(self):
         if not os.path.exists(self.situations_file):
             os.makedirs(os.path.dirname(self.situations_file), exist_ok=True)
             with open(self.situations_file, 'w', encoding='utf-8') as f:
@@ -131,84 +202,81 @@ class FileManager:
             except:
                 return ["Пример ситуации: Когда кофе закончился"]
         except Exception as e:
-            print(f"❌ Ошибка чтения файла ситуаций: {e}")
+            logger.error("❌ Ошибка чтения файла ситуаций: %s", e)
             return ["Пример ситуации: Когда кофе закончился"]
     
-    def get_random_situations(self, count=10):
-        situations = self.get_all_situations()
-        if not situations:
-            return ["Пример ситуации: Когда кофе закончился"]
-        return random.sample(situations, min(count, len(situations)))
-    
-    def _load_used_memes(self):
+    def _situations_file_mtime(self):
         try:
-            with open(self.used_memes_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('used_memes', [])
-        except Exception as e:
-            print(f"❌ Ошибка загрузки used_memes: {e}")
-            return []
+            return os.stat(self.situations_file).st_mtime_ns
+        except OSError:
+            return None
     
-    def _mark_memes_as_used(self, memes):
-        try:
-            used_memes = self._load_used_memes()
-            used_memes.extend(memes)
-            used_memes = list(set(used_memes))
-            
-            with open(self.used_memes_file, 'w', encoding='utf-8') as f:
-                json.dump({"used_memes": used_memes}, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"❌ Ошибка сохранения used_memes: {e}")
+    def _refresh_situations(self):
+        """Перечитать файл ситуаций, только если он изменился"""
+        mtime = self._situations_file_mtime()
+        if mtime is not None and mtime == self._situations_mtime:
+            return
+        
+        self._situations = [
+            Situation(text, situation_label(text)) for text in self._read_situations()
+        ]
+        self._situations_mtime = self._situations_file_mtime()
+        logger.info("🔄 Ситуации загружены: %s", len(self._situations))
     
-    def reset_used_memes(self):
-        try:
-            with open(self.used_memes_file, 'w', encoding='utf-8') as f:
-                json.dump({"used_memes": []}, f, ensure_ascii=False)
-            print("✅ Список использованных мемов сброшен")
-        except Exception as e:
-            print(f"❌ Ошибка сброса used_memes: {e}")
+    @timed(FILE_MANAGER_SECONDS)
+    def get_all_situations(self):
+        self._refresh_situations()
+        return [situation.text for situation in self._situations]
+    
+    @timed(FILE_MANAGER_SECONDS)
+    def get_random_situations(self, count=10):
+        """Случайные ситуации для раунда вместе с готовыми подписями кнопок"""
+        self._refresh_situations()
+        if not self._situations:
+            text = "Пример ситуации: Когда кофе закончился"
+            return [Situation(text, situation_label(text))]
+        return random.sample(self._situations, min(count, len(self._situations)))
     
+    @timed(FILE_MANAGER_SECONDS)
     def add_situation(self, situation):
         """Добавить новую ситуацию в файл"""
         try:
             safe_situation = safe_text(situation)
+            self._refresh_situations()
             with open(self.situations_file, 'a', encoding='utf-8') as f:
                 f.write(safe_situation + '\n')
-            print(f"✅ Ситуация добавлена: {safe_situation}")
+            # Держим пул в памяти в синхронизации с файлом без повторного чтения
+            self._situations.append(Situation(safe_situation, situation_label(safe_situation)))
+            self._situations_mtime = self._situations_file_mtime()
+            logger.info("✅ Ситуация добавлена: %s", safe_situation)
             return True
         except Exception as e:
-            print(f"❌ Ошибка добавления ситуации: {e}")
+            logger.error("❌ Ошибка добавления ситуации: %s", e)
             return False
     
+    @timed(FILE_MANAGER_SECONDS)
     def check_files(self):
         """Проверка доступности файлов и папок"""
-        print("=== ПРОВЕРКА ФАЙЛОВ ===")
+        logger.info("=== ПРОВЕРКА ФАЙЛОВ ===")
         
         # Проверка папки с мемами
         if os.path.exists(self.memes_dir):
-            memes_count = len(self.get_all_memes())
-            print(f"✅ Папка с мемами: {memes_count} файлов")
+            # Проверка идет до запуска event loop: каталог обновляется синхронно
+            self.catalog.refresh()
+            memes_count = len(self.catalog)
+            logger.info("✅ Папка с мемами: %s файлов", memes_count)
         else:
-            print("❌ Папка с мемами не существует")
+            logger.error("❌ Папка с мемами не существует")
             os.makedirs(self.memes_dir, exist_ok=True)
-            print("✅ Папка с мемами создана")
+            logger.info("✅ Папка с мемами создана")
         
         # Проверка файла с ситуациями
         if os.path.exists(self.situations_file):
             situations = self.get_all_situations()
-            print(f"✅ Файл с ситуациями: {len(situations)} ситуаций")
+            logger.info("✅ Файл с ситуациями: %s ситуаций", len(situations))
         else:
-            print("❌ Файл с ситуациями не существует")
+            logger.error("❌ Файл с ситуациями не существует")
             self.get_all_situations()  # Это создаст файл с примерами
-            print("✅ Файл с ситуациями создан")
-        
-        # Проверка файла использованных мемов
-        if os.path.exists(self.used_memes_file):
-            used_count = len(self._load_used_memes())
-            print(f"✅ Файл использованных мемов: {used_count} записей")
-        else:
-            print("❌ Файл использованных мемов не существует")
-            self._ensure_directories()
-            print("✅ Файл использованных мемов создан")
+            logger.info("✅ Файл с ситуациями создан")
         
-        print("=== ПРОВЕРКА ЗАВЕРШЕНА ===")
+        logger.info("=== ПРОВЕРКА ЗАВЕРШЕНА ===")
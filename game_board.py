@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from telegram.error import BadRequest
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class GameBoard:
+    """
+    Закрепленное табло игры: одно сообщение в чате, которое правится на месте.
+
+    refresh() только помечает табло устаревшим: правка уходит через delay секунд
+    и отражает состояние игры на момент отправки, поэтому десять присоединений
+    за секунду дают один edit_message_text.
+
+    Табло показывается в targets - списке (чат, message_id): у игры в группе это
+    одно сообщение, у быстрой игры - копии в ЛС каждого игрока.
+    """
+    # Сколько завершенных игр помнить: у быстрых игр chat_id каждый раз новый
+    FINISHED_LIMIT = 4096
+
+    def __init__(self, render, delay=None):
+        # render(chat_id) -> (targets, текст, клавиатура) или None, если табло нет
+        self.render = render
+        self.delay = Config.BOARD_DEBOUNCE if delay is None else delay
+        self._pending = {}  # chat_id -> задача отложенной правки
+        self._notices = {}  # chat_id -> строка события для ближайшей правки
+        self._shown = {}    # (чат, message_id) -> (текст, клавиатура) на экране
+        # Игры с итоговым табло: запоздавшая правка его не перезапишет
+        self._finished = OrderedDict()
+        self.edits = 0
+        self.coalesced = 0
+
+    def refresh(self, chat_id, bot, notice=None):
+        """Обновить табло с задержкой; notice - строка о событии внизу табло до следующей правки"""
+        if notice:
+            self._notices[chat_id] = notice
+        if chat_id in self._pending:
+            self.coalesced += 1
+            return
+        self._pending[chat_id] = asyncio.create_task(self._flush_later(chat_id, bot))
+
+    async def _flush_later(self, chat_id, bot):
+        await asyncio.sleep(self.delay)
+        # События во время правки запланируют следующую
+        self._pending.pop(chat_id, None)
+        try:
+            await self.flush(chat_id, bot)
+        except Exception as e:
+            logger.error("❌ Ошибка обновления табло игры %s: %s", chat_id, e)
+
+    async def flush(self, chat_id, bot):
+        rendered = await self.render(chat_id)
+        if rendered is None:
+            return
+        targets, text, reply_markup = rendered
+        notice = self._notices.pop(chat_id, None)
+        if notice:
+            text = f"{text}\n\n{notice}"
+        if chat_id in self._finished:
+            return
+        await self._edit_all(bot, targets, text, reply_markup)
+
+    async def _edit_all(self, bot, targets, text, reply_markup):
+        if len(targets) == 1:
+            await self._edit(bot, *targets[0], text, reply_markup)
+            return
+        # Копии в ЛС правятся параллельно; игрок, закрывший ЛС, не мешает остальным
+        results = await asyncio.gather(*(self._edit(bot, target, message_id, text, reply_markup)
+                                         for target, message_id in targets), return_exceptions=True)
+        for (target, _), result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.error("❌ Ошибка обновления табло в чате %s: %s", target, result)
+
+    async def _edit(self, bot, target, message_id, text, reply_markup):
+        key = (target, message_id)
+        shown = (text, reply_markup)
+        if self._shown.get(key) == shown:
+            return
+        try:
+            await bot.edit_message_text(text, target, message_id, reply_markup=reply_markup)
+            self.edits += 1
+        except BadRequest as e:
+            # Табло уже показывает этот текст (например, после перезапуска)
+            if 'not modified' not in str(e).lower():
+                raise
+        self._shown[key] = shown
+
+    async def show(self, chat_id, bot, targets, text, reply_markup=None):
+        """Сразу показать на табло текст без задержки (табло новой игры)"""
+        self._finished.pop(chat_id, None)
+        await self._edit_all(bot, targets, text, reply_markup)
+
+    async def pin(self, bot, targets):
+        for target, message_id in targets:
+            try:
+                await bot.pin_chat_message(target, message_id, disable_notification=True)
+            except BadRequest as e:
+                # Без прав администратора табло остается незакрепленным
+                logger.error("❌ Не удалось закрепить табло в чате %s: %s", target, e)
+
+    async def finish(self, chat_id, bot, targets, text):
+        """Итоговая правка табло без кнопок, открепление и забывание игры"""
+        task = self._pending.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+        self._notices.pop(chat_id, None)
+        for target, message_id in targets:
+            try:
+                await self._edit(bot, target, message_id, text, None)
+                await bot.unpin_chat_message(target, message_id)
+            except BadRequest as e:
+                logger.error("❌ Ошибка завершения табло в чате %s: %s", target, e)
+            finally:
+                self._shown.pop((target, message_id), None)
+        self._finished[chat_id] = True
+        if len(self._finished) > self.FINISHED_LIMIT:
+            self._finished.popitem(last=False)
+
+    async def close(self):
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
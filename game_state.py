@@ -0,0 +1,164 @@
+import json
+from array import array
+
+# Мем в игре хранится индексом каталога, заглушка - как -1
+STUB_INDEX = -1
+
+# Версия формата снимка: снимки другой версии не загружаются
+SNAPSHOT_VERSION = 2
+
+
+class Player:
+    """Игрок: очки, мемы на руках в текущем раунде и выбранный мем"""
+    __slots__ = ('user_id', 'name', 'score', 'hand', 'choice')
+
+    def __init__(self, user_id, name, score=0, hand=None, choice=None):
+        self.user_id = user_id
+        self.name = name
+        self.score = score
+        self.hand = array('i', hand or ())  # индексы каталога без отдельного int-объекта на мем
+        self.choice = choice  # индекс выбранного мема в каталоге или None
+
+
+class Game:
+    """
+    Состояние игры в чате. Игроки хранятся словарем user_id -> Player и списком
+    в порядке присоединения: ведущий - позиция в этом списке, смена ведущего O(1).
+    Рейтинг по очкам поддерживается при начислении очка, а не сортировкой на каждый вывод.
+    """
+    __slots__ = ('status', 'players', 'order', 'ranking', 'leader_index', 'round_number',
+                 'situations', 'current_situation', 'submitted', 'voting_options',
+                 'session_id', 'deadline', 'idle_rounds', 'nonce', 'board_message_id', 'screens', 'version')
+
+    def __init__(self, status='waiting', nonce=0):
+        self.status = status
+        self.players = {}           # user_id -> Player
+        self.order = []             # user_id в порядке присоединения (очередь ведущих)
+        self.ranking = []           # user_id по убыванию очков, при равенстве - по присоединению
+        self.leader_index = 0
+        self.round_number = 0
+        self.situations = []        # варианты ситуаций для ведущего
+        self.current_situation = None
+        self.submitted = []         # user_id в порядке отправки мемов
+        self.voting_options = []    # user_id в порядке кнопок голосования
+        self.session_id = None
+        self.deadline = None
+        self.idle_rounds = 0
+        self.nonce = nonce
+        self.board_message_id = None  # закрепленное табло игры в чате
+        self.screens = {}           # user_id -> копия табло в ЛС игрока (быстрая игра без общего чата)
+        self.version = 0            # версия в общем хранилище (compare-and-set)
+
+    @property
+    def leader(self):
+        return self.order[self.leader_index]
+
+    def add_player(self, user_id, name):
+        player = self.players[user_id] = Player(user_id, name)
+        self.order.append(user_id)
+        self.ranking.append(user_id)
+        return player
+
+    def rotate_leader(self):
+        self.leader_index = (self.leader_index + 1) % len(self.order)
+
+    def name(self, user_id, default="Игрок"):
+        player = self.players.get(user_id)
+        return player.name if player else default
+
+    def start_round(self, situation, hands):
+        """Ситуация выбрана: раздать руки (user_id -> индексы мемов), сбросить выбор"""
+        self.current_situation = situation
+        self.submitted = []
+        self.voting_options = []
+        for player in self.players.values():
+            player.hand = array('i', hands.get(player.user_id, ()))
+            player.choice = None
+
+    def submit(self, user_id, hand_position):
+        player = self.players[user_id]
+        player.choice = player.hand[hand_position]
+        self.submitted.append(user_id)
+
+    def board_targets(self, chat_id):
+        """Сообщения табло (чат, message_id): в чате игры или копии в ЛС игроков быстрой игры"""
+        if self.screens:
+            return list(self.screens.items())
+        return [(chat_id, self.board_message_id)] if self.board_message_id else []
+
+    def award(self, user_id, points=1):
+        """Начислить очки и поднять игрока в рейтинге: сдвиг на несколько позиций, без сортировки"""
+        player = self.players[user_id]
+        player.score += points
+        ranking = self.ranking
+        position = ranking.index(user_id)
+        joined = self.order.index(user_id)
+        while position:
+            ahead = self.players[ranking[position - 1]]
+            # Равные очки - по порядку присоединения, как после rerank()
+            if ahead.score > player.score or (ahead.score == player.score
+                                              and self.order.index(ahead.user_id) < joined):
+                break
+            ranking[position] = ahead.user_id
+            position -= 1
+        ranking[position] = user_id
+
+    def scoreboard(self):
+        """Игроки по убыванию очков"""
+        return [self.players[user_id] for user_id in self.ranking]
+
+    def rerank(self):
+        # Рейтинг из очков заново: после восстановления из снимка
+        self.ranking = sorted(self.order, key=lambda user_id: self.players[user_id].score, reverse=True)
+
+    def to_dict(self):
+        return {
+            'v': SNAPSHOT_VERSION,
+            'status': self.status,
+            'players': [[p.user_id, p.name, p.score, p.hand.tolist(), p.choice] for p in self.players.values()],
+            'leader_index': self.leader_index,
+            'round_number': self.round_number,
+            'situations': self.situations,
+            'current_situation': self.current_situation,
+            'submitted': self.submitted,
+            'voting_options': self.voting_options,
+            'session_id': self.session_id,
+            'deadline': self.deadline,
+            'idle_rounds': self.idle_rounds,
+            'nonce': self.nonce,
+            'board': self.board_message_id,
+            'screens': list(self.screens.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        game = cls(state['status'], state.get('nonce', 0))
+        for user_id, name, score, hand, choice in state['players']:
+            game.players[user_id] = Player(user_id, name, score, hand, choice)
+            game.order.append(user_id)
+        game.leader_index = state['leader_index']
+        game.round_number = state['round_number']
+        game.situations = state['situations']
+        game.current_situation = state['current_situation']
+        game.submitted = state['submitted']
+        game.voting_options = state['voting_options']
+        game.session_id = state['session_id']
+        game.deadline = state['deadline']
+        game.idle_rounds = state['idle_rounds']
+        game.board_message_id = state.get('board')
+        game.screens = dict(state.get('screens', ()))
+        game.rerank()
+        return game
+
+
+def dump_game(game):
+    """Компактный JSON-снимок игры"""
+    return json.dumps(game.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+def load_game(text):
+    """Восстановить игру из снимка dump_game"""
+    state = json.loads(text)
+    if state.get('v') != SNAPSHOT_VERSION:
+        raise ValueError(f"Неизвестная версия снимка игры: {state.get('v')}")
+    return Game.from_dict(state)
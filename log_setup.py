@@ -0,0 +1,143 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from config import Config
+
+# Поля контекста, которые попадают в каждую запись обработчика
+CONTEXT_FIELDS = ('chat_id', 'user_id', 'phase', 'handler')
+
+# Контекст текущего апдейта: у каждой задачи asyncio своя копия,
+# задачи, запущенные обработчиком (раздача мемов, правка табло), наследуют его
+_context = contextvars.ContextVar('log_context', default={})
+
+_listener = None
+
+
+def bind(**fields):
+    """Новый контекст записей для текущей задачи; вернуть токен для unbind()"""
+    return _context.set(dict(_context.get(), **fields))
+
+
+def annotate(**fields):
+    """Дополнить контекст текущей задачи (например, фаза игры сменилась)"""
+    if _context.get():
+        _context.set(dict(_context.get(), **fields))
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Переносит контекст апдейта в запись. Срабатывает в задаче, которая пишет лог,
+    до постановки записи в очередь - поток записи контекста уже не видит.
+    """
+
+    def filter(self, record):
+        context = _context.get()
+        for field in CONTEXT_FIELDS:
+            if field in context and not hasattr(record, field):
+                setattr(record, field, context[field])
+        started = context.get('started')
+        if started is not None and not hasattr(record, 'duration'):
+            record.duration = time.perf_counter() - started
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Текст сообщения собирается в пишущей задаче (аргументы могут измениться позже),
+    трассировка - строкой в exc_text: в очередь уходит запись без ссылок на кадры стека
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        duration = getattr(record, 'duration', None)
+        if duration is not None:
+            entry['duration_ms'] = round(duration * 1000, 1)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Формат для разработки: как прежний basicConfig, контекст - в конце строки"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS
+                           if getattr(record, field, None) is not None)
+        return f"{line} [{context}]" if context else line
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """
+    Корневой логгер пишет в очередь, а в stdout пишет отдельный поток:
+    медленный stdout (лог-дрейн, pipe) не блокирует event loop.
+    Повторный вызов перенастраивает вывод.
+    """
+    global _listener
+    level = (level or Config.LOG_LEVEL).upper()
+    fmt = fmt or Config.LOG_FORMAT
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # Запрос к Bot API на каждое событие - шум уровня INFO у httpx
+    logging.getLogger('httpx').setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _flush_on_exit():
+    # Дописать очередь перед выходом процесса
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
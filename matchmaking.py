@@ -0,0 +1,113 @@
+import math
+import random
+import time
+from collections import OrderedDict, namedtuple
+from config import Config
+
+# Быстрые игры живут не в чате Telegram, а в ЛС игроков. Ключ такой игры -
+# синтетический chat_id ниже QUICK_CHAT_BASE: реальные id чатов Telegram
+# (супергруппы -100...) до него не доходят, а в callback_data (int64) он помещается
+QUICK_CHAT_BASE = -(1 << 62)
+
+# Ключ, по которому роутер отправляет очередь и быстрые игры на один воркер
+POOL_CHAT_ID = 0
+
+Waiting = namedtuple('Waiting', 'user_id name joined')
+
+
+def is_quick_chat(chat_id):
+    return chat_id <= QUICK_CHAT_BASE
+
+
+def new_quick_chat_id():
+    return QUICK_CHAT_BASE - random.getrandbits(48)
+
+
+class Matchmaker:
+    """
+    Очередь быстрой игры (/quickplay): игроки из любых чатов собираются в игры
+    от min_players до max_players человек.
+
+    Очередь - OrderedDict user_id -> Waiting в порядке входа: вход, выход
+    и выдача самых давних игроков - O(1). Цель по времени ожидания задается
+    для первого в очереди: сразу ему подходит только полный стол, а к target_wait
+    секундам требование линейно снижается до min_players. Остальные ждут
+    меньше первого, поэтому решение о новой игре принимается по нему одному.
+    Полный стол собирается сразу, так что между проверками в очереди
+    не больше max_players - 1 игроков, сколько бы ни нажали /quickplay разом.
+    Кто прождал max_wait и так и не набрал min_players, покидает очередь.
+    """
+
+    def __init__(self, min_players=None, max_players=None, target_wait=None, max_wait=None):
+        self.min_players = min_players or Config.MIN_PLAYERS
+        self.max_players = max_players or Config.MAX_PLAYERS
+        self.target_wait = Config.QUICKPLAY_TARGET_WAIT if target_wait is None else target_wait
+        self.max_wait = Config.QUICKPLAY_MAX_WAIT if max_wait is None else max_wait
+        self._queue = OrderedDict()  # user_id -> Waiting, самые давние первыми
+        self.playing = {}            # user_id -> chat_id быстрой игры, в которой он сейчас
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __contains__(self, user_id):
+        return user_id in self._queue
+
+    def join(self, user_id, name, now=None):
+        """Встать в очередь; False - игрок уже в очереди или в быстрой игре"""
+        if user_id in self._queue or user_id in self.playing:
+            return False
+        self._queue[user_id] = Waiting(user_id, name, time.time() if now is None else now)
+        return True
+
+    def leave(self, user_id):
+        return self._queue.pop(user_id, None) is not None
+
+    def table_size(self, waited):
+        """Сколько игроков нужно для игры, если первый в очереди ждет waited секунд"""
+        if waited >= self.target_wait:
+            return self.min_players
+        # Запас на погрешность: проверка в момент next_check() должна сработать
+        relaxed = math.floor((self.max_players - self.min_players) * waited / self.target_wait + 1e-9)
+        return self.max_players - relaxed
+
+    def match(self, now=None):
+        """Собрать игры, которые уже можно начать: список групп Waiting, давние первыми"""
+        now = time.time() if now is None else now
+        groups = []
+        while len(self._queue) >= self.min_players:
+            head = next(iter(self._queue.values()))
+            size = min(len(self._queue), self.max_players)
+            if size < self.table_size(now - head.joined):
+                break
+            groups.append([self._queue.popitem(last=False)[1] for _ in range(size)])
+        return groups
+
+    def expire(self, now=None):
+        """Убрать из очереди тех, кто прождал max_wait без игры"""
+        now = time.time() if now is None else now
+        expired = []
+        while self._queue:
+            head = next(iter(self._queue.values()))
+            if now - head.joined < self.max_wait:
+                break
+            expired.append(self._queue.popitem(last=False)[1])
+        return expired
+
+    def next_check(self):
+        """Когда очередь изменится сама: соберется игра поменьше или истечет ожидание"""
+        if not self._queue:
+            return None
+        head = next(iter(self._queue.values()))
+        waiting = len(self._queue)
+        if waiting < self.min_players:
+            return head.joined + self.max_wait
+        span = self.max_players - self.min_players
+        return head.joined + (self.target_wait * (self.max_players - waiting) / span if span else 0)
+
+    def started(self, chat_id, user_ids):
+        for user_id in user_ids:
+            self.playing[user_id] = chat_id
+
+    def finished(self, user_ids):
+        for user_id in user_ids:
+            self.playing.pop(user_id, None)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import time
+from telegram import InputMediaPhoto, InputMediaVideo
+from telegram.error import RetryAfter
+from config import Config
+from metrics import MEDIA_READ_SECONDS, MEDIA_SOURCES
+from meme_catalog import media_type_for
+from rate_limiter import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+def is_video(meme):
+    media_type = meme.get('media_type') or media_type_for(meme['filename'])
+    return media_type == 'video'
+
+
+def file_id_from_message(message):
+    """Достать file_id из сообщения, которое вернул Telegram после отправки"""
+    if message is None:
+        return None
+    if message.video:
+        return message.video.file_id
+    if message.animation:
+        return message.animation.file_id
+    if message.photo:
+        return message.photo[-1].file_id
+    if message.document:
+        return message.document.file_id
+    return None
+
+
+class MediaCache:
+    """
+    Кэш Telegram file_id для мемов: каждый файл загружается один раз,
+    дальше отправляется по file_id
+    """
+    def __init__(self, db):
+        self.db = db
+        # Загрузка при старте, до запуска event loop
+        self._file_ids = db.sync.load_media_file_ids()
+        logger.info("✅ Кэш file_id загружен: %s записей", len(self._file_ids))
+
+    @staticmethod
+    def cache_key(meme):
+        # Имя + размер + время изменения: замена файла с тем же именем даст новый ключ.
+        # Мемы из каталога уже знают размер и mtime, stat нужен только для остальных
+        if 'size' in meme:
+            return f"{meme['filename']}:{meme['size']}:{meme['mtime']}"
+        stat = os.stat(meme['path'])
+        return f"{meme['filename']}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    def get(self, meme):
+        if meme['path'] == 'stub':
+            return None
+        try:
+            return self._file_ids.get(self.cache_key(meme))
+        except OSError:
+            return None
+
+    async def remember(self, meme, message):
+        file_id = file_id_from_message(message)
+        if not file_id or meme['path'] == 'stub':
+            return
+        try:
+            key = self.cache_key(meme)
+        except OSError:
+            return
+        if self._file_ids.get(key) == file_id:
+            return
+        self._file_ids[key] = file_id
+        await self.db.save_media_file_id(key, file_id, 'video' if is_video(meme) else 'photo')
+
+    def keys(self):
+        return list(self._file_ids)
+
+    def drop(self, keys):
+        """Забыть file_id удаленных файлов при старте, до запуска event loop"""
+        keys = [key for key in keys if self._file_ids.pop(key, None) is not None]
+        if keys:
+            self.db.sync.delete_media_file_ids(keys)
+
+    async def forget(self, keys):
+        """Забыть file_id удаленных файлов (например, вытесненных листов голосования)"""
+        keys = [key for key in keys if self._file_ids.pop(key, None) is not None]
+        if keys:
+            await self.db.delete_media_file_ids(keys)
+
+    async def remember_group(self, memes, messages):
+        for meme, message in zip(memes, messages or ()):
+            await self.remember(meme, message)
+
+    def input_media(self, meme, caption=""):
+        """InputMedia для медиагруппы: по file_id, если он уже есть, иначе с загрузкой файла"""
+        media_class = InputMediaVideo if is_video(meme) else InputMediaPhoto
+        file_id = self.get(meme)
+        if file_id:
+            MEDIA_SOURCES.inc('file_id')
+            return media_class(media=file_id, caption=caption)
+        # InputFile читает содержимое сразу, поэтому файл можно закрыть
+        MEDIA_SOURCES.inc('upload')
+        started = time.perf_counter()
+        with open(meme['path'], 'rb') as f:
+            media = media_class(media=f, caption=caption)
+        MEDIA_READ_SECONDS.observe(time.perf_counter() - started)
+        return media
+
+    async def send(self, bot, chat_id, meme, caption=None, **kwargs):
+        """Отправить один мем (видео или фото) и запомнить его file_id"""
+        file_id = self.get(meme)
+        send = bot.send_video if is_video(meme) else bot.send_photo
+        field = 'video' if is_video(meme) else 'photo'
+        if file_id:
+            MEDIA_SOURCES.inc('file_id')
+            return await send(chat_id, **{field: file_id}, caption=caption, **kwargs)
+
+        MEDIA_SOURCES.inc('upload')
+        with open(meme['path'], 'rb') as f:
+            message = await send(chat_id, **{field: f}, caption=caption, **kwargs)
+        await self.remember(meme, message)
+        return message
+
+    async def warm_up(self, bot, storage_chat_id, memes):
+        """Фоновая предзагрузка всей библиотеки мемов в служебный чат"""
+        pending = [m for m in memes if m['path'] != 'stub' and not self.get(m)]
+        logger.info("🔄 Предзагрузка мемов: %s из %s без file_id", len(pending), len(memes))
+
+        # С ограничителем запросов предзагрузка уступает очередь игровым сообщениям
+        extra = {'rate_limit_args': BACKGROUND} if getattr(bot, 'rate_limiter', None) else {}
+        uploaded = 0
+        for meme in pending:
+            while True:
+                try:
+                    await self.send(bot, storage_chat_id, meme, disable_notification=True, **extra)
+                    uploaded += 1
+                    break
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error("❌ Ошибка предзагрузки мема %s: %s", meme['filename'], e)
+                    break
+            await asyncio.sleep(Config.MEDIA_WARMUP_DELAY)
+
+        logger.info("✅ Предзагрузка мемов завершена: загружено %s", uploaded)
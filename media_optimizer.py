@@ -0,0 +1,212 @@
+"""
+Оптимизация библиотеки мемов перед отправкой в Telegram.
+
+Картинки уменьшаются до MEDIA_MAX_SIDE, пережимаются в JPEG без метаданных,
+статичные GIF становятся JPEG. Видео и анимированные GIF перекодируются в H.264 MP4,
+если в системе есть ffmpeg (иначе отправляются как есть).
+
+Результаты лежат в папке с адресацией по содержимому: <хэш[:2]>/<хэш>.<ext>,
+где хэш - sha256 исходного файла и настроек. index.json связывает мем
+(имя:размер:mtime) с артефактом, поэтому уже обработанные файлы не читаются повторно.
+
+Запуск вручную: python media_optimizer.py [--workers N]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from config import Config
+from meme_catalog import VIDEO_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+
+def _settings_signature():
+    # Смена настроек дает другие хэши: артефакты пересобираются
+    return (f"v1:{Config.MEDIA_MAX_SIDE}:{Config.MEDIA_JPEG_QUALITY}:"
+            f"{Config.MEDIA_VIDEO_MAX_SIDE}:{Config.MEDIA_VIDEO_CRF}").encode('ascii')
+
+
+def source_hash(path):
+    digest = hashlib.sha256(_settings_signature())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_animated(path):
+    with Image.open(path) as image:
+        return getattr(image, 'n_frames', 1) > 1
+
+
+def _optimize_image(src, dst):
+    with Image.open(src) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((Config.MEDIA_MAX_SIDE, Config.MEDIA_MAX_SIDE), Image.LANCZOS)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Прозрачность кладем на белый фон: Telegram все равно отдает фото в JPEG
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        # exif не передаем - метаданные не попадают в артефакт
+        image.save(dst, 'JPEG', quality=Config.MEDIA_JPEG_QUALITY, optimize=True, progressive=True)
+
+
+def _optimize_video(src, dst, ffmpeg):
+    side = Config.MEDIA_VIDEO_MAX_SIDE
+    subprocess.run([
+        ffmpeg, '-v', 'error', '-y', '-i', src,
+        '-map_metadata', '-1',
+        '-vf', f"scale='min({side},iw)':'min({side},ih)':force_original_aspect_ratio=decrease,"
+               f"pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(Config.MEDIA_VIDEO_CRF),
+        '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '96k',
+        '-movflags', '+faststart', '-f', 'mp4', dst
+    ], check=True, capture_output=True, timeout=600)
+
+
+def optimize_file(path, cache_dir, ffmpeg):
+    """
+    Оптимизировать один файл (выполняется в процессе пула).
+    Возвращает (запись индекса, байт до, байт после). Запись [путь относительно cache_dir,
+    тип медиа, размер, mtime] или [None], если выигрыша нет и отправляется исходный файл.
+    Без ffmpeg видео откладывается: возвращается None, запись в индекс не делается.
+    """
+    src_size = os.path.getsize(path)
+    lower = path.lower()
+    if lower.endswith(VIDEO_EXTENSIONS) or (lower.endswith('.gif') and _is_animated(path)):
+        if not ffmpeg:
+            return None
+        ext, media_type = '.mp4', 'video'
+    else:
+        ext, media_type = '.jpg', 'photo'
+
+    digest = source_hash(path)
+    relpath = os.path.join(digest[:2], digest + ext)
+    artifact = os.path.join(cache_dir, relpath)
+    if not os.path.exists(artifact):
+        os.makedirs(os.path.dirname(artifact), exist_ok=True)
+        tmp_file = f"{artifact}.{os.getpid()}.tmp"
+        try:
+            if media_type == 'video':
+                _optimize_video(path, tmp_file, ffmpeg)
+            else:
+                _optimize_image(path, tmp_file)
+            os.replace(tmp_file, artifact)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    stat = os.stat(artifact)
+    if stat.st_size >= src_size:
+        # Исходник уже компактнее: артефакт не нужен
+        os.remove(artifact)
+        return [None], src_size, src_size
+    return [relpath, media_type, stat.st_size, int(stat.st_mtime)], src_size, stat.st_size
+
+
+class MediaOptimizer:
+    """Индекс оптимизированных артефактов и их сборка пулом процессов"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, INDEX_FILE)
+        self.index = {}  # имя:размер:mtime -> [артефакт, тип медиа, размер, mtime] или [None]
+        self.load()
+
+    @staticmethod
+    def key(meme):
+        return f"{meme['filename']}:{meme['size']}:{meme['mtime']}"
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+        except Exception as e:
+            logger.error("❌ Ошибка чтения индекса оптимизированных мемов: %s", e)
+            self.index = {}
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.index_file)
+
+    def serve(self, meme):
+        """Мем для отправки: оптимизированный артефакт, если он есть, иначе исходный"""
+        record = self.index.get(self.key(meme))
+        if not record or not record[0]:
+            return meme
+        relpath, media_type, size, mtime = record
+        # Размер и mtime артефакта: file_id кэшируется для тех байтов, что ушли в Telegram
+        return dict(meme, path=os.path.join(self.cache_dir, relpath), size=size, mtime=mtime, media_type=media_type)
+
+    def optimize(self, memes, workers=None):
+        """Обработать мемы, которых еще нет в индексе. Возвращает (обработано, байт до, байт после)"""
+        ffmpeg = shutil.which('ffmpeg')
+        pending = [meme for meme in memes if self.key(meme) not in self.index]
+        if not ffmpeg:
+            videos = [meme for meme in pending if meme['filename'].lower().endswith(VIDEO_EXTENSIONS)]
+            if videos:
+                logger.warning("⚠️ ffmpeg не найден: %s видео отправляются без оптимизации", len(videos))
+                pending = [meme for meme in pending if meme not in videos]
+        if not pending:
+            return 0, 0, 0
+
+        started = time.perf_counter()
+        processed = bytes_before = bytes_after = 0
+        with ProcessPoolExecutor(max_workers=workers or Config.MEDIA_OPTIMIZE_WORKERS) as pool:
+            futures = {
+                self.key(meme): pool.submit(optimize_file, meme['path'], self.cache_dir, ffmpeg)
+                for meme in pending
+            }
+            for meme_key, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error("❌ Ошибка оптимизации %s: %s", meme_key, e)
+                    continue
+                if result is None:
+                    # Анимированный GIF без ffmpeg: обработается, когда ffmpeg появится
+                    continue
+                record, src_size, out_size = result
+                self.index[meme_key] = record
+                processed += 1
+                bytes_before += src_size
+                bytes_after += out_size
+
+        self._save()
+        logger.info("✅ Оптимизировано мемов: %s за %.1fс, %.1fМБ -> %.1fМБ", processed,
+                    time.perf_counter() - started, bytes_before / 1024 / 1024, bytes_after / 1024 / 1024)
+        return processed, bytes_before, bytes_after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='процессов (по умолчанию - все ядра)')
+    args = parser.parse_args()
+
+    from log_setup import setup_logging
+    from meme_catalog import MemeCatalog
+    setup_logging()
+    catalog = MemeCatalog(Config.MEMES_DIR, legacy_manifest=Config.MEMES_MANIFEST_FILE)
+    MediaOptimizer(Config.OPTIMIZED_MEDIA_DIR).optimize(catalog.memes(), args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import os
+import json
+import logging
+from collections import OrderedDict
+from config import Config
+from meme_index import MemeIndex
+
+logger = logging.getLogger(__name__)
+
+MEME_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.mp4', '.mov', '.avi')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+
+def media_type_for(filename):
+    return 'video' if filename.lower().endswith(VIDEO_EXTENSIONS) else 'photo'
+
+
+class MemeCatalog:
+    """
+    Каталог мемов поверх индекса в SQLite (meme_index.MemeIndex). Папка
+    пересканируется только когда меняется её mtime (или по явной команде),
+    в индекс пишутся лишь новые, измененные и пропавшие файлы.
+    Индексы мемов стабильны: удаленный файл остается в индексе скрытой строкой.
+
+    В памяти - только пулы id для раздачи (array на фильтр) и LRU недавно
+    запрошенных мемов, а не словарь на каждый файл библиотеки.
+
+    Работа с диском и SQLite (load, fetch) не трогает состояние каталога и
+    может идти в потоке: бот выполняет ее в потоке БД, а в event loop
+    остаются только apply и попадания в пулы и LRU.
+    """
+    def __init__(self, memes_dir, index=None, legacy_manifest=None):
+        self.memes_dir = memes_dir
+        self.index = index or MemeIndex()
+        self.dir_mtime = self.index.get_state('dir_mtime')
+        self.version = 0
+        self._revision = None
+        self._count = 0
+        self._pools = {}              # (тип, тег) -> array id для раздачи
+        self._cache = OrderedDict()   # индекс -> мем, недавние последними
+
+        if legacy_manifest and self.index.is_empty():
+            self._import_manifest(legacy_manifest)
+        self.refresh()
+
+    def __len__(self):
+        return self._count
+
+    def _make_entry(self, row):
+        index, filename, media_type, size, mtime, width, height, duration, enabled = row
+        return {
+            'index': index,
+            'filename': filename,
+            'path': os.path.join(self.memes_dir, filename),
+            'size': size,
+            'mtime': mtime,
+            'media_type': media_type,
+            'width': width,
+            'height': height,
+            'duration': duration,
+            'enabled': bool(enabled)
+        }
+
+    def _import_manifest(self, manifest_file):
+        """Однократный перенос прежнего JSON-манифеста: индексы в снимках игр остаются верными"""
+        if not os.path.exists(manifest_file):
+            return
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rows = data.get('memes', [])
+            self.index.import_legacy(rows, data.get('dir_mtime'))
+            logger.info("✅ Манифест мемов перенесен в индекс: %s мемов", sum(row is not None for row in rows))
+        except Exception as e:
+            logger.error("❌ Ошибка переноса манифеста мемов: %s", e)
+
+    def _scan(self, force):
+        try:
+            dir_mtime = os.stat(self.memes_dir).st_mtime_ns
+        except OSError:
+            return False
+
+        if not force and dir_mtime == self.dir_mtime:
+            return False
+
+        # mtime папки меняют добавление, удаление и переименование файлов: размер
+        # и mtime нужны только новым именам. Правку файла на месте находит force
+        known = self.index.files() if force else dict.fromkeys(self.index.present_files())
+        seen = set()
+        changed = []
+        with os.scandir(self.memes_dir) as it:
+            for dir_entry in it:
+                filename = dir_entry.name
+                if not filename.lower().endswith(MEME_EXTENSIONS) or not dir_entry.is_file():
+                    continue
+                seen.add(filename)
+                if filename in known and not force:
+                    continue
+
+                stat = dir_entry.stat()
+                mtime = int(stat.st_mtime)
+                if known.get(filename) == (stat.st_size, mtime):
+                    continue
+                changed.append((filename, stat.st_size, mtime, media_type_for(filename)))
+
+        missing = [filename for filename in known if filename not in seen]
+        self.index.apply_scan(changed, missing, dir_mtime)
+        self.dir_mtime = dir_mtime
+        if changed or missing:
+            logger.info("🔄 Папка мемов просканирована: новых и измененных %s, удалено %s",
+                        len(changed), len(missing))
+        return bool(changed or missing)
+
+    def load(self, force=False, pools=()):
+        """
+        Скан папки и чтение индекса для refresh: без force папка сканируется
+        только если изменился её mtime. Заодно строит пулы pools (ключи
+        (тип, тег)), которых нет в каталоге. Результат применяет apply().
+        """
+        changed = self._scan(force)
+
+        # Индекс могли изменить и без скана: теги и enabled из python meme_index.py
+        revision = self.index.revision()
+        stale = revision != self._revision
+        count = self.index.count() if stale else self._count
+        built = {key: self.index.pool(*key) for key in pools if stale or key not in self._pools}
+        return changed, revision, count, built
+
+    def apply(self, update):
+        """Применить результат load(). Возвращает True, если папка изменилась"""
+        changed, revision, count, pools = update
+        if revision != self._revision:
+            # Результат, прочитанный до более нового обновления, устарел
+            if self._revision is not None and revision < self._revision:
+                return changed
+            self._revision = revision
+            self._count = count
+            self._pools = {}
+            self._cache.clear()
+            self.version += 1
+            logger.info("🔄 Каталог мемов обновлен: %s мемов", self._count)
+        self._pools.update(pools)
+        return changed
+
+    def refresh(self, force=False):
+        """Инкрементальное обновление каталога. Возвращает True, если папка изменилась"""
+        return self.apply(self.load(force))
+
+    def memes(self):
+        """Все существующие мемы (включая выключенные) - для оптимизации и предзагрузки"""
+        return [self._make_entry(row) for row in self.index.rows()]
+
+    def pool(self, media_type=None, tag=None):
+        """id мемов для раздачи; один общий массив на фильтр до следующего изменения каталога"""
+        key = (media_type, tag)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = self.index.pool(media_type, tag)
+        return pool
+
+    def cached(self, index):
+        """Мем из LRU или None, без запроса к индексу"""
+        meme = self._cache.get(index)
+        if meme is not None:
+            self._cache.move_to_end(index)
+        return meme
+
+    def fetch(self, indexes):
+        """Строки индекса для мемов, которых нет в LRU (результат - в remember)"""
+        return {index: self.index.get(index) for index in indexes}
+
+    def remember(self, index, row):
+        if row is None:
+            return None
+        meme = self._cache[index] = self._make_entry(row)
+        if len(self._cache) > Config.MEME_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return meme
+
+    def get(self, index):
+        meme = self.cached(index)
+        if meme is None:
+            meme = self.remember(index, self.index.get(index))
+        return meme
@@ -0,0 +1,74 @@
+import random
+
+
+class MemeDeck:
+    """
+    Колода одного чата поверх общего пула id каталога (catalog.pool()).
+    Перетасовка ленивая (Фишер-Йетс по мере раздачи): карта тянется за O(1),
+    а колода хранит только перестановки уже вытянутых карт, а не копию пула.
+    Повторов нет, пока колода не закончится; внутри раунда одна и та же карта
+    не достается двум игрокам.
+    Фильтр раздачи (тип, тег) сужает пул; если под него ничего не подходит,
+    раздается вся библиотека.
+    """
+    def __init__(self, catalog, media_type=None, tag=None):
+        self.catalog = catalog
+        self.media_type = media_type
+        self.tag = tag
+        self._pool = ()
+        self._remaining = 0
+        self._swaps = {}     # позиция в пуле -> позиция карты, которая на нее переставлена
+        self._version = None
+        self._round_cards = set()
+
+    def _shuffle(self):
+        self._pool = self.catalog.pool(self.media_type, self.tag)
+        if not self._pool and (self.media_type or self.tag):
+            self._pool = self.catalog.pool()
+        self._remaining = len(self._pool)
+        self._swaps = {}
+        self._version = self.catalog.version
+
+    def _next(self):
+        # Случайная карта из еще не вытянутых, на ее место - последняя не вытянутая
+        position = random.randrange(self._remaining)
+        last = self._remaining - 1
+        card = self._swaps.get(position, position)
+        moved = self._swaps.pop(last, last)
+        if position != last:
+            self._swaps[position] = moved
+        self._remaining = last
+        return self._pool[card]
+
+    def new_round(self):
+        self._round_cards = set()
+
+    def draw(self, count):
+        # Каталог изменился - пул мог устареть
+        if self._version != self.catalog.version:
+            self._shuffle()
+
+        hand = []
+        progress = True
+        allow_repeats = False
+        while len(hand) < count:
+            if not self._remaining:
+                if not progress:
+                    if allow_repeats:
+                        break
+                    # Мемов меньше, чем игроков * карт: повторы между игроками неизбежны
+                    allow_repeats = True
+                # Колода закончилась: карты, уже розданные в этом раунде, пропускаются
+                self._shuffle()
+                if not self._remaining:
+                    break
+                progress = False
+
+            index = self._next()
+            if index in hand or (index in self._round_cards and not allow_repeats):
+                continue
+            hand.append(index)
+            self._round_cards.add(index)
+            progress = True
+
+        return hand
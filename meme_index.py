@@ -0,0 +1,386 @@
+"""
+Индекс библиотеки мемов в SQLite (таблицы memes и meme_tags в базе бота).
+
+Для каждого файла из data/memes хранятся тип, размер, mtime, размеры кадра
+и длительность, теги, флаг enabled и счетчики раздач и побед. id строки -
+индекс мема в каталоге: он стабилен, удаленный файл остается строкой
+с present = 0, а вернувшийся файл получает свой прежний id.
+
+Папку сканирует MemeCatalog (только когда меняется ее mtime), в индекс
+пишутся лишь новые, измененные и пропавшие файлы. Теги берутся из имени
+файла и добавляются вручную; кириллица приводится к латинице, так что
+"кот.jpg" и "kot.jpg" получают один тег. Размеры и длительность читаются
+отдельным шагом: картинки - заголовок через Pillow, видео - ffprobe, если он есть.
+
+Запуск вручную:
+  python meme_index.py import [--force]   импорт папки и чтение метаданных
+  python meme_index.py tag ФАЙЛ ТЕГ...    добавить теги (untag - снять)
+  python meme_index.py disable ФАЙЛ...    не раздавать мем (enable - вернуть)
+  python meme_index.py stats              сводка по библиотеке
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import time
+from array import array
+from PIL import Image
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS memes (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           filename TEXT NOT NULL UNIQUE,
+           media_type TEXT NOT NULL,
+           size INTEGER NOT NULL,
+           mtime INTEGER NOT NULL,
+           width INTEGER,
+           height INTEGER,
+           duration REAL,
+           probed INTEGER NOT NULL DEFAULT 0,
+           enabled INTEGER NOT NULL DEFAULT 1,
+           present INTEGER NOT NULL DEFAULT 1,
+           times_dealt INTEGER NOT NULL DEFAULT 0,
+           times_won INTEGER NOT NULL DEFAULT 0,
+           added_at REAL
+       )''',
+    # Пул раздачи: только включенные и существующие мемы, по типу
+    '''CREATE INDEX IF NOT EXISTS idx_memes_deal
+       ON memes (media_type, id) WHERE enabled = 1 AND present = 1''',
+    '''CREATE TABLE IF NOT EXISTS meme_tags (
+           tag TEXT NOT NULL,
+           meme_id INTEGER NOT NULL REFERENCES memes (id),
+           auto INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (tag, meme_id)
+       ) WITHOUT ROWID''',
+    '''CREATE INDEX IF NOT EXISTS idx_meme_tags_meme ON meme_tags (meme_id)''',
+    '''CREATE TABLE IF NOT EXISTS meme_index_state (
+           key TEXT PRIMARY KEY,
+           value
+       )''',
+]
+
+ROW_COLUMNS = 'id, filename, media_type, size, mtime, width, height, duration, enabled'
+
+# Транслитерация для тегов: "кот" и "kot" - один тег
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya',
+})
+
+TAG_MIN_LENGTH = 3
+TAG_WORD = re.compile(r'[a-z0-9]+')
+PROBE_BATCH_SIZE = 500
+
+
+def normalize_tag(text):
+    return ''.join(TAG_WORD.findall(text.lower().translate(TRANSLIT)))
+
+
+def filename_tags(filename):
+    """Теги из имени файла: слова от трех букв, без чисел"""
+    stem = os.path.splitext(filename)[0].lower().translate(TRANSLIT)
+    return {tag for tag in TAG_WORD.findall(stem) if len(tag) >= TAG_MIN_LENGTH and not tag.isdigit()}
+
+
+def probe_media(path, media_type, ffprobe=None):
+    """(ширина, высота, длительность) файла; None - прочитать нечем (видео без ffprobe)"""
+    if media_type == 'video':
+        if not ffprobe:
+            return None
+        output = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=width,height:format=duration', '-of', 'json', path],
+            capture_output=True, check=True, timeout=60,
+        ).stdout
+        info = json.loads(output)
+        stream = (info.get('streams') or [{}])[0]
+        duration = info.get('format', {}).get('duration')
+        return stream.get('width'), stream.get('height'), float(duration) if duration else None
+
+    # Pillow читает только заголовок; у анимированного GIF - еще и кадры ради длительности
+    with Image.open(path) as image:
+        frames = getattr(image, 'n_frames', 1)
+        duration = frames * image.info.get('duration', 0) / 1000 if frames > 1 else None
+        return image.width, image.height, duration
+
+
+class MemeIndex:
+    """
+    Метаданные мемов в SQLite. Запросы раздачи идут по частичному индексу
+    включенных мемов и по (tag, meme_id), поэтому пул на 100 тысяч мемов
+    выбирается одним проходом по индексу без чтения файлов.
+    Любая правка, меняющая состав пулов (импорт, теги, enabled), увеличивает
+    revision: по нему каталог бота замечает и правки из командной строки.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path or Config.DATABASE_URL.replace('sqlite:///', '')
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}')
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def close(self):
+        self.conn.close()
+
+    def get_state(self, key):
+        row = self.conn.execute('SELECT value FROM meme_index_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, conn, key, value):
+        conn.execute('INSERT OR REPLACE INTO meme_index_state (key, value) VALUES (?, ?)', (key, value))
+
+    def _bump(self, conn):
+        conn.execute('''
+            INSERT INTO meme_index_state (key, value) VALUES ('revision', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1
+        ''')
+
+    def revision(self):
+        return self.get_state('revision') or 0
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM memes LIMIT 1').fetchone() is None
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM memes WHERE present = 1').fetchone()[0]
+
+    def present_files(self):
+        return {row[0] for row in self.conn.execute('SELECT filename FROM memes WHERE present = 1')}
+
+    def files(self):
+        """Имя файла -> (размер, mtime) существующих мемов для полного сравнения со сканом папки"""
+        cursor = self.conn.execute('SELECT filename, size, mtime FROM memes WHERE present = 1')
+        return {filename: (size, mtime) for filename, size, mtime in cursor}
+
+    def _write_auto_tags(self, conn, named_ids):
+        """Теги из имен файлов для пар (id, имя файла); ручные теги не трогаются"""
+        conn.executemany('DELETE FROM meme_tags WHERE meme_id = ? AND auto = 1',
+                         [(meme_id,) for meme_id, _ in named_ids])
+        conn.executemany('INSERT OR IGNORE INTO meme_tags (tag, meme_id, auto) VALUES (?, ?, 1)',
+                         [(tag, meme_id) for meme_id, filename in named_ids for tag in filename_tags(filename)])
+
+    def apply_scan(self, changed, missing, dir_mtime):
+        """
+        Результат скана папки одной транзакцией: changed - новые и измененные
+        файлы (имя, размер, mtime, тип), missing - имена пропавших файлов
+        """
+        now = time.time()
+        named_ids = []
+        with self.conn as conn:
+            for filename, size, mtime, media_type in changed:
+                # Измененный или вернувшийся файл сохраняет id и ручные теги, метаданные читаются заново
+                meme_id = conn.execute('''
+                    INSERT INTO memes (filename, media_type, size, mtime, added_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (filename) DO UPDATE SET
+                        media_type = excluded.media_type, size = excluded.size, mtime = excluded.mtime,
+                        width = NULL, height = NULL, duration = NULL, probed = 0, present = 1
+                    RETURNING id
+                ''', (filename, media_type, size, mtime, now)).fetchone()[0]
+                named_ids.append((meme_id, filename))
+            self._write_auto_tags(conn, named_ids)
+            conn.executemany('UPDATE memes SET present = 0 WHERE filename = ?', [(name,) for name in missing])
+            if changed or missing:
+                self._bump(conn)
+            self._set_state(conn, 'dir_mtime', dir_mtime)
+
+    def import_legacy(self, rows, dir_mtime):
+        """Перенос JSON-манифеста: rows[индекс] = (имя, размер, mtime, тип) или None для удаленного"""
+        now = time.time()
+        memes = [(meme_id, *row) for meme_id, row in enumerate(rows) if row is not None]
+        with self.conn as conn:
+            conn.executemany('''
+                INSERT INTO memes (id, filename, size, mtime, media_type, added_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(*meme, now) for meme in memes])
+            self._write_auto_tags(conn, [(meme[0], meme[1]) for meme in memes])
+            # Новые мемы не должны занять индексы удаленных в конце манифеста
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'memes'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('memes', ?)", (len(rows) - 1,))
+            self._bump(conn)
+            self._set_state(conn, 'dir_mtime', dir_mtime)
+
+    def pool(self, media_type=None, tag=None):
+        """id мемов для раздачи (включенные и существующие) с фильтром по типу и тегу"""
+        if tag is not None:
+            query = '''SELECT m.id FROM meme_tags t JOIN memes m ON m.id = t.meme_id
+                       WHERE t.tag = ? AND m.enabled = 1 AND m.present = 1'''
+            params = [normalize_tag(tag)]
+            if media_type is not None:
+                query += ' AND m.media_type = ?'
+                params.append(media_type)
+        else:
+            query = 'SELECT id FROM memes WHERE enabled = 1 AND present = 1'
+            params = []
+            if media_type is not None:
+                query += ' AND media_type = ?'
+                params.append(media_type)
+        return array('i', (row[0] for row in self.conn.execute(query, params)))
+
+    def get(self, meme_id):
+        return self.conn.execute(
+            f'SELECT {ROW_COLUMNS} FROM memes WHERE id = ? AND present = 1', (meme_id,)
+        ).fetchone()
+
+    def rows(self):
+        return self.conn.execute(f'SELECT {ROW_COLUMNS} FROM memes WHERE present = 1 ORDER BY id').fetchall()
+
+    def set_enabled(self, filenames, enabled):
+        with self.conn as conn:
+            updated = sum(
+                conn.execute('UPDATE memes SET enabled = ? WHERE filename = ?', (int(enabled), filename)).rowcount
+                for filename in filenames
+            )
+            if updated:
+                self._bump(conn)
+        return updated
+
+    def _find(self, filename):
+        row = self.conn.execute('SELECT id FROM memes WHERE filename = ?', (filename,)).fetchone()
+        return row[0] if row else None
+
+    def add_tags(self, filename, tags):
+        """Ручные теги мема; False - такого файла нет в индексе"""
+        meme_id = self._find(filename)
+        if meme_id is None:
+            return False
+        with self.conn as conn:
+            conn.executemany('''
+                INSERT INTO meme_tags (tag, meme_id, auto) VALUES (?, ?, 0)
+                ON CONFLICT (tag, meme_id) DO UPDATE SET auto = 0
+            ''', [(tag, meme_id) for tag in map(normalize_tag, tags) if tag])
+            self._bump(conn)
+        return True
+
+    def remove_tags(self, filename, tags):
+        meme_id = self._find(filename)
+        if meme_id is None:
+            return False
+        with self.conn as conn:
+            conn.executemany('DELETE FROM meme_tags WHERE tag = ? AND meme_id = ?',
+                             [(normalize_tag(tag), meme_id) for tag in tags])
+            self._bump(conn)
+        return True
+
+    def _save_probed(self, results):
+        with self.conn as conn:
+            conn.executemany('''
+                UPDATE memes SET width = ?, height = ?, duration = ?, probed = 1
+                WHERE id = ? AND size = ? AND mtime = ?
+            ''', results)
+
+    def probe(self, memes_dir):
+        """Прочитать размеры и длительность еще не прочитанных мемов (читает файлы - вне event loop)"""
+        ffprobe = shutil.which('ffprobe')
+        pending = self.conn.execute('''
+            SELECT id, filename, media_type, size, mtime FROM memes WHERE present = 1 AND probed = 0
+        ''').fetchall()
+        if not ffprobe:
+            videos = sum(1 for row in pending if row[2] == 'video')
+            if videos:
+                # Видео прочитаются при следующем запуске, когда ffprobe появится
+                logger.warning("⚠️ ffprobe не найден: длительность и размеры %s видео не прочитаны", videos)
+
+        started = time.perf_counter()
+        results = []
+        probed = 0
+        for meme_id, filename, media_type, size, mtime in pending:
+            try:
+                meta = probe_media(os.path.join(memes_dir, filename), media_type, ffprobe)
+            except Exception as e:
+                # Битый файл не читаем повторно до его изменения
+                logger.warning("⚠️ Не удалось прочитать метаданные %s: %s", filename, e)
+                meta = (None, None, None)
+            if meta is None:
+                continue
+            results.append((*meta, meme_id, size, mtime))
+            probed += 1
+            if len(results) >= PROBE_BATCH_SIZE:
+                self._save_probed(results)
+                results = []
+        self._save_probed(results)
+        if probed:
+            logger.info("✅ Метаданные мемов прочитаны: %s за %.1fс", probed, time.perf_counter() - started)
+        return probed
+
+    def stats(self):
+        by_type = self.conn.execute('''
+            SELECT media_type, COUNT(*), SUM(enabled), SUM(size), SUM(times_dealt), SUM(times_won),
+                   SUM(probed = 0)
+            FROM memes WHERE present = 1 GROUP BY media_type ORDER BY media_type
+        ''').fetchall()
+        top_tags = self.conn.execute('''
+            SELECT t.tag, COUNT(*) FROM meme_tags t JOIN memes m ON m.id = t.meme_id
+            WHERE m.present = 1 GROUP BY t.tag ORDER BY COUNT(*) DESC, t.tag LIMIT 10
+        ''').fetchall()
+        top_memes = self.conn.execute('''
+            SELECT filename, times_won, times_dealt FROM memes
+            WHERE present = 1 AND times_won > 0 ORDER BY times_won DESC LIMIT 10
+        ''').fetchall()
+        return by_type, top_tags, top_memes
+
+
+def log_stats(index):
+    by_type, top_tags, top_memes = index.stats()
+    for media_type, total, enabled, size, dealt, won, unprobed in by_type:
+        logger.info("📊 %s: %s мемов (включено %s), %.1fМБ, раздач %s, побед %s, без метаданных %s",
+                    media_type, total, enabled, size / 1024 / 1024, dealt, won, unprobed)
+    if top_tags:
+        logger.info("🏷 Теги: %s", ", ".join(f"{tag} ({count})" for tag, count in top_tags))
+    for filename, won, dealt in top_memes:
+        logger.info("🏆 %s: побед %s из %s раздач", filename, won, dealt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='импорт папки с мемами и чтение метаданных')
+    import_parser.add_argument('--force', action='store_true', help='сканировать, даже если mtime папки не менялся')
+    for name, help_text in (('tag', 'добавить теги мему'), ('untag', 'снять теги с мема')):
+        tag_parser = commands.add_parser(name, help=help_text)
+        tag_parser.add_argument('filename')
+        tag_parser.add_argument('tags', nargs='+')
+    for name, help_text in (('disable', 'не раздавать мемы'), ('enable', 'снова раздавать мемы')):
+        commands.add_parser(name, help=help_text).add_argument('filenames', nargs='+')
+    commands.add_parser('stats', help='сводка по библиотеке')
+    args = parser.parse_args()
+
+    from log_setup import setup_logging
+    from meme_catalog import MemeCatalog
+    setup_logging()
+    index = MemeIndex()
+    try:
+        if args.command == 'import':
+            catalog = MemeCatalog(Config.MEMES_DIR, index, legacy_manifest=Config.MEMES_MANIFEST_FILE)
+            if args.force:
+                catalog.refresh(force=True)
+            index.probe(Config.MEMES_DIR)
+            log_stats(index)
+        elif args.command in ('tag', 'untag'):
+            change = index.add_tags if args.command == 'tag' else index.remove_tags
+            if not change(args.filename, args.tags):
+                logger.error("❌ Мем не найден в индексе: %s", args.filename)
+        elif args.command in ('disable', 'enable'):
+            updated = index.set_enabled(args.filenames, args.command == 'enable')
+            logger.info("✅ Мемов изменено: %s из %s", updated, len(args.filenames))
+        else:
+            log_stats(index)
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
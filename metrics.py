@@ -0,0 +1,236 @@
+import bisect
+import functools
+import logging
+import time
+import tornado.web
+from telegram.request import BaseRequest
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунд (как у клиента Prometheus по умолчанию)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'labelnames', 'values')
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}  # значения меток -> число
+
+    def inc(self, *labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """
+    Гистограмма задержек: на наблюдение - bisect и два сложения, без блокировок.
+    Счетчики корзин хранятся без накопления, накопленные считаются при выдаче.
+    """
+    __slots__ = ('name', 'help', 'labelnames', 'buckets', 'series')
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.series = {}  # значения меток -> [счетчики корзин..., сумма]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.series.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                total += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {total}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {total}"
+
+
+class Collected:
+    """Значение, которое считается в момент запроса метрик: число или {значения меток: число}"""
+    __slots__ = ('name', 'help', 'labelnames', 'kind', 'collect')
+
+    def __init__(self, name, help, collect, kind='gauge', labelnames=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.kind = kind
+        self.labelnames = labelnames
+
+    def samples(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(number)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # имя -> метрика, в порядке регистрации
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def collected(self, name, help, collect, kind='gauge', labelnames=()):
+        """Повторная регистрация с тем же именем заменяет функцию (новый экземпляр бота)"""
+        return self._add(Collected(name, help, collect, kind, labelnames))
+
+    def render(self):
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error("❌ Ошибка сбора метрики %s: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CALLBACK_SECONDS = REGISTRY.histogram(
+    'memes_callback_seconds', 'Время обработки нажатия кнопки', ('action',))
+CALLBACK_ERRORS = REGISTRY.counter(
+    'memes_callback_errors_total', 'Нажатия кнопок, завершившиеся ошибкой', ('action', 'error'))
+API_SECONDS = REGISTRY.histogram(
+    'telegram_api_request_seconds', 'Время запроса к Bot API (без ожидания в ограничителе)', ('method',))
+API_RESPONSES = REGISTRY.counter(
+    'telegram_api_responses_total', 'Ответы Bot API по кодам HTTP', ('method', 'code'))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    'telegram_rate_limit_wait_seconds', 'Ожидание токена в ограничителе запросов по приоритетам', ('priority',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+DB_SECONDS = REGISTRY.histogram(
+    'memes_db_call_seconds', 'Время вызова базы в потоке БД, включая ожидание потока', ('method',))
+FILE_MANAGER_SECONDS = REGISTRY.histogram(
+    'memes_file_manager_call_seconds', 'Время вызова FileManager', ('method',))
+MEDIA_SOURCES = REGISTRY.counter(
+    'memes_media_sent_total', 'Отправленные мемы: по file_id или загрузкой файла', ('source',))
+MEDIA_READ_SECONDS = REGISTRY.histogram(
+    'memes_media_read_seconds', 'Чтение файла мема с диска для загрузки в Telegram')
+QUICKPLAY_WAIT_SECONDS = REGISTRY.histogram(
+    'memes_quickplay_wait_seconds', 'Ожидание в очереди быстрой игры до начала игры',
+    buckets=(1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0))
+
+
+def timed(histogram):
+    """Декоратор синхронного метода: время вызова в histogram с меткой-именем метода"""
+    def decorator(method):
+        name = method.__name__
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+def async_timed(histogram):
+    """То же для корутины: время до завершения, включая ожидание потока БД и пула"""
+    def decorator(method):
+        name = method.__name__
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+class InstrumentedRequest(BaseRequest):
+    """
+    Обертка над запросом к Bot API: время и код ответа по каждому методу.
+    Стоит под ограничителем запросов, поэтому ожидание токена сюда не входит.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    @property
+    def read_timeout(self):
+        return self.wrapped.read_timeout
+
+    async def initialize(self):
+        await self.wrapped.initialize()
+
+    async def shutdown(self):
+        await self.wrapped.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        code = 'error'
+        try:
+            code, payload = await self.wrapped.do_request(url, method, request_data, **timeouts)
+            return code, payload
+        finally:
+            # getUpdates - long polling, его время - ожидание апдейтов, а не задержка API
+            if endpoint != 'getUpdates':
+                API_SECONDS.observe(time.perf_counter() - started, endpoint)
+            API_RESPONSES.inc(endpoint, str(code))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(REGISTRY.render())
+
+
+def serve(port=None, address=None):
+    """HTTP-сервер /metrics в текущем event loop; возвращает сервер для stop()"""
+    port = Config.METRICS_PORT if port is None else port
+    address = Config.METRICS_LISTEN if address is None else address
+    server = tornado.web.Application([(r"/metrics", MetricsHandler)]).listen(port, address=address)
+    logger.info("✅ Метрики: http://%s:%s/metrics", address, port)
+    return server
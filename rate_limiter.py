@@ -0,0 +1,214 @@
+"""
+Ограничитель исходящих запросов к Bot API.
+
+Подключается к Application через builder.rate_limiter(): через него проходят все
+вызовы context.bot, поэтому обработчикам не нужно думать о лимитах Telegram.
+- Токен-бакет на чат (личные чаты ~1 сообщение в секунду, группы ~20 в минуту)
+  и общий бакет (~30 запросов в секунду).
+- Общий бакет раздает токены по приоритету: ответы на нажатия кнопок и правки
+  сообщений раньше рассылок, фоновая предзагрузка мемов - в последнюю очередь.
+- RetryAfter от Telegram ставит на паузу чат (или всех, если чат неизвестен)
+  и повторяет запрос сам.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import Config
+from metrics import RATE_LIMIT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BACKGROUND: 'background'}
+
+# Ответ на нажатие кнопки и правка сообщения с кнопками - то, чего пользователь ждет прямо сейчас
+INTERACTIVE_ENDPOINTS = frozenset({
+    'answerCallbackQuery', 'editMessageText', 'editMessageReplyMarkup',
+    'editMessageCaption', 'deleteMessage',
+})
+
+# Запросы без лимитов Telegram на отправку сообщений
+UNLIMITED_ENDPOINTS = frozenset({'getUpdates', 'getMe', 'setWebhook', 'deleteWebhook', 'getWebhookInfo'})
+
+
+class TokenBucket:
+    """
+    Бакет с резервированием: reserve() сразу забирает токен (баланс может уйти в минус)
+    и возвращает, сколько ждать. Так ожидающие в одном чате идут строго по очереди.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self):
+        """Сколько ждать до свободного токена, ничего не забирая"""
+        now = time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        # Бакет пуст на seconds секунд вперед
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class RateLimiter(BaseRateLimiter):
+    def __init__(self):
+        self.global_bucket = TokenBucket(Config.RATE_LIMIT_GLOBAL, Config.RATE_LIMIT_GLOBAL)
+        self.chat_buckets = {}  # chat_id -> TokenBucket
+        self._waiters = []  # (приоритет, порядковый номер, future) за токеном общего бакета
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump = None
+        # Метрики
+        self.requests = 0
+        self.retries = 0
+        self.wait_total = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.wait_max = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.wait_count = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    async def initialize(self):
+        if self._pump is None:
+            self._pump = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+            logger.info("⏱ Исходящие запросы: %s, повторов после RetryAfter: %s", self.requests, self.retries)
+            for name, count in self.wait_count.items():
+                if count:
+                    logger.info("⏱ Ожидание токена (%s): среднее %.2fс, макс %.2fс",
+                                name, self.wait_total[name] / count, self.wait_max[name])
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= Config.RATE_LIMIT_MAX_CHATS:
+                # Полные бакеты ничего не ограничивают - их можно забыть
+                self.chat_buckets = {cid: b for cid, b in self.chat_buckets.items() if not b.is_full()}
+            if chat_id < 0:
+                bucket = TokenBucket(Config.RATE_LIMIT_GROUP_PER_MINUTE / 60, Config.RATE_LIMIT_GROUP_BURST)
+            else:
+                bucket = TokenBucket(Config.RATE_LIMIT_PRIVATE, Config.RATE_LIMIT_PRIVATE_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _run(self):
+        # Раздача токенов общего бакета ожидающим в порядке приоритета
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)  # отмененные запросы
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.global_bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self.global_bucket.take()
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire_global(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    @staticmethod
+    def _priority(endpoint, rate_limit_args):
+        if isinstance(rate_limit_args, int):
+            return rate_limit_args
+        if isinstance(rate_limit_args, dict) and 'priority' in rate_limit_args:
+            return rate_limit_args['priority']
+        return INTERACTIVE if endpoint in INTERACTIVE_ENDPOINTS else NORMAL
+
+    async def _acquire(self, chat_id, priority):
+        started = time.monotonic()
+        if isinstance(chat_id, int):
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await self._acquire_global(priority)
+
+        name = PRIORITY_NAMES.get(priority, 'normal')
+        waited = time.monotonic() - started
+        self.wait_total[name] += waited
+        self.wait_count[name] += 1
+        if waited > self.wait_max[name]:
+            self.wait_max[name] = waited
+        RATE_LIMIT_WAIT_SECONDS.observe(waited, name)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        priority = self._priority(endpoint, rate_limit_args)
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            self.requests += 1
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                self.retries += 1
+                if attempt > Config.RATE_LIMIT_MAX_RETRIES:
+                    raise
+                logger.warning("⏱ RetryAfter %sс для %s (чат %s), повтор %s", e.retry_after, endpoint, chat_id, attempt)
+                if isinstance(chat_id, int):
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    self.global_bucket.pause(e.retry_after)
+
+    def metrics(self):
+        """Глубина очереди по приоритетам и время ожидания токена"""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES.get(priority, 'normal')] += 1
+        return {
+            'queue_depth': depth,
+            'requests': self.requests,
+            'retries': self.retries,
+            'wait_avg': {name: self.wait_total[name] / count if count else 0.0
+                         for name, count in self.wait_count.items()},
+            'wait_max': dict(self.wait_max),
+            'chats': len(self.chat_buckets),
+        }
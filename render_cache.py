@@ -0,0 +1,35 @@
+from collections import OrderedDict
+from config import Config
+
+
+class RenderCache:
+    """
+    Готовые клавиатуры и тексты сообщений. InlineKeyboardMarkup неизменяем,
+    поэтому один объект отдается всем, кто отрисовывает то же состояние:
+    кнопки выбора мема собираются один раз на раунд, а не для каждого игрока.
+
+    Ключ включает chat_id и nonce раунда, поэтому смена фазы дает новый ключ,
+    а записи прошлых раундов вытесняются по LRU без явной очистки.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or Config.RENDER_CACHE_SIZE
+        self._items = OrderedDict()  # ключ -> готовая клавиатура или текст
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Готовое значение по ключу; при промахе build() вызывается один раз"""
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        value = self._items[key] = build()
+        self.misses += 1
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from game_state import dump_game, load_game
+from worker_router import routing_key, worker_for_chat
+
+logger = logging.getLogger(__name__)
+
+
+class StateConflict(Exception):
+    """Игру успел изменить другой обработчик или воркер: состояние нужно перечитать"""
+
+
+class MemoryStateStore:
+    """
+    Игры в памяти процесса (один воркер на токен). Снимки пишутся в базу
+    пакетами только для восстановления после перезапуска.
+    """
+    shared = False
+
+    def __init__(self, db):
+        self.db = db
+        self.games = {}
+
+    def restore(self):
+        """Загрузка снимков незавершенных игр при старте"""
+        started = time.perf_counter()
+        for chat_id, state in self.db.sync.load_game_snapshots():
+            try:
+                self.games[chat_id] = load_game(state)
+            except Exception as e:
+                logger.error("❌ Ошибка восстановления игры %s: %s", chat_id, e)
+        if self.games:
+            logger.info("♻️ Восстановлено игр: %s за %.2fс", len(self.games), time.perf_counter() - started)
+
+    def local_games(self):
+        return self.games
+
+    async def get(self, chat_id):
+        return self.games.get(chat_id)
+
+    async def create(self, chat_id, game):
+        self.games[chat_id] = game
+        await self.db.save_game_snapshot(chat_id, dump_game(game))
+
+    async def save(self, chat_id, game):
+        # Одна копия игры на процесс: конфликтов не бывает, только снимок
+        self.games[chat_id] = game
+        await self.db.save_game_snapshot(chat_id, dump_game(game))
+
+    async def delete(self, chat_id):
+        self.games.pop(chat_id, None)
+        await self.db.delete_game_snapshot(chat_id)
+
+    async def close(self):
+        pass
+
+
+def owned_by_worker(chat_id, worker_index=None, worker_count=None):
+    """Игру обслуживает этот воркер: роутер отдает ему ее апдейты"""
+    worker_index = Config.WORKER_INDEX if worker_index is None else worker_index
+    worker_count = worker_count or Config.WORKER_COUNT
+    return worker_for_chat(routing_key(chat_id), worker_count) == worker_index
+
+
+class SQLiteStateStore:
+    """
+    Общее хранилище игр для нескольких воркеров. Каждая игра хранится с версией,
+    сохранение - атомарный compare-and-set по версии: если игру уже изменил
+    другой воркер, save() бросает StateConflict.
+    Локально роль общего хранилища играет отдельный SQLite-файл.
+
+    Воркер помнит последнее известное состояние своих игр (local_games): по нему
+    после перезапуска взводятся дедлайны и продолжаются игры, считаются метрики.
+    Источник истины - по-прежнему общее хранилище, get() всегда читает его.
+    """
+    shared = True
+
+    def __init__(self, path, worker_index=None, worker_count=None):
+        self.worker_index = Config.WORKER_INDEX if worker_index is None else worker_index
+        self.worker_count = worker_count or Config.WORKER_COUNT
+        self.games = {}  # chat_id -> игра этого воркера
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS shared_games (
+                chat_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated_at REAL
+            )
+        ''')
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, method, *args)
+
+    def _owned(self, chat_id):
+        return owned_by_worker(chat_id, self.worker_index, self.worker_count)
+
+    def restore(self):
+        """Игры этого воркера из общего хранилища: их нужно продолжить после перезапуска"""
+        started = time.perf_counter()
+        for chat_id, version, state in self.conn.execute('SELECT chat_id, version, state FROM shared_games'):
+            if not self._owned(chat_id):
+                continue
+            try:
+                game = load_game(state)
+            except Exception as e:
+                logger.error("❌ Ошибка восстановления игры %s: %s", chat_id, e)
+                continue
+            game.version = version
+            self.games[chat_id] = game
+        if self.games:
+            logger.info("♻️ Восстановлено игр воркера %s: %s за %.2fс", self.worker_index, len(self.games),
+                        time.perf_counter() - started)
+
+    def local_games(self):
+        return self.games
+
+    def _remember(self, chat_id, game):
+        if self._owned(chat_id):
+            self.games[chat_id] = game
+
+    def _get(self, chat_id):
+        return self.conn.execute(
+            'SELECT version, state FROM shared_games WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+
+    def _put(self, chat_id, state):
+        self.conn.execute('''
+            INSERT OR REPLACE INTO shared_games (chat_id, version, state, updated_at)
+            VALUES (?, 1, ?, ?)
+        ''', (chat_id, state, time.time()))
+
+    def _compare_and_set(self, chat_id, expected_version, state):
+        cursor = self.conn.execute('''
+            UPDATE shared_games SET version = version + 1, state = ?, updated_at = ?
+            WHERE chat_id = ? AND version = ?
+        ''', (state, time.time(), chat_id, expected_version))
+        return cursor.rowcount == 1
+
+    def _delete(self, chat_id):
+        self.conn.execute('DELETE FROM shared_games WHERE chat_id = ?', (chat_id,))
+
+    async def get(self, chat_id):
+        row = await self._run(self._get, chat_id)
+        if row is None:
+            self.games.pop(chat_id, None)
+            return None
+        game = load_game(row[1])
+        game.version = row[0]
+        self._remember(chat_id, game)
+        return game
+
+    async def create(self, chat_id, game):
+        # Новая игра в чате заменяет старую
+        game.version = 1
+        await self._run(self._put, chat_id, dump_game(game))
+        self._remember(chat_id, game)
+
+    async def save(self, chat_id, game):
+        expected_version = game.version
+        if not await self._run(self._compare_and_set, chat_id, expected_version, dump_game(game)):
+            raise StateConflict(f"игра {chat_id} изменена другим воркером")
+        game.version = expected_version + 1
+        self._remember(chat_id, game)
+
+    async def delete(self, chat_id):
+        await self._run(self._delete, chat_id)
+        self.games.pop(chat_id, None)
+
+    async def close(self):
+        await self._run(self.conn.close)
+        self._executor.shutdown(wait=True)
+
+
+def create_state_store(db):
+    if Config.STATE_BACKEND == 'sqlite':
+        return SQLiteStateStore(Config.SHARED_STATE_PATH)
+    return MemoryStateStore(db)
@@ -0,0 +1,214 @@
+"""
+Лист голосования: все мемы раунда одной пронумерованной картинкой.
+
+Вместо медиагруппы и отдельного сообщения с кнопками ведущий получает одно фото
+с клавиатурой. Для видео берется кадр-постер (через ffmpeg, если он есть,
+иначе - плашка с номером). Готовые листы кэшируются по хэшу ключей мемов
+(имя, размер, mtime): в памяти - описание листа, на диске - файл, а Telegram
+file_id листа запоминает MediaCache. На диске хранится не больше
+VOTING_SHEET_DISK_LIMIT листов: давно не нужные удаляются, и их file_id
+тоже забываются (take_evicted).
+"""
+import hashlib
+import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+from config import Config
+from media_cache import MediaCache, is_video
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND = (24, 24, 24)
+PLACEHOLDER = (60, 60, 60)
+BADGE = (255, 196, 0)
+GAP = 8
+
+# Имя файла листа и ключ MediaCache для него: sheet_<sha1>.jpg:<размер>:<mtime>
+SHEET_FILE = re.compile(r'sheet_([0-9a-f]{40})\.jpg')
+
+
+def _load_font(size):
+    try:
+        return ImageFont.truetype('DejaVuSans-Bold.ttf', size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _video_poster(path, ffmpeg):
+    """Кадр из начала видео или None"""
+    if not ffmpeg:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-v', 'error', '-ss', '0.5', '-i', path, '-frames:v', '1',
+             '-f', 'image2pipe', '-vcodec', 'png', 'pipe:1'],
+            check=True, capture_output=True, timeout=30
+        )
+        return Image.open(BytesIO(result.stdout))
+    except Exception as e:
+        logger.error("❌ Ошибка получения постера %s: %s", path, e)
+        return None
+
+
+class VotingSheetRenderer:
+    def __init__(self, cache_dir, tile=None, cache_size=None, disk_limit=None):
+        self.cache_dir = cache_dir
+        self.tile = tile or Config.VOTING_SHEET_TILE
+        self.cache_size = cache_size or Config.VOTING_SHEET_CACHE_SIZE
+        self.disk_limit = disk_limit or Config.VOTING_SHEET_DISK_LIMIT
+        self._sheets = OrderedDict()  # хэш листа -> описание листа для MediaCache
+        self._files = OrderedDict()   # хэш листа -> файл на диске, недавние последними
+        self._evicted = []            # ключи MediaCache удаленных листов
+        self._lock = threading.Lock()  # листы рисуются в потоках пула
+        self._posters = {}  # ключ мема -> файл постера (только для видео)
+        self._font = _load_font(self.tile // 6)
+        self._ffmpeg = shutil.which('ffmpeg')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_files()
+
+    def _load_files(self):
+        # Листы прошлых запусков: порядок вытеснения - по времени создания
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                match = SHEET_FILE.fullmatch(entry.name)
+                if match:
+                    files.append((entry.stat().st_mtime, match.group(1), entry.path))
+        for _, digest, path in sorted(files):
+            self._files[digest] = path
+        self._trim_files()
+
+    def _trim_files(self):
+        while len(self._files) > self.disk_limit:
+            digest, path = self._files.popitem(last=False)
+            self._sheets.pop(digest, None)
+            try:
+                key = MediaCache.cache_key({'filename': os.path.basename(path), 'path': path})
+                os.remove(path)
+            except OSError as e:
+                logger.error("❌ Ошибка удаления листа голосования %s: %s", path, e)
+                continue
+            self._evicted.append(key)
+
+    def take_evicted(self):
+        """Ключи MediaCache листов, удаленных с диска: их file_id больше не нужны"""
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        return evicted
+
+    def stale_keys(self, keys):
+        """Ключи MediaCache листов, которых уже нет на диске (из прошлых запусков)"""
+        stale = []
+        for key in keys:
+            match = SHEET_FILE.match(key)
+            if match and key[match.end()] == ':' and match.group(1) not in self._files:
+                stale.append(key)
+        return stale
+
+    def _poster_path(self, meme):
+        # Постеры видео тоже живут на диске: повторный запуск ffmpeg не нужен
+        key = MediaCache.cache_key(meme)
+        path = self._posters.get(key)
+        if path is None:
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            path = os.path.join(self.cache_dir, f"poster_{digest}.jpg")
+            if not os.path.exists(path):
+                poster = _video_poster(meme['path'], self._ffmpeg)
+                if poster is None:
+                    return None
+                poster.convert('RGB').save(path, 'JPEG', quality=85)
+            self._posters[key] = path
+        return path
+
+    def _thumbnail(self, meme):
+        """Картинка мема, вписанная в квадрат tile, или None для заглушки/видео без постера"""
+        if meme['path'] == 'stub':
+            return None
+        path = self._poster_path(meme) if is_video(meme) else meme['path']
+        if path is None:
+            return None
+        try:
+            with Image.open(path) as image:
+                # draft ускоряет декодирование больших JPEG сразу в уменьшенном размере
+                image.draft('RGB', (self.tile, self.tile))
+                image = image.convert('RGB')
+                image.thumbnail((self.tile, self.tile), Image.LANCZOS)
+                return image
+        except Exception as e:
+            logger.error("❌ Ошибка чтения мема %s для листа: %s", meme['filename'], e)
+            return None
+
+    def _draw_tile(self, sheet, draw, number, meme, x, y):
+        image = self._thumbnail(meme)
+        if image is None:
+            draw.rectangle([x, y, x + self.tile - 1, y + self.tile - 1], fill=PLACEHOLDER)
+            if is_video(meme) and meme['path'] != 'stub':
+                # Значок воспроизведения вместо кадра
+                cx, cy, r = x + self.tile // 2, y + self.tile // 2, self.tile // 6
+                draw.polygon([(cx - r, cy - r), (cx - r, cy + r), (cx + r, cy)], fill=(200, 200, 200))
+        else:
+            sheet.paste(image, (x + (self.tile - image.width) // 2, y + (self.tile - image.height) // 2))
+
+        # Номер варианта совпадает с номером кнопки голосования
+        size = self.tile // 4
+        draw.rectangle([x, y, x + size, y + size], fill=BADGE)
+        draw.text((x + size // 2, y + size // 2), str(number), fill=(0, 0, 0), font=self._font, anchor='mm')
+
+    def _render(self, memes, path):
+        columns = math.ceil(math.sqrt(len(memes)))
+        rows = math.ceil(len(memes) / columns)
+        step = self.tile + GAP
+        sheet = Image.new('RGB', (columns * step + GAP, rows * step + GAP), BACKGROUND)
+        draw = ImageDraw.Draw(sheet)
+        for i, meme in enumerate(memes):
+            row, column = divmod(i, columns)
+            self._draw_tile(sheet, draw, i + 1, meme, GAP + column * step, GAP + row * step)
+
+        tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        sheet.save(tmp_file, 'JPEG', quality=85, optimize=True)
+        os.replace(tmp_file, path)
+
+    def render(self, memes):
+        """
+        Лист для мемов (в порядке кнопок голосования), memes - записи из
+        FileManager.get_meme. Возвращает описание фото для MediaCache.send.
+        Синхронный и нагружает CPU: вызывать через run_in_executor.
+        """
+        # Ключ учитывает содержимое мемов: замена файла дает новый лист
+        digest = hashlib.sha1('|'.join(
+            MediaCache.cache_key(meme) if meme['path'] != 'stub' else 'stub' for meme in memes
+        ).encode('utf-8')).hexdigest()
+        with self._lock:
+            sheet = self._sheets.get(digest)
+            if sheet is not None:
+                self._sheets.move_to_end(digest)
+                self._files.move_to_end(digest)
+                return sheet
+
+        path = os.path.join(self.cache_dir, f"sheet_{digest}.jpg")
+        if not os.path.exists(path):
+            self._render(memes, path)
+
+        stat = os.stat(path)
+        sheet = {
+            'filename': os.path.basename(path),
+            'path': path,
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'media_type': 'photo',
+        }
+        with self._lock:
+            self._sheets[digest] = sheet
+            if len(self._sheets) > self.cache_size:
+                self._sheets.popitem(last=False)
+            self._files[digest] = path
+            self._files.move_to_end(digest)
+            self._trim_files()
+        return sheet
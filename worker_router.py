@@ -0,0 +1,131 @@
+import asyncio
+import hmac
+import json
+import logging
+import httpx
+import tornado.web
+import callback_codec
+from callback_codec import InvalidCallback
+from config import Config
+from matchmaking import POOL_CHAT_ID, is_quick_chat
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def worker_for_chat(chat_id, worker_count):
+    """Номер воркера, который обслуживает чат (для отрицательных id тоже неотрицательный)"""
+    return chat_id % worker_count
+
+
+def routing_key(chat_id):
+    """Ключ роутинга игры: быстрые игры живут на воркере очереди (POOL_CHAT_ID)"""
+    return POOL_CHAT_ID if is_quick_chat(chat_id) else chat_id
+
+
+def _join_chat_id(text):
+    # /join 123, /join@bot 123 или /join_123
+    command, _, args = text.partition(' ')
+    candidate = args.split()[0] if args.split() else command.split('@')[0][len('/join_'):]
+    try:
+        return int(candidate)
+    except ValueError:
+        return None
+
+
+def chat_id_for_update(update):
+    """
+    Чат игры, к которой относится апдейт. Все апдейты одной игры (включая
+    выбор мемов и голосование в ЛС) должны попасть на один воркер.
+    Очередь быстрой игры и собранные из нее игры - на воркер POOL_CHAT_ID.
+    """
+    callback = update.get('callback_query')
+    if callback:
+        # Кнопки игры несут ее чат (нажимаются в том числе в ЛС игроков)
+        try:
+            data = callback_codec.decode(callback.get('data') or '')
+            if data.action in callback_codec.GAME_ACTIONS:
+                return routing_key(data.chat_id)
+            if data.action in callback_codec.QUICKPLAY_ACTIONS:
+                return POOL_CHAT_ID
+        except InvalidCallback:
+            pass
+        message = callback.get('message') or {}
+        return message.get('chat', {}).get('id', callback['from']['id'])
+
+    message = update.get('message') or update.get('edited_message')
+    if message:
+        text = message.get('text') or ''
+        if text.startswith('/join'):
+            chat_id = _join_chat_id(text)
+            if chat_id is not None:
+                return routing_key(chat_id)
+        if text.startswith('/quickplay'):
+            return POOL_CHAT_ID
+        return message['chat']['id']
+    return 0
+
+
+class RouterHandler(tornado.web.RequestHandler):
+    def initialize(self, router):
+        self.router = router
+
+    async def post(self):
+        if not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ''), self.router.secret):
+            self.set_status(403)
+            return
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        self.set_status(await self.router.forward(update, self.request.body))
+
+
+class WorkerRouter:
+    """
+    Принимает webhook Telegram и пересылает апдейт воркеру, который обслуживает
+    чат игры. Ответ воркера возвращается Telegram: при ошибке апдейт будет
+    доставлен повторно.
+    """
+
+    def __init__(self, worker_urls, secret):
+        if not worker_urls:
+            raise ValueError("WORKER_URLS не задан")
+        # Без секрета роутер и воркеры приняли бы поддельные апдейты от кого угодно
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET не задан")
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.client = httpx.AsyncClient(timeout=Config.DEAL_TIMEOUT)
+
+    def worker_url(self, update):
+        return self.worker_urls[worker_for_chat(chat_id_for_update(update), len(self.worker_urls))]
+
+    async def forward(self, update, body):
+        headers = {'Content-Type': 'application/json', SECRET_HEADER: self.secret}
+        url = self.worker_url(update)
+        try:
+            response = await self.client.post(url, content=body, headers=headers)
+            return response.status_code
+        except httpx.HTTPError as e:
+            logger.error("❌ Воркер %s недоступен: %s", url, e)
+            return 502
+
+    def make_app(self, path):
+        return tornado.web.Application([(rf"/{path}/?", RouterHandler, {'router': self})])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def run_router():
+    router = WorkerRouter(Config.WORKER_URLS, Config.WEBHOOK_SECRET)
+    server = router.make_app(Config.WEBHOOK_PATH).listen(Config.PORT, address=Config.WEBHOOK_LISTEN)
+    logger.info("✅ Роутер слушает порт %s, воркеров: %s", Config.PORT, len(router.worker_urls))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        await router.close()